@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from threading import Lock
+from utils import log_utils, metrics
+import numpy as np
+import hashlib
+import sqlite3
+import json
+
+cache_hits = metrics.counter("analyzer_cache_hits_total", "analysis results served from the cache", ("tier",))
+cache_misses = metrics.counter("analyzer_cache_misses_total", "texts not found in any tier of the cache")
+cache_evictions = metrics.counter("analyzer_cache_evictions_total", "entries evicted from the cache", ("tier",))
+cache_entries = metrics.gauge("analyzer_cache_entries", "entries in the in-process tier of the cache")
+
+
+class AnalysisCache:
+  """
+  Caches the predicted labels and the embeddings of texts, keyed by a hash of the text and the model versions.
+  The in-process tier is an LRU of 'max_entries', the optional on-disk tier is an sqlite database at 'disk_path'
+  which survives restarts, holding at most 'max_disk_entries'.
+  """
+
+  def __init__(self, max_entries: int = 10000, disk_path: str | None = None, max_disk_entries: int = 1000000):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.max_entries = max_entries
+    self.max_disk_entries = max_disk_entries
+    self.__entries: OrderedDict[str, tuple[tuple[str, ...], np.ndarray]] = OrderedDict()
+
+    # the cache is used by the batcher and the pipeline threads
+    self.__lock = Lock()
+
+    self.__db = None
+    if disk_path is not None:
+      self.log.info(f"using on-disk analysis cache at {disk_path}")
+      self.__db = sqlite3.connect(disk_path, check_same_thread=False)
+      self.__db.execute("CREATE TABLE IF NOT EXISTS analysis (key TEXT PRIMARY KEY, labels TEXT, embeddings BLOB)")
+      self.__db.commit()
+
+  @staticmethod
+  def make_key(text: str, model_version: str) -> str:
+    return hashlib.sha256(f"{model_version}\0{text}".encode()).hexdigest()
+
+  def get_many(self, keys: list[str]) -> dict[str, tuple[tuple[str, ...], np.ndarray]]:
+    """Look up the keys in the in-process tier, then in the on-disk tier, return the found entries."""
+
+    found = {}
+    with self.__lock:
+      for key in keys:
+        entry = self.__entries.get(key)
+        if entry is not None:
+          self.__entries.move_to_end(key)
+          found[key] = entry
+    cache_hits.inc(len(found), tier="memory")
+
+    missing = [key for key in dict.fromkeys(keys) if key not in found]
+    if self.__db is not None and len(missing) > 0:
+      from_disk = self.__get_from_disk(missing)
+      cache_hits.inc(len(from_disk), tier="disk")
+      # promote to the in-process tier
+      self.__put_in_memory(from_disk)
+      found |= from_disk
+
+    cache_misses.inc(len([key for key in dict.fromkeys(keys) if key not in found]))
+    return found
+
+  def put_many(self, entries: dict[str, tuple[tuple[str, ...], np.ndarray]]) -> None:
+    self.__put_in_memory(entries)
+    if self.__db is not None:
+      self.__put_on_disk(entries)
+
+  def __put_in_memory(self, entries: dict[str, tuple[tuple[str, ...], np.ndarray]]) -> None:
+    evicted = 0
+    with self.__lock:
+      for key, entry in entries.items():
+        self.__entries[key] = entry
+        self.__entries.move_to_end(key)
+      while len(self.__entries) > self.max_entries:
+        self.__entries.popitem(last=False)
+        evicted += 1
+      cache_entries.set(len(self.__entries))
+    cache_evictions.inc(evicted, tier="memory")
+
+  def __get_from_disk(self, keys: list[str]) -> dict[str, tuple[tuple[str, ...], np.ndarray]]:
+    found = {}
+    with self.__lock:
+      # stay below the sqlite limit of host parameters
+      for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        rows = self.__db.execute(
+          f"SELECT key, labels, embeddings FROM analysis WHERE key IN ({','.join('?' * len(chunk))})",
+          chunk,
+        ).fetchall()
+        for key, labels, embeddings in rows:
+          found[key] = (tuple(json.loads(labels)), np.frombuffer(embeddings, dtype=np.float32))
+    return found
+
+  def __put_on_disk(self, entries: dict[str, tuple[tuple[str, ...], np.ndarray]]) -> None:
+    rows = [
+      (key, json.dumps(list(labels)), np.asarray(embeddings, dtype=np.float32).tobytes())
+      for key, (labels, embeddings) in entries.items()
+    ]
+    with self.__lock:
+      self.__db.executemany("INSERT OR REPLACE INTO analysis (key, labels, embeddings) VALUES (?, ?, ?)", rows)
+
+      # drop the oldest rows above the limit
+      deleted = self.__db.execute(
+        "DELETE FROM analysis WHERE rowid <= (SELECT MAX(rowid) FROM analysis) - ?",
+        (self.max_disk_entries,),
+      ).rowcount
+      self.__db.commit()
+    if deleted > 0:
+      cache_evictions.inc(deleted, tier="disk")
@@ -1,32 +1,92 @@
-from utils import log_utils
+from utils import log_utils, metrics
 from repository.analyzer import AnalyzerRepository
 from .classifier import CategoryClassifier
 from .embeddings import EmbeddingsModel
+from .inference_pool import InferenceWorkerPool
+from .analysis_cache import AnalysisCache
+from .article_deduplicator import ArticleDeduplicator
+from .known_categories import KnownCategories
 from domain import ScrapedArticle, ScrapedArticleMetadata, Article, Category
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import numpy as np
+import time
 import hashlib
 
+stage_seconds = metrics.histogram(
+  "analyzer_stage_seconds",
+  "time spent on a batch by each stage of the analysis, 'map', 'deduplicate', 'classify', 'embed', "
+  "'inference' in the worker pool, 'store_categories' and 'store_articles'",
+  ("stage",),
+  # mapping and deduplicating a batch take well under a millisecond
+  buckets=(0.0001, 0.00025, 0.0005, *metrics.DEFAULT_BUCKETS),
+)
+
 
 class Analyzer:
 
   def __init__(
     self, 
     repository: AnalyzerRepository,
-    category_classifier: CategoryClassifier,
-    embeddings_model: EmbeddingsModel,
+    category_classifier: CategoryClassifier | None,
+    embeddings_model: EmbeddingsModel | None,
+    inference_pool: InferenceWorkerPool | None = None,
+    cache: AnalysisCache | None = None,
+    deduplicator: ArticleDeduplicator | None = None,
+    concurrent_inference: bool = False,
+    known_categories: KnownCategories | None = None,
   ):
     self.log = log_utils.create_console_logger(__class__.__name__)
     self.repository = repository
     self.category_classifier = category_classifier
     self.embeddings_model = embeddings_model
+
+    # if set, the models are run in the worker processes of the pool instead
+    self.inference_pool = inference_pool
+
+    # if set, only the texts which are not in the cache are analyzed
+    self.cache = cache
+
+    # if set, the articles already stored with the current models are skipped
+    self.deduplicator = deduplicator
+
+    # if set, only the categories which are not known to be stored are written
+    self.known_categories = known_categories
+
+    # if set, the classification runs in this executor while the embeddings are created
+    self.classifier_executor = None
+    if concurrent_inference:
+      self.classifier_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="classifier")
+
+  @property
+  def model_version(self) -> str:
+    """Identifies the models used for the analysis."""
+    if self.inference_pool is not None:
+      return f"{self.inference_pool.category_classifier_version}|{self.inference_pool.embeddings_model_version}"
+    return f"{self.category_classifier.version}|{self.embeddings_model.version}"
   
 
   def process(self, docs: list[dict]) -> list[str]:
 
+    try: 
+      analyzed = self.analyze(docs)
+      if analyzed is None:
+        return []
+
+      return self.store(analyzed)
+
+    except Exception:
+      # the batcher doesn't ack the messages of a failed batch, they stay pending
+      self.log.exception(f"error trying to analyze batch of {len(docs)} docs")
+      raise
+
+  def analyze(self, docs: list[dict]) -> tuple[dict[str, Category], list[Article]] | None:
+    """Run the inference part of 'process', returns None if there is nothing to store."""
+
     scraped_articles = []
     prepared_texts = []
 
-    try: 
+    with stage_seconds.time(stage="map"):
       for doc in docs:
 
         scraped_article = self.__map_to_article(doc)
@@ -35,30 +95,63 @@ class Analyzer:
       
         scraped_articles.append(scraped_article)
 
-      prepared_texts = self.__extract_text(scraped_articles) 
-      if len(prepared_texts) == 0:
-        self.log.warning(f"no text found in documents in scraped batch, skipping batch")
-        return []
+    if self.deduplicator is not None:
+      with stage_seconds.time(stage="deduplicate"):
+        scraped_articles = self.deduplicator.filter_analyzed(scraped_articles, self.model_version)
+      if len(scraped_articles) == 0:
+        self.log.info(f"all articles in the batch are already analyzed, skipping batch")
+        return None
+
+    prepared_texts = self.__extract_text(scraped_articles) 
+    if len(prepared_texts) == 0:
+      self.log.warning(f"no text found in documents in scraped batch, skipping batch")
+      return None
 
-      # run analysis for the batch
-      category_labels, embeddings = self.analyze_batch(prepared_texts)
+    # run analysis for the batch
+    category_labels, embeddings = self.analyze_batch(prepared_texts, self.__extract_sections(scraped_articles))
 
-      (categories, articles) = self.__create_categories_and_articles(
-        scraped_articles, category_labels, embeddings
-      )
+    return self.__create_categories_and_articles(
+      scraped_articles, category_labels, embeddings
+    )
 
-      # store the categories if they don't exist
-      cat_ids = self.repository.store_categories(list(categories.values()))
-      self.log.info(f"stored {len(cat_ids)} categories")
+  def store(self, analyzed: tuple[dict[str, Category], list[Article]], update_only: bool = False) -> list[str]:
+    """
+    Run the storage part of 'process', returns the ids of the stored articles.
+    With 'update_only', only the analysis of the articles already stored is updated, e.g. in a backfill.
+    """
 
-      # store the articles
-      ids = self.repository.store_analyzed_articles(articles)
-      self.log.info(f"done storing batch of {len(articles)} articles")
+    (categories, articles) = analyzed
 
-      return ids
+    # store the categories if they don't exist
+    new_categories = self.new_categories(categories)
+    cat_ids = []
+    if len(new_categories) > 0:
+      with stage_seconds.time(stage="store_categories"):
+        cat_ids = self.repository.store_categories(new_categories)
+    self.remember_categories(new_categories, cat_ids)
+    self.log.info(f"stored {len(cat_ids)} new categories, skipped {len(categories) - len(cat_ids)} existing ones")
 
-    except Exception:
-      self.log.exception(f"error trying to analyze doc: {doc}")
+    # store the articles
+    with stage_seconds.time(stage="store_articles"):
+      if update_only:
+        ids = self.repository.update_analyzed_articles(articles)
+      else:
+        ids = self.repository.store_analyzed_articles(articles)
+    if self.deduplicator is not None and len(articles) > 0:
+      self.deduplicator.remember(ids, articles[0].analyzer_version)
+    self.log.info(f"done storing batch of {len(articles)} articles")
+
+    return ids
+
+  def new_categories(self, categories: dict[str, Category]) -> list[Category]:
+    """The categories of a batch which have to be stored, all of them without 'known_categories'."""
+    if self.known_categories is None:
+      return list(categories.values())
+    return self.known_categories.filter_new(list(categories.values()))
+
+  def remember_categories(self, categories: list[Category], created_ids: list[str]) -> None:
+    if self.known_categories is not None:
+      self.known_categories.remember(categories, created_ids)
 
   def __map_to_article(self, doc: dict) -> ScrapedArticle | None:
 
@@ -151,28 +244,105 @@ class Analyzer:
       texts.append(text)
     return texts
 
+  def __extract_sections(self, scraped_articles: list[ScrapedArticle]) -> list[tuple[str, list[str]]]:
+    # (title, paragraphs) for each document, used when the embeddings are created in chunks
+    return [('\n'.join(article.title), article.paragraphs) for article in scraped_articles]
+
+
+  def analyze_batch(
+    self, 
+    texts: list[str], 
+    sections: list[tuple[str, list[str]]] | None = None,
+  ) -> list[tuple[list[str], list[float], list[str]]]:
+    if self.cache is None:
+      labels, embeddings = self.__run_models(texts, sections)
+      return (labels, embeddings.tolist())
+
+    model_version = self.model_version
+    keys = [AnalysisCache.make_key(text, model_version) for text in texts]
+    results = self.cache.get_many(keys)
+
+    # identical texts in the batch are only analyzed once
+    missing = {}
+    for i, key in enumerate(keys):
+      if key not in results and key not in missing:
+        missing[key] = i
+    self.log.info(f"found {len(texts) - len(missing)} of {len(texts)} texts in the analysis cache")
 
-  def analyze_batch(self, texts: list[str]) -> list[tuple[list[str], list[float], list[str]]]:
-    # classify the text
-    labels = self.category_classifier.predict_batch(texts)
+    if len(missing) > 0:
+      labels, embeddings = self.__run_models(
+        [texts[i] for i in missing.values()],
+        [sections[i] for i in missing.values()] if sections is not None else None,
+      )
+      analyzed = {
+        # copy the rows, so the cache doesn't keep the whole batch array alive
+        key: (tuple(art_labels), np.array(art_embeddings, dtype=np.float32)) 
+        for key, art_labels, art_embeddings in zip(missing.keys(), labels, embeddings)
+      }
+      self.cache.put_many(analyzed)
+      results |= analyzed
+
+    return (
+      [list(results[key][0]) for key in keys],
+      [results[key][1].tolist() for key in keys],
+    )
+
+  def __run_models(
+    self, 
+    texts: list[str], 
+    sections: list[tuple[str, list[str]]] | None,
+  ) -> tuple[list[list[str]], np.ndarray]:
+    if self.inference_pool is not None:
+      with stage_seconds.time(stage="inference"):
+        return self.inference_pool.analyze_batch(texts, sections)
+
+    if self.classifier_executor is not None:
+      # both release the GIL in their numeric kernels, so they can run in parallel
+      start = time.perf_counter()
+      labels_future = self.classifier_executor.submit(self.__timed, self.category_classifier.predict_batch, texts)
+      embeddings, embed_seconds = self.__timed(self.__embed, texts, sections)
+      labels, classify_seconds = labels_future.result()
+      total_seconds = time.perf_counter() - start
+    else:
+      # classify the text
+      labels, classify_seconds = self.__timed(self.category_classifier.predict_batch, texts)
+
+      # create embeddings
+      embeddings, embed_seconds = self.__timed(self.__embed, texts, sections)
+      total_seconds = classify_seconds + embed_seconds
+
+    stage_seconds.observe(classify_seconds, stage="classify")
+    stage_seconds.observe(embed_seconds, stage="embed")
+    self.log.info(
+      f"analyzed batch of {len(texts)} documents in {total_seconds * 1000:.1f} millis, "
+      f"classification: {classify_seconds * 1000:.1f} millis, embeddings: {embed_seconds * 1000:.1f} millis"
+    )
+    return (labels, embeddings)
 
-    # create embeddings
-    embeddings = self.embeddings_model.encode(texts)
+  def __embed(self, texts: list[str], sections: list[tuple[str, list[str]]] | None) -> np.ndarray:
+    # in chunks if the model is configured for it
+    if sections is not None and self.embeddings_model.chunk_pooling is not None:
+      return self.embeddings_model.encode_chunked(sections)
+    return self.embeddings_model.encode(texts)
 
-    return (labels, embeddings.tolist())
+  def __timed(self, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (result, time.perf_counter() - start)
   
   def __create_categories_and_articles(
     self, 
     scraped_articles: list[ScrapedArticle],
     predicted_categories: list[list[str]],
     embeddings: list[list[float]],
-  ) -> tuple[list[Category], list[Article]]:
+  ) -> tuple[dict[str, Category], list[Article]]:
 
     # gather the categories and articles
     articles = []
     unique_category_names = set()
     categories = {}
     analyze_time = datetime.now()
+    model_version = self.model_version
     for scr_art, art_categories, art_embeddings in zip(scraped_articles, predicted_categories, embeddings):
       
       # gather the categories per article
@@ -208,6 +378,7 @@ class Analyzer:
           analyze_time=analyze_time,
           analyzed_categories=predicted_categories,
           embeddings=art_embeddings,
+          analyzer_version=model_version,
           topics=None
         )
       )
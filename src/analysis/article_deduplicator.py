@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from threading import Lock
+from repository.analyzer import AnalyzerRepository
+from domain import ScrapedArticle
+from utils import log_utils, metrics
+
+dedup_skipped = metrics.counter(
+  "analyzer_dedup_skipped_total",
+  "articles skipped because they were already analyzed with the current models",
+  ("source",),
+)
+dedup_lookups = metrics.counter("analyzer_dedup_lookups_total", "article ids looked up in the repository")
+
+
+class ArticleDeduplicator:
+  """
+  Filters out the articles which are already stored with the current model versions.
+  Ids stored by this process are remembered in a bounded set of 'max_recent_ids',
+  the rest are looked up in the repository with one request per batch.
+  """
+
+  def __init__(self, repository: AnalyzerRepository, max_recent_ids: int = 100000):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.repository = repository
+    self.max_recent_ids = max_recent_ids
+    self.__recent: OrderedDict[str, str] = OrderedDict()
+    self.__lock = Lock()
+
+  def filter_analyzed(self, articles: list[ScrapedArticle], model_version: str) -> list[ScrapedArticle]:
+    """Return the articles which still have to be analyzed with 'model_version'."""
+
+    unknown_ids = []
+    skipped_recent = 0
+    with self.__lock:
+      for article in articles:
+        if self.__recent.get(article.id) == model_version:
+          skipped_recent += 1
+        else:
+          unknown_ids.append(article.id)
+    dedup_skipped.inc(skipped_recent, source="recent")
+
+    unknown_ids = list(dict.fromkeys(unknown_ids))
+    dedup_lookups.inc(len(unknown_ids))
+    stored_versions = self.repository.get_analyzed_versions(unknown_ids)
+    analyzed_ids = {id for id, version in stored_versions.items() if version == model_version}
+    self.remember(analyzed_ids, model_version)
+
+    to_analyze = set(unknown_ids) - analyzed_ids
+    remaining = [article for article in articles if article.id in to_analyze]
+    skipped = len(articles) - len(remaining)
+    dedup_skipped.inc(skipped - skipped_recent, source="repository")
+    if skipped > 0:
+      self.log.info(f"skipping {skipped} of {len(articles)} articles, they are already analyzed with {model_version}")
+    return remaining
+
+  def remember(self, article_ids: list[str] | set[str], model_version: str) -> None:
+    """Remember the ids as stored with 'model_version'."""
+    with self.__lock:
+      for id in article_ids:
+        self.__recent[id] = model_version
+        self.__recent.move_to_end(id)
+      while len(self.__recent) > self.max_recent_ids:
+        self.__recent.popitem(last=False)
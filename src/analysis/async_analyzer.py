@@ -0,0 +1,74 @@
+from repository.analyzer import AsyncAnalyzerRepository
+from domain import *
+from utils import log_utils
+from .analyzer import Analyzer, stage_seconds
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio
+
+
+class AsyncAnalyzer:
+  """
+  Runs the inference of an 'Analyzer' in an executor, so the event loop keeps reading and writing meanwhile,
+  and stores the results with an async repository.
+  """
+
+  def __init__(
+    self,
+    analyzer: Analyzer,
+    repository: AsyncAnalyzerRepository,
+    executor: Executor | None = None,
+  ):
+    self.log = log_utils.create_console_logger(__class__.__name__)
+    self.analyzer = analyzer
+    self.repository = repository
+
+    # a single thread by default, the models parallelize internally
+    self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+  async def process(self, docs: list[dict]) -> list[str]:
+
+    try:
+      analyzed = await self.analyze(docs)
+      if analyzed is None:
+        return []
+
+      return await self.store(analyzed)
+
+    except Exception:
+      # the batcher doesn't ack the messages of a failed batch, they stay pending
+      self.log.exception(f"error trying to analyze batch of {len(docs)} docs")
+      raise
+
+  async def analyze(self, docs: list[dict]) -> tuple[dict[str, Category], list[Article]] | None:
+    """Run 'Analyzer.analyze' in the executor."""
+    return await asyncio.get_running_loop().run_in_executor(self.executor, self.analyzer.analyze, docs)
+
+  async def store(self, analyzed: tuple[dict[str, Category], list[Article]]) -> list[str]:
+    """Store the categories and the articles concurrently, returns the ids of the stored articles."""
+
+    (categories, articles) = analyzed
+
+    new_categories = self.analyzer.new_categories(categories)
+    cat_ids, ids = await asyncio.gather(
+      self.__store_categories(new_categories),
+      self.__store_articles(articles),
+    )
+    self.analyzer.remember_categories(new_categories, cat_ids)
+    self.log.info(f"stored {len(cat_ids)} new categories, skipped {len(categories) - len(cat_ids)} existing ones")
+
+    deduplicator = self.analyzer.deduplicator
+    if deduplicator is not None and len(articles) > 0:
+      deduplicator.remember(ids, articles[0].analyzer_version)
+    self.log.info(f"done storing batch of {len(articles)} articles")
+
+    return ids
+
+  async def __store_categories(self, categories: list[Category]) -> list[str]:
+    if len(categories) == 0:
+      return []
+    with stage_seconds.time(stage="store_categories"):
+      return await self.repository.store_categories(categories)
+
+  async def __store_articles(self, articles: list[Article]) -> list[str]:
+    with stage_seconds.time(stage="store_articles"):
+      return await self.repository.store_analyzed_articles(articles)
@@ -12,7 +12,7 @@ class CategoryClassifier:
       level=level
     )
 
-  def __init__(self, mc: ModelContainer, log_level: int = logging.INFO):
+  def __init__(self, mc: ModelContainer, log_level: int = logging.INFO, vectorize: bool = True):
     self.configure_logging(log_level)
     self.mc = mc
     self.tfidf = mc.tfidf
@@ -20,10 +20,39 @@ class CategoryClassifier:
     self.thresholds = mc.thresholds
     self.target_names = mc.target_names
 
+    # identifies the model in caches and stored articles
+    self.version = f"ovr_{mc.train_date}_{getattr(mc, 'save_date', None)}"
+
+    # if all classifiers are linear, they are stacked into one coefficient matrix,
+    # and a batch is scored with a single matmul
+    self.coef = None
+    self.intercept = None
+    self.score_thresholds = None
+    if vectorize or self.clfs is None:
+      self.__stack_linear_classifiers()
+    self.__names = np.array(self.target_names, dtype=object)
+
+  def __stack_linear_classifiers(self) -> None:
+    stacked = self.mc.stack_linear_classifiers()
+    if stacked is None:
+      self.log.info(f"not all classifiers are binary logistic regressions, using the per-classifier path")
+      return
+    self.coef, self.intercept = stacked
+
+    # the sigmoid is monotonic, so 'proba > threshold' is 'score > logit(threshold)'
+    # thresholds of 0 and 1 become -inf and inf
+    thresholds = np.asarray(self.thresholds, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+      self.score_thresholds = np.log(thresholds) - np.log1p(-thresholds)
+    self.log.info(f"using {len(self.target_names)} stacked linear classifiers, coefficient matrix {self.coef.shape}")
+
   def predict(self, text: str) -> list[str]:
     self.log.info(f"predicting category for single document {text[:20]}...")
     vect = self.tfidf.transform([text])
 
+    if self.coef is not None:
+      return self.__predict_stacked(vect)[0]
+
     labels = []
     for i in range(len(self.clfs)):
       pred = self.clfs[i].predict_proba(vect)
@@ -34,13 +63,26 @@ class CategoryClassifier:
 
   def predict_batch(self, texts: list[str]) -> list[str]:
     self.log.info(f"predicting category for batch of {len(texts)} documents")
-    
+
     vects = self.tfidf.transform(texts)
 
+    if self.coef is not None:
+      return self.__predict_stacked(vects)
+
     labels = [[] for _ in range(len(texts))]
     for i in range(len(self.clfs)):
       pred = self.clfs[i].predict_proba(vects)
       doc_indices = np.argwhere(pred[:, 1] > self.thresholds[i]).flatten()
       for j in doc_indices:
         labels[j].append(self.target_names[i])
-    return labels
\ No newline at end of file
+    return labels
+
+  def __predict_stacked(self, vects) -> list[list[str]]:
+    # (docs, features) sparse x (features, categories) dense
+    scores = vects @ self.coef + self.intercept
+    hits = scores > self.score_thresholds
+
+    # nonzero is ordered by document, then by category, like the per-classifier path
+    _, categories = np.nonzero(hits)
+    splits = np.cumsum(hits.sum(axis=1))[:-1]
+    return [names.tolist() for names in np.split(self.__names[categories], splits)]
@@ -1,5 +1,9 @@
 import pickle
+import json
+import os
+import numpy as np
 from datetime import date
+from utils.mmap_arrays import mmap_npy
 
 # Contains the OVR classification models
 
@@ -7,6 +11,9 @@ class ModelContainer: pass
 
 class ModelContainer:
 
+  # version of the directory format written by 'save_artifact'
+  artifact_format = 1
+
   def __init__(self, tfidf, clfs, thresholds, target_names, results, train_date):
     self.tfidf = tfidf
     self.clfs = clfs
@@ -15,6 +22,33 @@ class ModelContainer:
     self.results = results
     self.train_date = train_date
 
+    # stacked coefficients of linear classifiers, set when loaded from an artifact
+    self.coef = None
+    self.intercept = None
+
+  def stack_linear_classifiers(self) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Stack the classifiers into a (features, categories) coefficient matrix and an intercept vector,
+    so that 'sigmoid(x @ coef + intercept)' is the positive class probability of each category.
+    Returns None if any of the classifiers is not a binary logistic regression.
+    """
+    if self.coef is not None:
+      return (self.coef, self.intercept)
+
+    from sklearn.linear_model import LogisticRegression
+
+    scales = []
+    for clf in self.clfs:
+      if not isinstance(clf, LogisticRegression) or len(clf.classes_) != 2:
+        return None
+      # a binary 'multinomial' model predicts softmax([-d, d]), which is the sigmoid of 2d
+      scales.append(2.0 if clf.multi_class == "multinomial" else 1.0)
+
+    scales = np.array(scales)
+    coef = np.hstack([clf.coef_.T for clf in self.clfs]) * scales
+    intercept = np.concatenate([clf.intercept_ for clf in self.clfs]) * scales
+    return (coef, intercept)
+
   def save(self, filename):
     self.save_date = date.today()
 
@@ -33,6 +67,9 @@ class ModelContainer:
 
   @classmethod
   def load(cls, filename) -> ModelContainer:
+    if os.path.isdir(filename):
+      return cls.load_artifact(filename)
+
     print(f"loading {cls.__name__} from {filename}")
     with open(filename, 'rb') as f:
       d = pickle.load(f)
@@ -46,4 +83,95 @@ class ModelContainer:
       mc = ModelContainer(tfidf, clfs, thresholds, t_names, results, train_date)
       mc.save_date = save_date
       print(f"loaded {cls.__name__} from {filename}")
-      return mc
\ No newline at end of file
+      return mc
+
+  def save_artifact(self, dirname):
+    """
+    Save the models into a directory, the large arrays (idf, stacked coefficients) as .npy files
+    which are memory-mapped when loaded, the vocabulary as one term per line, the rest as json.
+    """
+    # keep the save date of a converted pickle, it is part of the model version
+    if not hasattr(self, "save_date"):
+      self.save_date = date.today()
+
+    params = self.tfidf.get_params()
+    for name in ("analyzer", "preprocessor", "tokenizer"):
+      if callable(params[name]):
+        raise ValueError(f"the vectorizer has a custom '{name}', it can't be saved as an artifact")
+    params["dtype"] = np.dtype(params["dtype"]).name
+    if params["stop_words"] is not None and not isinstance(params["stop_words"], str):
+      params["stop_words"] = sorted(params["stop_words"])
+    if params["vocabulary"] is not None:
+      params["vocabulary"] = None
+
+    terms = [None] * len(self.tfidf.vocabulary_)
+    for term, index in self.tfidf.vocabulary_.items():
+      if "\n" in term:
+        raise ValueError(f"the vocabulary term {term!r} contains a newline, it can't be saved as an artifact")
+      terms[index] = term
+
+    os.makedirs(dirname, exist_ok=True)
+    with open(os.path.join(dirname, "vocabulary.txt"), "w", encoding="utf-8") as f:
+      f.write("\n".join(terms))
+    np.save(os.path.join(dirname, "idf.npy"), np.asarray(self.tfidf.idf_, dtype=np.float64))
+
+    stacked = self.stack_linear_classifiers()
+    if stacked is not None:
+      np.save(os.path.join(dirname, "coef.npy"), stacked[0])
+      np.save(os.path.join(dirname, "intercept.npy"), stacked[1])
+    else:
+      # not linear, the estimators are kept as they are
+      with open(os.path.join(dirname, "clfs.pkl"), "wb") as f:
+        pickle.dump(self.clfs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with open(os.path.join(dirname, "results.pkl"), "wb") as f:
+      pickle.dump(self.results, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    metadata = {
+      "format": self.artifact_format,
+      "save_date": self.save_date.isoformat() if self.save_date is not None else None,
+      "train_date": self.train_date.isoformat() if self.train_date is not None else None,
+      "tfidf_params": params,
+      "thresholds": [float(t) for t in self.thresholds],
+      "target_names": list(self.target_names),
+      "linear": stacked is not None,
+    }
+    with open(os.path.join(dirname, "metadata.json"), "w") as f:
+      json.dump(metadata, f, indent=2)
+    print(f"saved {self.__class__.__name__} artifact at {dirname}")
+
+  @classmethod
+  def load_artifact(cls, dirname) -> ModelContainer:
+    print(f"loading {cls.__name__} artifact from {dirname}")
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    with open(os.path.join(dirname, "metadata.json")) as f:
+      metadata = json.load(f)
+    if metadata["format"] != cls.artifact_format:
+      raise ValueError(f"unsupported artifact format {metadata['format']} in {dirname}")
+
+    params = metadata["tfidf_params"]
+    params["dtype"] = np.dtype(params["dtype"]).type
+    tfidf = TfidfVectorizer(**params)
+    with open(os.path.join(dirname, "vocabulary.txt"), encoding="utf-8") as f:
+      terms = f.read().split("\n")
+    tfidf.vocabulary_ = dict(zip(terms, range(len(terms))))
+    tfidf.idf_ = mmap_npy(os.path.join(dirname, "idf.npy"))
+    tfidf._tfidf.n_features_in_ = len(terms)
+
+    clfs = None
+    if not metadata["linear"]:
+      with open(os.path.join(dirname, "clfs.pkl"), "rb") as f:
+        clfs = pickle.load(f)
+
+    with open(os.path.join(dirname, "results.pkl"), "rb") as f:
+      results = pickle.load(f)
+
+    train_date = date.fromisoformat(metadata["train_date"]) if metadata["train_date"] else None
+    mc = ModelContainer(tfidf, clfs, metadata["thresholds"], metadata["target_names"], results, train_date)
+    mc.save_date = date.fromisoformat(metadata["save_date"]) if metadata["save_date"] else None
+    if metadata["linear"]:
+      mc.coef = mmap_npy(os.path.join(dirname, "coef.npy"))
+      mc.intercept = np.load(os.path.join(dirname, "intercept.npy"))
+    print(f"loaded {cls.__name__} artifact from {dirname}")
+    return mc
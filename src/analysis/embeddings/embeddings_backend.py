@@ -0,0 +1,133 @@
+from abc import ABC, abstractmethod
+from utils import log_utils
+import numpy as np
+import os
+
+# Backends running the forward pass of a sentence-transformers model on already tokenized input.
+# All of them produce the same 'sentence_embedding' output as the fp32 PyTorch model.
+
+
+class EmbeddingsBackend(ABC):
+
+  name: str
+
+  def __init__(self, model):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.model = model
+
+  @abstractmethod
+  def forward(self, input_ids: list[list[int]]) -> np.ndarray:
+    """Embed a micro-batch of token ids, padded to its longest sequence by the backend."""
+    raise NotImplementedError
+
+
+class TorchEmbeddingsBackend(EmbeddingsBackend):
+  """The fp32 PyTorch model, as it was pickled."""
+
+  name = "torch"
+
+  def forward(self, input_ids: list[list[int]]) -> np.ndarray:
+    import torch
+
+    features = self.model.tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+    features = {name: tensor.to(self.model.device) for name, tensor in features.items()}
+
+    with torch.inference_mode():
+      out = self.model(features)
+    return out["sentence_embedding"].float().cpu().numpy()
+
+
+class QuantizedTorchEmbeddingsBackend(TorchEmbeddingsBackend):
+  """The PyTorch model with its linear layers dynamically quantized to int8."""
+
+  name = "int8"
+
+  def __init__(self, model):
+    super().__init__(model)
+    import torch
+    import copy
+
+    self.log.info("quantizing the linear layers of the embeddings model to int8")
+    self.model = torch.quantization.quantize_dynamic(copy.deepcopy(model).cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxEmbeddingsBackend(EmbeddingsBackend):
+  """The model exported with 'export_onnx', run by ONNX Runtime."""
+
+  name = "onnx"
+
+  def __init__(self, model, onnx_path: str):
+    super().__init__(model)
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    # follow the thread limits of the process, set by the inference workers
+    options.intra_op_num_threads = int(os.environ.get("OMP_NUM_THREADS", 0))
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    self.log.info(f"loading ONNX embeddings model from {onnx_path}")
+    self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+  def forward(self, input_ids: list[list[int]]) -> np.ndarray:
+    features = self.model.tokenizer.pad({"input_ids": input_ids}, return_tensors="np")
+    return self.session.run(
+      ["sentence_embedding"],
+      {
+        "input_ids": features["input_ids"].astype(np.int64),
+        "attention_mask": features["attention_mask"].astype(np.int64),
+      },
+    )[0]
+
+
+def create_backend(name: str, model, onnx_path: str | None = None) -> EmbeddingsBackend:
+  if name == TorchEmbeddingsBackend.name:
+    return TorchEmbeddingsBackend(model)
+  if name == QuantizedTorchEmbeddingsBackend.name:
+    return QuantizedTorchEmbeddingsBackend(model)
+  if name == OnnxEmbeddingsBackend.name:
+    if onnx_path is None:
+      raise ValueError("the onnx embeddings backend needs the path of the exported model")
+    return OnnxEmbeddingsBackend(model, onnx_path)
+  raise ValueError(f"unknown embeddings backend '{name}', expected 'torch', 'int8' or 'onnx'")
+
+
+def export_onnx(model, onnx_path: str, opset_version: int = 14) -> None:
+  """Export the whole sentence-transformers pipeline (transformer, pooling, normalization) to ONNX."""
+  import torch
+
+  class SentenceEmbedding(torch.nn.Module):
+
+    def __init__(self, model):
+      super().__init__()
+      self.model = model
+
+    def forward(self, input_ids, attention_mask):
+      return self.model({"input_ids": input_ids, "attention_mask": attention_mask})["sentence_embedding"]
+
+  sample = model.tokenizer(["an example sentence to trace the model"], return_tensors="pt")
+  torch.onnx.export(
+    SentenceEmbedding(model.cpu()).eval(),
+    (sample["input_ids"], sample["attention_mask"]),
+    onnx_path,
+    input_names=["input_ids", "attention_mask"],
+    output_names=["sentence_embedding"],
+    dynamic_axes={
+      "input_ids": {0: "batch", 1: "sequence"},
+      "attention_mask": {0: "batch", 1: "sequence"},
+      "sentence_embedding": {0: "batch"},
+    },
+    opset_version=opset_version,
+  )
+
+
+def cosine_parity(reference: np.ndarray, candidate: np.ndarray) -> dict[str, float]:
+  """Row-wise cosine similarity of the candidate backend's embeddings to the reference ones."""
+  reference = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+  candidate = candidate / np.maximum(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12)
+  similarities = np.sum(reference * candidate, axis=1)
+  return {
+    "mean_cosine": float(similarities.mean()),
+    "min_cosine": float(similarities.min()),
+  }
@@ -1,11 +1,17 @@
 import pickle
+import json
+import os
 from datetime import date
+from utils.mmap_arrays import mmap_safetensors
 
 
 class EmbeddingsModelContainer: pass
 
 class EmbeddingsModelContainer:
 
+  # version of the directory format written by 'save_artifact'
+  artifact_format = 1
+
   def __init__(self,embeddings_model, embeddings_model_name):
     self.embeddings_model = embeddings_model
     self.embeddings_model_name = embeddings_model_name
@@ -24,6 +30,9 @@ class EmbeddingsModelContainer:
 
   @classmethod
   def load(cls, filename) -> EmbeddingsModelContainer:
+    if os.path.isdir(filename):
+      return cls.load_artifact(filename)
+
     print(f"loading {cls.__name__} from {filename}")
     with open(filename, 'rb') as f:
       d = pickle.load(f)
@@ -33,4 +42,58 @@ class EmbeddingsModelContainer:
       ec = EmbeddingsModelContainer(embeddings_model, embeddings_model_name)
       ec.save_date = save_date
       print(f"loaded {cls.__name__} from {filename}")
-      return ec
\ No newline at end of file
+      return ec
+
+  def save_artifact(self, dirname):
+    """
+    Save the sentence-transformers model into a directory, the weights as safetensors
+    which are memory-mapped when loaded, the tokenizer and configs as the library saves them.
+    """
+    if not hasattr(self, "save_date"):
+      self.save_date = date.today()
+
+    os.makedirs(dirname, exist_ok=True)
+    self.embeddings_model.save(os.path.join(dirname, "model"), safe_serialization=True)
+
+    metadata = {
+      "format": self.artifact_format,
+      "save_date": self.save_date.isoformat() if self.save_date is not None else None,
+      "embeddings_model_name": self.embeddings_model_name,
+    }
+    with open(os.path.join(dirname, "metadata.json"), "w") as f:
+      json.dump(metadata, f, indent=2)
+    print(f"saved {self.__class__.__name__} artifact at {dirname}")
+
+  @classmethod
+  def load_artifact(cls, dirname) -> EmbeddingsModelContainer:
+    print(f"loading {cls.__name__} artifact from {dirname}")
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    with open(os.path.join(dirname, "metadata.json")) as f:
+      metadata = json.load(f)
+    if metadata["format"] != cls.artifact_format:
+      raise ValueError(f"unsupported artifact format {metadata['format']} in {dirname}")
+
+    model_dir = os.path.join(dirname, "model")
+    model = SentenceTransformer(model_dir, device="cpu")
+
+    # replace the weights read into private memory with views of the memory-mapped file,
+    # shared by every process on the host which loads the same artifact
+    transformer = model[0].auto_model
+    weights = mmap_safetensors(os.path.join(model_dir, "model.safetensors"))
+    missing, unexpected = transformer.load_state_dict(
+      {name: torch.from_numpy(array) for name, array in weights.items()},
+      strict=False,
+      assign=True,
+    )
+    if len(unexpected) > 0:
+      raise ValueError(f"unexpected weights in {model_dir}: {unexpected}")
+    if len(missing) > 0:
+      # e.g. tied weights, which are only saved once, these stay in private memory
+      print(f"{len(missing)} weights of {cls.__name__} are not memory-mapped: {missing}")
+
+    ec = EmbeddingsModelContainer(model.eval(), metadata["embeddings_model_name"])
+    ec.save_date = date.fromisoformat(metadata["save_date"]) if metadata["save_date"] else None
+    print(f"loaded {cls.__name__} artifact from {dirname}")
+    return ec
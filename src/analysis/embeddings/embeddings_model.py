@@ -1,8 +1,42 @@
 from analysis.embeddings.embeddings_container import EmbeddingsModelContainer
+from analysis.embeddings.embeddings_backend import create_backend
 import numpy as np
 from utils import log_utils
 import logging
 
+# used for the micro-batches of the chunks, if the model has no token budget
+DEFAULT_TOKEN_BUDGET = 8192
+
+# a generous estimate of the characters per token, to cut the very long articles before tokenizing them,
+# English text averages about 4 with the WordPiece tokenizers
+CHARS_PER_TOKEN_ESTIMATE = 6
+
+
+def make_token_budget_batches(lengths: list[int], token_budget: int, max_length_spread: float = 1.25) -> list[list[int]]:
+  """
+  Group the indices of 'lengths' into micro-batches of similar length,
+  so that each micro-batch padded to its longest element holds at most 'token_budget' tokens,
+  and its longest element is at most 'max_length_spread' times its shortest one.
+  A single element longer than the budget gets its own micro-batch.
+  """
+  order = np.argsort(lengths, kind="stable")
+
+  batches = []
+  batch = []
+  for i in order:
+    # sorted ascending, the current element is the longest in the batch, the first one is the shortest
+    if len(batch) > 0 and (
+      (len(batch) + 1) * lengths[i] > token_budget or 
+      lengths[i] > max_length_spread * lengths[batch[0]]
+    ):
+      batches.append(batch)
+      batch = []
+    batch.append(int(i))
+
+  if len(batch) > 0:
+    batches.append(batch)
+  return batches
+
 
 class EmbeddingsModel:
 
@@ -13,10 +47,159 @@ class EmbeddingsModel:
       level=level
     )
 
-  def __init__(self, embeddings_container: EmbeddingsModelContainer, log_level: int = logging.INFO):
+  def __init__(
+    self,
+    embeddings_container: EmbeddingsModelContainer,
+    log_level: int = logging.INFO,
+    token_budget: int | None = None,
+    chunk_pooling: str | None = None,
+    max_chunks: int = 8,
+    title_weight: float = 0.3,
+    backend: str = "torch",
+    onnx_path: str | None = None,
+  ):
     self.ec = embeddings_container
     self.configure_logging(log_level)
 
+    if chunk_pooling not in (None, "mean", "title_weighted"):
+      raise ValueError(f"unknown chunk pooling '{chunk_pooling}', expected 'mean' or 'title_weighted'")
+
+    # identifies the model in caches and stored articles
+    self.version = embeddings_container.embeddings_model_name
+    if chunk_pooling is not None:
+      self.version += f"+chunks_{chunk_pooling}_{max_chunks}"
+    if backend != "torch":
+      self.version += f"+{backend}"
+
+    # runs the forward pass of the tokenized micro-batches
+    self.backend = create_backend(backend, embeddings_container.embeddings_model, onnx_path)
+
+    # if set, the texts are tokenized once, and embedded in micro-batches of similar length,
+    # holding at most 'token_budget' tokens including the padding
+    self.token_budget = token_budget
+
+    # if set, 'encode_chunked' embeds the articles in chunks and pools the chunk embeddings
+    # 'mean' averages all chunks, 'title_weighted' embeds the title as a separate chunk,
+    # and gives it 'title_weight' of the final vector
+    self.chunk_pooling = chunk_pooling
+    self.max_chunks = max_chunks
+    self.title_weight = title_weight
+
   def encode(self, docs) -> np.ndarray:
     self.log.info(f"embedding batch of {len(docs)} documents")
-    return self.ec.embeddings_model.encode(docs)
+    if not self.token_budget and self.backend.name == "torch":
+      return self.ec.embeddings_model.encode(docs)
+
+    return self.encode_tokenized(self.tokenize(docs))
+
+  def tokenize(self, docs: list[str]) -> list[list[int]]:
+    """Tokenize the documents like the model does, truncated to its max sequence length."""
+    model = self.ec.embeddings_model
+    return model.tokenizer(
+      [str(doc).strip() for doc in docs],
+      add_special_tokens=True,
+      truncation=True,
+      max_length=model.max_seq_length,
+    )["input_ids"]
+
+  def encode_tokenized(self, input_ids: list[list[int]]) -> np.ndarray:
+    """Embed already tokenized documents, returns the embeddings in the order of 'input_ids'."""
+
+    batches = make_token_budget_batches([len(ids) for ids in input_ids], self.token_budget or DEFAULT_TOKEN_BUDGET)
+    self.log.debug(f"embedding {len(input_ids)} documents in {len(batches)} micro-batches")
+
+    dims = self.ec.embeddings_model.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(input_ids), dims), dtype=np.float32)
+    for batch in batches:
+      # restore the original order
+      embeddings[batch] = self.backend.forward([input_ids[i] for i in batch])
+
+    return embeddings
+
+  def encode_chunked(self, articles: list[tuple[str, list[str]]]) -> np.ndarray:
+    """
+    Embed (title, paragraphs) articles, split at paragraph boundaries into chunks which fit into the model,
+    returns one pooled, normalized embedding per article.
+    """
+    self.log.info(f"embedding batch of {len(articles)} documents in chunks")
+    tokenizer = self.ec.embeddings_model.tokenizer
+    window = self.ec.embeddings_model.max_seq_length - tokenizer.num_special_tokens_to_add(pair=False)
+
+    # bound the worst case before tokenizing, the text past what fits into 'max_chunks' windows is dropped anyway
+    max_chars = self.max_chunks * window * CHARS_PER_TOKEN_ESTIMATE
+    articles = [
+      (str(title)[:window * CHARS_PER_TOKEN_ESTIMATE], self.cap_paragraphs(paragraphs, max_chars))
+      for title, paragraphs in articles
+    ]
+
+    # tokenize every title and paragraph of the batch once, in a single call
+    pieces = []
+    for title, paragraphs in articles:
+      pieces.append(title)
+      pieces.extend(paragraphs)
+    piece_ids = tokenizer([str(piece).strip() for piece in pieces], add_special_tokens=False)["input_ids"]
+
+    chunk_ids = []
+    chunk_weights = []
+    chunk_articles = []
+    start = 0
+    for i, (_, paragraphs) in enumerate(articles):
+      title_ids = piece_ids[start]
+      paragraph_ids = piece_ids[start + 1:start + 1 + len(paragraphs)]
+      start += 1 + len(paragraphs)
+
+      windows = self.__make_windows(title_ids, paragraph_ids, window)
+      chunk_ids.extend(tokenizer.build_inputs_with_special_tokens(ids) for ids in windows)
+      chunk_weights.extend(self.__pooling_weights(len(windows)))
+      chunk_articles.extend([i] * len(windows))
+
+    self.log.debug(f"embedding {len(chunk_ids)} chunks of {len(articles)} documents")
+    chunk_embeddings = self.encode_tokenized(chunk_ids)
+
+    pooled = np.zeros((len(articles), chunk_embeddings.shape[1]), dtype=np.float32)
+    np.add.at(pooled, chunk_articles, chunk_embeddings * np.array(chunk_weights, dtype=np.float32)[:, None])
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled / np.maximum(norms, 1e-12)
+
+  @staticmethod
+  def cap_paragraphs(paragraphs: list[str], max_chars: int) -> list[str]:
+    """The leading paragraphs of at most 'max_chars' characters, the last one is cut if it goes over."""
+    capped = []
+    chars = 0
+    for paragraph in paragraphs:
+      if chars >= max_chars:
+        break
+      capped.append(str(paragraph)[:max_chars - chars])
+      chars += len(capped[-1])
+    return capped
+
+  def __make_windows(self, title_ids: list[int], paragraph_ids: list[list[int]], window: int) -> list[list[int]]:
+    # pack whole paragraphs into windows, only split the paragraphs which don't fit into a window by themselves
+    windows = []
+    current = []
+    if self.chunk_pooling == "title_weighted":
+      windows.append(title_ids[:window])
+    else:
+      current = title_ids[:window]
+
+    for ids in paragraph_ids:
+      for start in range(0, len(ids), window):
+        piece = ids[start:start + window]
+        if len(current) > 0 and len(current) + len(piece) > window:
+          windows.append(current)
+          current = []
+        current = current + piece
+
+      # bound the worst case, the rest of the article is dropped
+      if len(windows) >= self.max_chunks:
+        break
+
+    if len(current) > 0:
+      windows.append(current)
+    return windows[:self.max_chunks] or [[]]
+
+  def __pooling_weights(self, chunks: int) -> list[float]:
+    if self.chunk_pooling == "title_weighted" and chunks > 1:
+      # the first chunk is the title
+      return [self.title_weight] + [(1 - self.title_weight) / (chunks - 1)] * (chunks - 1)
+    return [1 / chunks] * chunks
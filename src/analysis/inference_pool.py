@@ -0,0 +1,132 @@
+from analysis.classifier import CategoryClassifier, ModelContainer
+from analysis.embeddings import EmbeddingsModel, EmbeddingsModelContainer
+from concurrent.futures import ProcessPoolExecutor
+from utils import log_utils
+import multiprocessing
+import numpy as np
+import math
+import time
+import os
+
+# models of the worker process, loaded once by the pool initializer
+_category_classifier: CategoryClassifier = None
+_embeddings_model: EmbeddingsModel = None
+
+
+def _limit_threads(threads: int) -> None:
+  # the env variables only affect libraries which are not initialized yet (e.g. torch loaded by the unpickling)
+  for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ[var] = str(threads)
+
+  # numpy is already imported at this point, limit its BLAS pool at runtime
+  from threadpoolctl import threadpool_limits
+  threadpool_limits(limits=threads)
+
+  try:
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+  except ImportError:
+    pass
+
+
+def _init_worker(
+  cat_clf_model_path: str, 
+  embeddings_model_path: str, 
+  threads_per_worker: int, 
+  embeddings_options: dict,
+) -> None:
+  global _category_classifier, _embeddings_model
+  _limit_threads(threads_per_worker)
+  _category_classifier = CategoryClassifier(ModelContainer.load(cat_clf_model_path))
+  _embeddings_model = EmbeddingsModel(EmbeddingsModelContainer.load(embeddings_model_path), **embeddings_options)
+
+
+def _analyze_sub_batch(
+  texts: list[str], 
+  sections: list[tuple[str, list[str]]] | None,
+) -> tuple[list[list[str]], np.ndarray]:
+  labels = _category_classifier.predict_batch(texts)
+  if sections is not None and _embeddings_model.chunk_pooling is not None:
+    embeddings = _embeddings_model.encode_chunked(sections)
+  else:
+    embeddings = _embeddings_model.encode(texts)
+  return (labels, embeddings)
+
+
+def _ping(delay_seconds: float) -> tuple[int, str, str]:
+  # the delay spreads the pings over the idle workers
+  time.sleep(delay_seconds)
+  return (os.getpid(), _category_classifier.version, _embeddings_model.version)
+
+
+class InferenceWorkerPool:
+  """
+  Runs the category classifier and the embeddings model in 'workers' processes,
+  each of them loads the models once at startup.
+  """
+
+  def __init__(
+    self,
+    cat_clf_model_path: str,
+    embeddings_model_path: str,
+    workers: int,
+    threads_per_worker: int = 1,
+    min_sub_batch_size: int = 8,
+    embeddings_options: dict | None = None,
+  ):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.workers = workers
+    self.min_sub_batch_size = min_sub_batch_size
+
+    # versions of the models loaded by the workers, known after 'wait_ready'
+    self.category_classifier_version = None
+    self.embeddings_model_version = None
+
+    # 'spawn' so the workers don't inherit the threads and connections of the parent
+    self.log.info(f"starting {workers} inference workers with {threads_per_worker} threads each")
+    self.executor = ProcessPoolExecutor(
+      max_workers=workers,
+      mp_context=multiprocessing.get_context("spawn"),
+      initializer=_init_worker,
+      # keyword arguments of the 'EmbeddingsModel' of the workers
+      initargs=(cat_clf_model_path, embeddings_model_path, threads_per_worker, embeddings_options or {}),
+    )
+
+  def wait_ready(self) -> None:
+    """Block until every worker has loaded the models."""
+    # a worker only picks up tasks after its initializer finished
+    pids = set()
+    while len(pids) < self.workers:
+      futures = [self.executor.submit(_ping, 0.05) for _ in range(self.workers)]
+      for f in futures:
+        pid, self.category_classifier_version, self.embeddings_model_version = f.result()
+        pids.add(pid)
+    self.log.info(f"inference workers ready, pids: {sorted(pids)}")
+
+  def analyze_batch(
+    self, 
+    texts: list[str], 
+    sections: list[tuple[str, list[str]]] | None = None,
+  ) -> tuple[list[list[str]], np.ndarray]:
+    """Classify and embed the texts on the workers, the results are in the order of 'texts'."""
+
+    sub_batch_size = max(self.min_sub_batch_size, math.ceil(len(texts) / self.workers))
+    starts = range(0, len(texts), sub_batch_size)
+    sub_texts = [texts[i:i + sub_batch_size] for i in starts]
+    sub_sections = [sections[i:i + sub_batch_size] if sections is not None else None for i in starts]
+    self.log.info(f"analyzing batch of {len(texts)} documents in {len(sub_texts)} sub-batches")
+
+    labels = []
+    embeddings = []
+    # 'map' returns the results in the order of the submitted sub-batches
+    for sub_labels, sub_embeddings in self.executor.map(_analyze_sub_batch, sub_texts, sub_sections):
+      labels.extend(sub_labels)
+      embeddings.append(sub_embeddings)
+
+    return (labels, np.concatenate(embeddings))
+
+  def shutdown(self) -> None:
+    self.executor.shutdown(wait=True)
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from threading import Lock
+from domain import Category
+from utils import log_utils, metrics
+
+categories_total = metrics.counter(
+  "analyzer_categories_total",
+  "categories of the stored batches, 'known' ones are skipped, 'new' ones are created, "
+  "'existing' ones were created by another analyzer meanwhile",
+  ("result",),
+)
+
+
+class KnownCategories:
+  """
+  The ids of the categories which are already in the repository, so only new categories are stored.
+  Bounded to the 'max_entries' most recently seen ids, the ones dropped are stored again, which is harmless.
+  """
+
+  def __init__(self, max_entries: int = 10000):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.max_entries = max_entries
+    self.__known: OrderedDict[str, None] = OrderedDict()
+    self.__lock = Lock()
+
+  def warm(self, category_ids: list[str]) -> None:
+    """Add the ids of the categories found in the repository, e.g. at startup."""
+    self.__add(category_ids)
+    self.log.info(f"warmed up with {len(category_ids)} categories")
+
+  def filter_new(self, categories: list[Category]) -> list[Category]:
+    """Return the categories which are not known to be stored."""
+    with self.__lock:
+      new = []
+      for category in categories:
+        if category.id in self.__known:
+          self.__known.move_to_end(category.id)
+        else:
+          new.append(category)
+    categories_total.inc(len(categories) - len(new), result="known")
+    return new
+
+  def remember(self, categories: list[Category], created_ids: list[str]) -> None:
+    """Remember the stored categories, 'created_ids' are the ones which didn't exist before."""
+    self.__add([category.id for category in categories])
+    categories_total.inc(len(created_ids), result="new")
+    categories_total.inc(len(categories) - len(created_ids), result="existing")
+
+  def __add(self, category_ids: list[str]) -> None:
+    with self.__lock:
+      for id in category_ids:
+        self.__known[id] = None
+        self.__known.move_to_end(id)
+      while len(self.__known) > self.max_entries:
+        self.__known.popitem(last=False)
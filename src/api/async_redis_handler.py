@@ -0,0 +1,281 @@
+import redis.asyncio
+import redis.exceptions
+import typing as t
+import asyncio
+import uuid
+from random import randint
+from collections import Counter
+from utils import log_utils
+from api.redis_handler import StreamAck, message_size, decode_stream_reply, redis_command_seconds
+from api.stream_read_tuner import StreamReadTuner, next_fair_read, read_limit, interleave_streams
+from utils.in_flight_budget import InFlightBudget
+
+
+class AsyncRedisHandler:
+  """
+  The asyncio variant of 'RedisHandler', the stream reads, the acks and the autoclaim share one event loop.
+  Call 'connect' before consuming.
+  """
+
+  def __init__(self, redis_host, redis_port):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.host = redis_host
+    self.port = redis_port
+    self.r = None
+    self.raw = None
+
+  async def connect(self) -> None:
+    # TODO: redis cluster connection
+    await self.close()
+    self.r = redis.asyncio.Redis(host=self.host, port=self.port, decode_responses=True)
+    # the stream reads, the messages are not decoded to 'str' before they are parsed
+    self.raw = redis.asyncio.Redis(host=self.host, port=self.port, decode_responses=False)
+
+    backoff = randint(500, 1000)
+    while not await self.__ping():
+      self.log.info(f"redis not ready, waiting {backoff} milliseconds")
+      await asyncio.sleep(backoff / 1000)
+      backoff = min(backoff * 2, 30000)
+
+  async def __ping(self) -> bool:
+    try:
+      return await self.r.ping()
+    except redis.exceptions.ConnectionError:
+      return False
+
+  async def close(self) -> None:
+    if self.r is not None:
+      await self.r.aclose()
+      self.r = None
+    if self.raw is not None:
+      await self.raw.aclose()
+      self.raw = None
+
+  async def consume_stream(
+    self,
+    stream_name,
+    consumer_group,
+    callback: t.Callable[[tuple[str, t.Any], StreamAck], t.Awaitable[None]],
+    *callback_args,
+    read_tuner: StreamReadTuner | None = None,
+    **kwargs,
+  ):
+    """Consume a single stream, see 'consume_streams'."""
+    await self.consume_streams(
+      [stream_name],
+      consumer_group,
+      callback,
+      *callback_args,
+      read_tuners={stream_name: read_tuner} if read_tuner is not None else None,
+      **kwargs,
+    )
+
+  async def consume_streams(
+    self,
+    stream_names: list[str],
+    consumer_group,
+    callback: t.Callable[[tuple[str, t.Any], StreamAck], t.Awaitable[None]],
+    *callback_args,
+    claim_messages_idle_millis: int = 30000, # 30s
+    claim_check_interval_millis: int = 120000, # 2m
+    claim_max_count: int = 20,
+    delete_acked: bool = False,
+    read_tuners: dict[str, StreamReadTuner] | None = None,
+    in_flight_budget: InFlightBudget | None = None,
+  ):
+    """Like 'RedisHandler.consume_streams', with a coroutine callback, and 'await ack()' to ack a message."""
+
+    consumer_name = f"{consumer_group}_{uuid.uuid4().hex}"
+    if read_tuners is None:
+      read_tuners = {}
+    tuners = [read_tuners.get(stream_name) or StreamReadTuner(stream_name) for stream_name in stream_names]
+
+    for stream_name in stream_names:
+      await self.__try_create_consumer_group(stream_name, consumer_group)
+
+    # a task instead of the autoclaim thread
+    autoclaim_task = asyncio.create_task(self.__auto_claim(
+      stream_names,
+      consumer_group,
+      consumer_name,
+      claim_messages_idle_millis,
+      claim_check_interval_millis,
+      claim_max_count,
+    ))
+
+    self.log.info(f"consumer starting in consumer group {consumer_group}, consumer name: {consumer_name}, streams: {stream_names}")
+    last_ids = {stream_name: "0" for stream_name in stream_names}
+    check_pending_messages = {stream_name: True for stream_name in stream_names}
+    try:
+      while True:
+
+        # pending messages since the last acked one first, then new messages, see 'RedisHandler.consume_streams'
+        streams = {
+          stream_name: last_ids[stream_name] if check_pending_messages[stream_name] else ">"
+          for stream_name in stream_names
+        }
+
+        try:
+          # waits in a thread, blocking the event loop would keep the batches from giving the messages back
+          if in_flight_budget is not None and not await asyncio.to_thread(in_flight_budget.wait_for_room, 1):
+            self.log.debug("in-flight budget saturated, pausing reads")
+            continue
+
+          for tuner in tuners:
+            if tuner.lag_check_due():
+              tuner.set_lag(await self.__get_group_lag(tuner.stream_name, consumer_group))
+
+          room = in_flight_budget.room() if in_flight_budget is not None else None
+          xread_count, xread_timeout = next_fair_read(tuners)
+          if room is not None:
+            xread_count = min(xread_count, room)
+          # taken before the callbacks change the capacity
+          limit = read_limit(tuners, room)
+          with redis_command_seconds.time(command="xreadgroup"):
+            messages = decode_stream_reply(await self.raw.xreadgroup(
+              groupname=consumer_group,
+              consumername=consumer_name,
+              streams=streams,
+              block=xread_timeout,
+              count=xread_count
+            ))
+        except redis.exceptions.ConnectionError:
+          # try to connect again
+          await self.connect()
+          continue
+
+        returned = {stream_name: stream_messages for stream_name, stream_messages in messages}
+        # only the messages handed to the callback are counted, the ones over the limit are read again
+        taken = interleave_streams(messages)[:limit]
+        taken_counts = Counter(stream_name for stream_name, _ in taken)
+        for tuner in tuners:
+          taken_count = taken_counts[tuner.stream_name]
+          tuner.observe_read(xread_count, taken_count, len(returned.get(tuner.stream_name, [])) - taken_count)
+
+        if len(messages) == 0:
+          self.log.debug(f"{xread_timeout} millis passed, no new messages")
+          continue
+
+        was_pending = dict(check_pending_messages)
+        for stream_name, stream_messages in returned.items():
+          check_pending_messages[stream_name] = len(stream_messages) != 0
+
+        # the messages over the limit are left pending, see 'RedisHandler.consume_streams'
+        for stream_name, message in taken:
+          message_id = message[0]
+
+          # it's up to the callback to decide when a message is processed and when it can be acked
+          size = message_size(message) if in_flight_budget is not None else 0
+          ack = StreamAck(
+            self, stream_name, consumer_group, message_id, delete=delete_acked, budget=in_flight_budget, size=size,
+          )
+          if in_flight_budget is not None:
+            in_flight_budget.take(size)
+          await callback(message, ack, *callback_args)
+
+          if was_pending[stream_name]:
+            self.log.debug(f"consumed pending message {message_id} of {stream_name}")
+          else:
+            self.log.debug(f"consumed message {message_id} of {stream_name}")
+
+          last_ids[stream_name] = message_id
+
+    except asyncio.CancelledError:
+      self.log.info("shutting down consumer")
+      raise
+    except Exception:
+      self.log.exception("error while consuming messages, exiting")
+      raise
+    finally:
+      autoclaim_task.cancel()
+
+  async def __get_group_lag(self, stream_name: str, consumer_group: str) -> int | None:
+    try:
+      for group in await self.r.xinfo_groups(stream_name):
+        if group["name"] == consumer_group:
+          return group.get("lag")
+    except redis.exceptions.ResponseError:
+      self.log.exception(f"error while getting the lag of consumer group {consumer_group}")
+    return None
+
+  async def ack_many(self, stream_name: str, consumer_group: str, message_ids: list[str], delete: bool = False) -> None:
+    """Ack the messages with a single XACK, and delete them from the stream in the same round trip if 'delete' is set."""
+    if len(message_ids) == 0:
+      return
+
+    if delete:
+      pipe = self.r.pipeline(transaction=False)
+      pipe.xack(stream_name, consumer_group, *message_ids)
+      pipe.xdel(stream_name, *message_ids)
+      with redis_command_seconds.time(command="xack"):
+        await pipe.execute()
+      self.log.debug(f"ack-d and deleted {len(message_ids)} messages")
+    else:
+      with redis_command_seconds.time(command="xack"):
+        await self.r.xack(stream_name, consumer_group, *message_ids)
+      self.log.debug(f"ack-d {len(message_ids)} messages")
+
+  async def ack_batch(self, acks: list[t.Callable[[], t.Any]]) -> None:
+    """Ack the 'StreamAck's of a batch with one XACK per stream and consumer group, other acks are awaited one by one."""
+    grouped: dict[tuple[str, str, bool], list[str]] = {}
+    for ack in acks:
+      if isinstance(ack, StreamAck) and ack.handler is self:
+        grouped.setdefault((ack.stream_name, ack.consumer_group, ack.delete), []).append(ack.message_id)
+        ack.release()
+      else:
+        result = ack()
+        if asyncio.iscoroutine(result):
+          await result
+
+    await asyncio.gather(*(
+      self.ack_many(stream_name, consumer_group, message_ids, delete=delete)
+      for (stream_name, consumer_group, delete), message_ids in grouped.items()
+    ))
+
+  def release_batch(self, acks: list[t.Callable[[], t.Any]]) -> None:
+    """Give the messages of a batch back to the in-flight budget without ack-ing them, they stay pending."""
+    for ack in acks:
+      if isinstance(ack, StreamAck):
+        ack.release()
+
+  async def __auto_claim(
+    self,
+    stream_names: list[str],
+    consumer_group,
+    consumer_name,
+    claim_messages_idle_millis: int,
+    claim_check_interval_millis: int,
+    claim_max_count: int,
+  ):
+    # try to claim pending messages from other consumers
+    while True:
+      await asyncio.sleep(claim_check_interval_millis / 1000)
+      for stream_name in stream_names:
+        try:
+          claimed = await self.r.xautoclaim(
+            stream_name,
+            consumer_group,
+            consumer_name,
+            min_idle_time=claim_messages_idle_millis,
+            start_id="0-0",
+            count=claim_max_count,
+            justid=True,
+          )
+          if len(claimed) > 0:
+            self.log.debug(f"autoclaimed messages of {stream_name}, total claimed pending messages: {len(claimed)}")
+        except Exception:
+          self.log.exception(f"error while autoclaiming messages of {stream_name}")
+
+  async def __try_create_consumer_group(self, stream_name, consumer_group):
+    try:
+      await self.r.xgroup_create(name=stream_name, groupname=consumer_group, mkstream=True)
+      self.log.info(f"created/asserted consumer group {consumer_group} for stream {stream_name}")
+    except redis.exceptions.ResponseError as e:
+      if "BUSYGROUP" in str(e):
+        self.log.info(f"consumer group {consumer_group} already exists")
+      else:
+        raise
+    except Exception:
+      self.log.exception(f"error while creating consumer group {consumer_group} for stream {stream_name}")
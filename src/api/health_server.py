@@ -0,0 +1,64 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from utils.readiness import Readiness
+from utils import log_utils, metrics
+
+
+class HealthServer:
+  """
+  Serves the state of the process over HTTP for the orchestration,
+  '/live' answers as long as the process runs, '/ready' only once every component is ready,
+  '/metrics' serves the metrics in the Prometheus text format.
+  """
+
+  def __init__(self, port: int, readiness: Readiness, host: str = "0.0.0.0"):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.readiness = readiness
+    self.routes = {
+      "/live": self.__live,
+      "/ready": self.__ready,
+      "/metrics": self.__metrics,
+    }
+
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+
+      def do_GET(self):
+        route = server.routes.get(self.path.split("?", 1)[0])
+        if route is None:
+          status, content_type, body = 404, "text/plain", "not found\n"
+        else:
+          status, content_type, body = route()
+
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        # probes would flood the logs
+        pass
+
+    self.httpd = ThreadingHTTPServer((host, port), Handler)
+    self.httpd.daemon_threads = True
+    self.port = port
+
+  def start(self) -> None:
+    Thread(target=self.httpd.serve_forever, daemon=True).start()
+    self.log.info(f"health server listening on port {self.port}")
+
+  def __live(self) -> tuple[int, str, str]:
+    return (200, "text/plain", "ok\n")
+
+  def __ready(self) -> tuple[int, str, str]:
+    if self.readiness.is_ready():
+      return (200, "text/plain", "ready\n")
+    return (503, "text/plain", f"waiting for: {', '.join(self.readiness.pending())}\n")
+
+  def __metrics(self) -> tuple[int, str, str]:
+    return (200, "text/plain; version=0.0.4; charset=utf-8", metrics.exposition())
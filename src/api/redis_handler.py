@@ -4,9 +4,72 @@ import typing as t
 import time
 import uuid
 from random import randint
-from utils import log_utils
+from collections import Counter
+from utils import log_utils, metrics
+from api.stream_read_tuner import StreamReadTuner, next_fair_read, read_limit, interleave_streams
+from utils.in_flight_budget import InFlightBudget
 import threading
 
+redis_command_seconds = metrics.histogram(
+  "analyzer_redis_command_seconds",
+  "latency of the stream commands, 'xreadgroup' includes the time it blocked for new messages, "
+  "'xack' the XDEL of the acked messages if they are deleted",
+  ("command",),
+)
+
+
+class StreamAck:
+  """
+  The 'ack' function of a stream message. Calling it acks the message with a round trip of its own,
+  'RedisHandler.ack_batch' acks many of them together instead.
+  With an 'AsyncRedisHandler', calling it returns the coroutine to await.
+  The message is given back to the in-flight 'budget' when it is ack-ed or released.
+  """
+
+  def __init__(
+    self, 
+    handler, 
+    stream_name: str, 
+    consumer_group: str, 
+    message_id: str, 
+    delete: bool = False,
+    budget: InFlightBudget | None = None,
+    size: int = 0,
+  ):
+    self.handler = handler
+    self.stream_name = stream_name
+    self.consumer_group = consumer_group
+    self.message_id = message_id
+    self.delete = delete
+    self.budget = budget
+    self.size = size
+
+  def __call__(self):
+    self.release()
+    return self.handler.ack_many(self.stream_name, self.consumer_group, [self.message_id], delete=self.delete)
+
+  def release(self) -> None:
+    """Give the message back to the budget, only once, whether it is ack-ed or left pending in the stream."""
+    if self.budget is not None:
+      budget, self.budget = self.budget, None
+      budget.give_back(self.size)
+
+
+def message_size(message: tuple[str, dict]) -> int:
+  """Size of the fields of a stream message, what is held in memory until it is ack-ed."""
+  return sum(len(key) + len(value) for key, value in message[1].items())
+
+
+def decode_stream_reply(reply: list) -> list[tuple[str, list[tuple[str, dict[bytes, bytes]]]]]:
+  """
+  The stream names and the message ids of an XREADGROUP reply read without 'decode_responses' as 'str',
+  the fields of the messages stay 'bytes', they are parsed straight from them.
+  """
+  return [
+    (stream_name.decode(), [(message_id.decode(), fields) for message_id, fields in stream_messages])
+    for stream_name, stream_messages in reply
+  ]
+
 
 class RedisHandler:
 
@@ -21,12 +84,20 @@ class RedisHandler:
   def __connect(self):
     # TODO: redis cluster connection
     self.r = redis.Redis(host=self.host, port=self.port, decode_responses=True)
+    # the stream reads, the messages are not decoded to 'str' before they are parsed
+    self.raw = redis.Redis(host=self.host, port=self.port, decode_responses=False)
 
     backoff = randint(500, 1000)
-    while not self.r.ping():
+    while not self.__ping():
       self.log.info(f"redis not ready, waiting {backoff} milliseconds")
       time.sleep(backoff / 1000)
-      backoff *= 2
+      backoff = min(backoff * 2, 30000)
+
+  def __ping(self) -> bool:
+    try:
+      return self.r.ping()
+    except redis.exceptions.ConnectionError:
+      return False
 
   def consume_stream(
     self, 
@@ -34,16 +105,49 @@ class RedisHandler:
     consumer_group, 
     callback: t.Callable[[tuple[str, t.Any], t.Callable[[], None]], None], 
     *callback_args,
+    read_tuner: StreamReadTuner | None = None,
+    **kwargs,
+  ):
+    """Consume a single stream, see 'consume_streams'."""
+    self.consume_streams(
+      [stream_name], 
+      consumer_group, 
+      callback, 
+      *callback_args, 
+      read_tuners={stream_name: read_tuner} if read_tuner is not None else None,
+      **kwargs,
+    )
+
+  def consume_streams(
+    self, 
+    stream_names: list[str], 
+    consumer_group, 
+    callback: t.Callable[[tuple[str, t.Any], t.Callable[[], None]], None], 
+    *callback_args,
     claim_messages_idle_millis: int = 30000, # 30s
     claim_check_interval_millis: int = 120000, # 2m
     claim_max_count: int = 20,
+    delete_acked: bool = False,
+    read_tuners: dict[str, StreamReadTuner] | None = None,
+    in_flight_budget: InFlightBudget | None = None,
   ):
+    """
+    Consume several streams with the same consumer group, with one XREADGROUP for all of them.
+    The messages of a read are passed to the callback round-robin between the streams,
+    the 'ack' function of a message knows its stream. The fields of the messages are passed as 'bytes'.
+    With an 'in_flight_budget', the reads pause while too many messages are not ack-ed yet,
+    the unread messages stay in the streams for the other consumers.
+    """
     
     consumer_name = f"{consumer_group}_{uuid.uuid4().hex}"
-    xread_count = 10
-    xread_timeout = 10000
 
-    self.__try_create_consumer_group(stream_name, consumer_group)
+    # adapts the COUNT and BLOCK of the reads to the lag of the group and to the capacity of the consumer
+    if read_tuners is None:
+      read_tuners = {}
+    tuners = [read_tuners.get(stream_name) or StreamReadTuner(stream_name) for stream_name in stream_names]
+
+    for stream_name in stream_names:
+      self.__try_create_consumer_group(stream_name, consumer_group)
 
     # 1. process any pending messages (something happened between consuming and acking a message)
     # 2. try to process any new messages + ack + delete processed messages (cleanup, also prevent trimming)
@@ -54,7 +158,7 @@ class RedisHandler:
     autoclaim_thread = threading.Thread(
       target=self.__auto_claim, 
       args=(
-        stream_name, 
+        stream_names, 
         consumer_group, 
         consumer_name, 
         autoclaim_exit, 
@@ -65,29 +169,47 @@ class RedisHandler:
     )
     autoclaim_thread.start()
 
-    self.log.info(f"consumer starting in consumer group {consumer_group}, consumer name: {consumer_name}")
-    last_id = "0"
-    check_pending_messages = True
+    self.log.info(f"consumer starting in consumer group {consumer_group}, consumer name: {consumer_name}, streams: {stream_names}")
+
+    # tracked per stream, each stream switches between its pending and its new messages on its own
+    last_ids = {stream_name: "0" for stream_name in stream_names}
+    check_pending_messages = {stream_name: True for stream_name in stream_names}
     while True:
 
-      if check_pending_messages:
-        # consume all pending messages since the last acked one
-        id = last_id
-      else:
-        # only consume new messages
-        id = ">"
+      # consume all pending messages since the last acked one, or only new messages
+      streams = {
+        stream_name: last_ids[stream_name] if check_pending_messages[stream_name] else ">" 
+        for stream_name in stream_names
+      }
       
       try:
-        messages = self.r.xreadgroup(
-          groupname=consumer_group, 
-          consumername=consumer_name, 
-          streams={stream_name: id}, 
-          block=xread_timeout,
-          count=xread_count
-        )
+        if in_flight_budget is not None and not in_flight_budget.wait_for_room(timeout=1):
+          # the downstream is saturated, checks again after the timeout
+          self.log.debug("in-flight budget saturated, pausing reads")
+          continue
+
+        for tuner in tuners:
+          if tuner.lag_check_due():
+            tuner.set_lag(self.__get_group_lag(tuner.stream_name, consumer_group))
+
+        room = in_flight_budget.room() if in_flight_budget is not None else None
+        xread_count, xread_timeout = next_fair_read(tuners)
+        if room is not None:
+          xread_count = min(xread_count, room)
+        # taken before the callbacks change the capacity
+        limit = read_limit(tuners, room)
+        with redis_command_seconds.time(command="xreadgroup"):
+          messages = decode_stream_reply(self.raw.xreadgroup(
+            groupname=consumer_group, 
+            consumername=consumer_name, 
+            streams=streams, 
+            block=xread_timeout,
+            count=xread_count
+          ))
       except redis.exceptions.ConnectionError:
         # try to connect again
         self.__connect()
+        continue
       except Exception:
         self.log.exception("unknown error while consuming message")
         return
@@ -98,6 +220,15 @@ class RedisHandler:
         autoclaim_thread.join()
         return
 
+      # streams without new messages are left out of the reply
+      returned = {stream_name: stream_messages for stream_name, stream_messages in messages}
+      # only the messages handed to the callback are counted, the ones over the limit are read again
+      taken = interleave_streams(messages)[:limit]
+      taken_counts = Counter(stream_name for stream_name, _ in taken)
+      for tuner in tuners:
+        taken_count = taken_counts[tuner.stream_name]
+        tuner.observe_read(xread_count, taken_count, len(returned.get(tuner.stream_name, [])) - taken_count)
+
       if len(messages) == 0:
         self.log.debug(f"{xread_timeout} millis passed, no new messages")
         continue
@@ -106,11 +237,13 @@ class RedisHandler:
       # we can start consuming new messages (there are no more pending messages)
       # when consuming new messages, the length will never be 0, 
       # we will check pending messages since the last acked message after every new read
-      was_pending = check_pending_messages
-      check_pending_messages = len(messages[0][1]) != 0 
+      was_pending = dict(check_pending_messages)
+      for stream_name, stream_messages in returned.items():
+        check_pending_messages[stream_name] = len(stream_messages) != 0
 
-      # consume the messages, either pending or new
-      for message in messages[0][1]:
+      # consume the messages, either pending or new, the COUNT applies to each stream, so the messages over the limit
+      # are left pending, 'last_ids' stays before them and the next read of the pending messages returns them
+      for stream_name, message in taken:
         try:
 
           # process the message
@@ -120,22 +253,23 @@ class RedisHandler:
 
           message_id = message[0]
 
-          callback(message, self.__make_ack_function(stream_name, consumer_group, message_id), *callback_args)
+          size = message_size(message) if in_flight_budget is not None else 0
+          ack = StreamAck(
+            self, stream_name, consumer_group, message_id, delete=delete_acked, budget=in_flight_budget, size=size,
+          )
+          if in_flight_budget is not None:
+            # held until the message is ack-ed, or its batch is released
+            in_flight_budget.take(size)
+          callback(message, ack, *callback_args)
           self.log.debug(f"processed message {message_id}")
 
-          if was_pending:
-            self.log.debug(f"consumed pending message {message_id}")
+          if was_pending[stream_name]:
+            self.log.debug(f"consumed pending message {message_id} of {stream_name}")
           else:
-            self.log.debug(f"consumed message {message_id}")
+            self.log.debug(f"consumed message {message_id} of {stream_name}")
 
           # reset the last_id so we consume pending messages starting from this id in the next iteration
-          last_id = message[0]
-
-          # TODO: decide on this
-          # do we want to delete?
-          # we might only want to regularly trim, or use a capped stream
-          # self.r.xdel(stream_name, message[0])
-          # self.log.debug(f"deleted message {message}")
+          last_ids[stream_name] = message_id
 
         except Exception:
           self.log.exception("error while processing message, waiting for autoclaim thread to finish, exiting")
@@ -143,16 +277,71 @@ class RedisHandler:
           autoclaim_thread.join()
           raise
 
-  def __make_ack_function(self, stream_name, consumer_group, message_id):
-    def ack():
-      self.r.xack(stream_name, consumer_group, message_id)
-      self.log.debug(f"ack-d message {message_id}")
-    return ack
+  def __get_group_lag(self, stream_name: str, consumer_group: str) -> int | None:
+    # the lag is reported since redis 7, and it is None if redis can't compute it, e.g. after XDEL
+    try:
+      for group in self.r.xinfo_groups(stream_name):
+        if group["name"] == consumer_group:
+          return group.get("lag")
+    except redis.exceptions.ResponseError:
+      self.log.exception(f"error while getting the lag of consumer group {consumer_group}")
+    return None
+
+  def ack_many(self, stream_name: str, consumer_group: str, message_ids: list[str], delete: bool = False) -> None:
+    """Ack the messages with a single XACK, and delete them from the stream in the same round trip if 'delete' is set."""
+    if len(message_ids) == 0:
+      return
+
+    if delete:
+      pipe = self.r.pipeline(transaction=False)
+      pipe.xack(stream_name, consumer_group, *message_ids)
+      pipe.xdel(stream_name, *message_ids)
+      with redis_command_seconds.time(command="xack"):
+        pipe.execute()
+      self.log.debug(f"ack-d and deleted {len(message_ids)} messages")
+    else:
+      with redis_command_seconds.time(command="xack"):
+        self.r.xack(stream_name, consumer_group, *message_ids)
+      self.log.debug(f"ack-d {len(message_ids)} messages")
+
+  def ack_batch(self, acks: list[t.Callable[[], None]]) -> None:
+    """
+    Ack the messages of a batch, the 'StreamAck's with one XACK per stream and consumer group,
+    pipelined in one round trip. Other ack functions are called one by one.
+    """
+    grouped: dict[tuple[str, str, bool], list[str]] = {}
+    for ack in acks:
+      if isinstance(ack, StreamAck) and ack.handler is self:
+        grouped.setdefault((ack.stream_name, ack.consumer_group, ack.delete), []).append(ack.message_id)
+        # the batch is done with, even if the XACK fails and the messages stay pending
+        ack.release()
+      else:
+        ack()
+
+    if len(grouped) == 1:
+      for (stream_name, consumer_group, delete), message_ids in grouped.items():
+        self.ack_many(stream_name, consumer_group, message_ids, delete=delete)
+      return
+
+    # a batch read from several streams is still ack-ed in a single round trip
+    pipe = self.r.pipeline(transaction=False)
+    for (stream_name, consumer_group, delete), message_ids in grouped.items():
+      pipe.xack(stream_name, consumer_group, *message_ids)
+      if delete:
+        pipe.xdel(stream_name, *message_ids)
+    with redis_command_seconds.time(command="xack"):
+      pipe.execute()
+
+  def release_batch(self, acks: list[t.Callable[[], None]]) -> None:
+    """Give the messages of a batch back to the in-flight budget without ack-ing them, they stay pending."""
+    for ack in acks:
+      if isinstance(ack, StreamAck):
+        ack.release()
 
 
   def __auto_claim(
     self, 
-    stream_name, 
+    stream_names: list[str], 
     consumer_group, 
     consumer_name, 
     exit_event: threading.Event,
@@ -175,20 +364,21 @@ class RedisHandler:
       if millis_without_checking >= claim_check_interval_millis:
         millis_without_checking = 0
 
-        try:
-          claimed = self.r.xautoclaim(
-            stream_name, 
-            consumer_group, 
-            consumer_name, 
-            min_idle_time=claim_messages_idle_millis, 
-            start_id="0-0", 
-            count=claim_max_count, 
-            justid=True,
-          )
-          if len(claimed) > 0:
-            self.log.debug(f"autoclaimed messages, total claimed pending messages: {len(claimed)}")
-        except Exception:
-          self.log.exception("error while autoclaiming messages")
+        for stream_name in stream_names:
+          try:
+            claimed = self.r.xautoclaim(
+              stream_name, 
+              consumer_group, 
+              consumer_name, 
+              min_idle_time=claim_messages_idle_millis, 
+              start_id="0-0", 
+              count=claim_max_count, 
+              justid=True,
+            )
+            if len(claimed) > 0:
+              self.log.debug(f"autoclaimed messages of {stream_name}, total claimed pending messages: {len(claimed)}")
+          except Exception:
+            self.log.exception(f"error while autoclaiming messages of {stream_name}")
       
       time.sleep(check_interval / 1000)
       millis_without_checking += check_interval
@@ -1,16 +1,31 @@
 from typing import Callable
 from api.scraped_articles.article_consumer import ScrapedArticleConsumer
-from threading import Thread, Event, RLock
-from time import sleep
+from api.scraped_articles.batch_sizing import (
+  AdaptiveBatchSize,
+  flushes_total,
+  queue_age_seconds,
+  flush_wait_seconds,
+  batch_sizes,
+)
+from threading import Thread, Event, Condition, RLock
+import time
 from utils import log_utils
 
 class ArticleBatcher:
+  """
+  Collects the articles into batches. A batch is flushed when it reaches the target batch size,
+  or when its oldest article has waited 'max_batch_timeout_millis', whichever comes first.
+  The target size adapts between 'min_batch_size' and 'max_batch_size' to the load, see 'AdaptiveBatchSize',
+  with 'adaptive_batch_size' off, it is always 'max_batch_size'.
+  """
 
   def __init__(
-    self, 
-    consumer: ScrapedArticleConsumer, 
-    max_batch_size: int = 1000, 
-    max_batch_timeout_millis: int = 5000
+    self,
+    consumer: ScrapedArticleConsumer,
+    max_batch_size: int = 1000,
+    max_batch_timeout_millis: int = 5000,
+    min_batch_size: int = 1,
+    adaptive_batch_size: bool = True,
   ):
     self.log = log_utils.create_console_logger(
       self.__class__.__name__,
@@ -18,104 +33,175 @@ class ArticleBatcher:
     self.__consumer = consumer
     self.__max_batch_size = max_batch_size
     self.__max_batch_timeout_millis = max_batch_timeout_millis
+    self.__batch_size = AdaptiveBatchSize(min_batch_size, max_batch_size, adaptive=adaptive_batch_size)
 
     self.__queue = []
-    self.__interval_thread = None
+    self.__deadline_thread = None
     self.__acks_to_call = []
-  
+
+    # arrival time of the oldest article in the queue, None if it is empty
+    self.__oldest_arrival = None
+    # since when the batcher is taking articles for the next batch
+    self.__accepting_since = time.monotonic()
+
   def consume_batched_articles(self, callback: Callable[[list[dict]], None], *callback_args) -> None:
-    
-    self.__consume_callback = callback
-    self.__consume_args = callback_args
+    """Consume the articles in batches, all messages of a batch are ack-ed after the callback returns."""
+    self.__consume(callback, callback_args, ack_after_callback=True)
 
-    if self.__interval_thread is not None:
-      self.__interval_thread.stop_flag.set()
-      self.__interval_thread.join()
-      self.__interval_thread = None
+  def consume_unacked_batches(
+    self,
+    callback: Callable[[list[dict], list[Callable[[], None]]], None],
+    *callback_args
+  ) -> None:
+    """Consume the articles in batches, the callback receives the 'ack' functions of the batch and has to call them."""
+    self.__consume(callback, callback_args, ack_after_callback=False)
 
-    self.__skip_iteration_flag = Event()
-    self.__stop_flag = Event()
-    self.__queue_lock = RLock()
+  def __consume(self, callback: Callable, callback_args: tuple, ack_after_callback: bool) -> None:
 
-    def callback_wrapper():
-      try:
-        self.__queue_lock.acquire()
-        if len(self.__queue) > 0:
-          self.__consume_callback(self.__queue, *self.__consume_args)
+    self.__consume_callback = callback
+    self.__consume_args = callback_args
+    self.__ack_after_callback = ack_after_callback
 
-        # ack the messages on successful processing
-        self._ack_messages()
+    if self.__deadline_thread is not None:
+      self.__deadline_thread.stop_flag.set()
+      self.__deadline_thread.join()
+      self.__deadline_thread = None
 
-        self.__queue = []
-      finally:
-        self.__queue_lock.release()
+    self.__queue_lock = RLock()
+    self.__queue_changed = Condition(self.__queue_lock)
 
-    self.__interval_thread = IntervalThread(
+    self.__deadline_thread = DeadlineThread(
       self.__max_batch_timeout_millis,
-      self.__skip_iteration_flag,
-      self.__stop_flag,
-      target=callback_wrapper
-    )     
-    self.__interval_thread.start()
+      self.__queue_changed,
+      Event(),
+      oldest_arrival=lambda: self.__oldest_arrival,
+      flush=lambda: self.__flush("deadline"),
+    )
+    self.__deadline_thread.start()
 
+    self.__consumer.set_read_capacity(self.__max_batch_size - len(self.__queue))
     self.__consumer.consume_article(self._add_article)
-    
-  def _add_article(self, article: dict, ack: Callable[[], None]) -> None:
 
-    # skip an iteration of the timeout interval thread, this function only gets called
-    # if there was an event
-    self.__skip_iteration_flag.set()
+  def _add_article(self, article: dict, ack: Callable[[], None]) -> None:
 
     try:
       self.__queue_lock.acquire()
 
-      self.log.info("adding article to queue")
+      self.log.debug("adding article to queue")
       self.__queue.append(article)
 
       # add the 'ack' function to call after the message is processed by the batch function
       self.__acks_to_call.append(ack)
 
-      if len(self.__queue) == self.__max_batch_size:
-        # consume and skip interval
-        self.log.info(f"max batch size of {self.__max_batch_size} reached, calling callback")
-        self.__consume_callback(self.__queue, *self.__consume_args)
-
-        # ack the messages on successful processing
-        self._ack_messages()
-        self.__queue = []
+      if self.__oldest_arrival is None:
+        # the first article of the batch starts its deadline
+        self.__oldest_arrival = time.monotonic()
+        self.__queue_changed.notify()
+
+      target = self.__batch_size.target
+      if len(self.__queue) >= target:
+        self.log.info(f"target batch size of {target} reached, calling callback")
+        self.__flush("size")
+      else:
+        # lets the consumer read only as many articles as fit in the largest batch,
+        # a backlog read at once fills the next batches right away, which grows the target size
+        self.__consumer.set_read_capacity(self.__max_batch_size - len(self.__queue))
     finally:
         self.__queue_lock.release()
-  
-  def _ack_messages(self) -> None:
-    while len(self.__acks_to_call) > 0:
-      ack = self.__acks_to_call.pop()
-      ack()
-  
 
-class IntervalThread(Thread):
+  def __flush(self, reason: str) -> None:
+    # has to be called while holding the queue lock
+    # swap the queue, so the callback owns the batch it receives
+    batch, acks = self.__queue, self.__acks_to_call
+    self.__queue, self.__acks_to_call = [], []
+
+    flushed_at = time.monotonic()
+    flushes_total.inc(reason=reason)
+    batch_sizes.observe(len(batch), reason=reason)
+    flush_wait_seconds.set(flushed_at - self.__oldest_arrival)
+    queue_age_seconds.set(0)
+    fill_seconds = flushed_at - self.__accepting_since
+    self.__oldest_arrival = None
 
-  def __init__(self, interval_millis: int, skip_iteration_flag: Event, stop_flag: Event, *args, **kwargs):
-    super().__init__(*args, **kwargs)
+    try:
+      self.__process(batch, acks)
+    finally:
+      self.__accepting_since = time.monotonic()
+      self.__batch_size.observe(len(batch), fill_seconds, self.__accepting_since - flushed_at)
+      self.__consumer.set_read_capacity(self.__max_batch_size)
+
+  def __process(self, batch: list[dict], acks: list[Callable[[], None]]) -> None:
+    # never raises, the flush runs on the reader and on the deadline thread, which keep going with the next batch
+    try:
+      if not self.__ack_after_callback:
+        # the callback takes over the acks, unless it fails to take the batch
+        self.__consume_callback(batch, acks, *self.__consume_args)
+        return
+
+      self.__consume_callback(batch, *self.__consume_args)
+    except Exception:
+      # the messages are not ack-ed, they stay pending and can be claimed again
+      self.log.exception(f"error while processing batch of {len(batch)} articles, skipping ack")
+      try:
+        self.release_messages(acks)
+      except Exception:
+        self.log.exception(f"error while releasing {len(acks)} messages")
+      return
+
+    try:
+      # ack the messages on successful processing
+      self.ack_messages(acks)
+    except Exception:
+      # the messages stay pending and are claimed again, storing them again is idempotent
+      self.log.exception(f"error while acking {len(acks)} messages")
+
+  def ack_messages(self, acks: list[Callable[[], None]]) -> None:
+    """Ack the messages of a batch through the consumer, which can ack them together."""
+    self.__consumer.ack_batch(acks)
+
+  def release_messages(self, acks: list[Callable[[], None]]) -> None:
+    """Give up on the messages of a batch without ack-ing them, they stay pending and can be claimed again."""
+    self.__consumer.release_batch(acks)
+
+
+class DeadlineThread(Thread):
+  """Flushes the batch when its oldest article is 'max_wait_millis' old, it sleeps until then."""
+
+  def __init__(
+    self,
+    max_wait_millis: int,
+    queue_changed: Condition,
+    stop_flag: Event,
+    oldest_arrival: Callable[[], float | None],
+    flush: Callable[[], None],
+  ):
+    super().__init__()
     self.log = log_utils.create_console_logger(
       self.__class__.__name__,
     )
-    self.interval_seconds = interval_millis / 1000
-    self.skip_iteration_flag = skip_iteration_flag
+    self.max_wait_seconds = max_wait_millis / 1000
+    self.queue_changed = queue_changed
     self.stop_flag = stop_flag
+    self.oldest_arrival = oldest_arrival
+    self.flush = flush
     self.daemon = True
-  
-  def run(self) -> None:
-    self.log.info("starting interval thread")
-    while True:
-      if (self.stop_flag.is_set()):
-        break
-
-      sleep(self.interval_seconds)
 
-      if not self.skip_iteration_flag.is_set():
-        self.log.debug("calling target")
-        self._target()
-      else: 
-        self.log.debug("interval thread skipped iteration")
-
-      self.skip_iteration_flag.clear()
+  def run(self) -> None:
+    self.log.info("starting deadline thread")
+    with self.queue_changed:
+      while not self.stop_flag.is_set():
+        oldest_arrival = self.oldest_arrival()
+        if oldest_arrival is None:
+          # notified by the first article of the next batch, the timeout only lets it see the stop flag
+          self.queue_changed.wait(timeout=1)
+          continue
+
+        age = time.monotonic() - oldest_arrival
+        queue_age_seconds.set(age)
+        if age >= self.max_wait_seconds:
+          self.log.info(f"oldest article waited {age * 1000:.0f} millis, calling callback")
+          self.flush()
+          continue
+
+        # wake up at the deadline, or at least every second to update the queue age
+        self.queue_changed.wait(timeout=min(self.max_wait_seconds - age, 1))
@@ -9,4 +9,16 @@ class ScrapedArticleConsumer(ABC):
   def consume_article(self, callback: Callable[[dict, Callable[[], None]], None], *callback_args) -> None:
     """Consume a scraped article with a callback, which takes a 'dict', an 'ack' function, and args."""
     raise NotImplementedError
-  
\ No newline at end of file
+
+  def ack_batch(self, acks: list[Callable[[], None]]) -> None:
+    """Ack the messages of a batch, implementations can override it to ack them in fewer round trips."""
+    for ack in acks:
+      ack()
+
+  def release_batch(self, acks: list[Callable[[], None]]) -> None:
+    """Called with the messages of a batch which won't be ack-ed, implementations can free what they hold for them."""
+    pass
+
+  def set_read_capacity(self, capacity: int) -> None:
+    """Hint of how many more articles the caller can take right away, implementations can size their reads by it."""
+    pass
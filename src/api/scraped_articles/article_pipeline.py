@@ -0,0 +1,93 @@
+from typing import Any, Callable
+from api.scraped_articles.article_batcher import ArticleBatcher
+from threading import Thread
+from queue import Queue
+from utils import log_utils
+
+
+class ArticlePipeline:
+  """
+  Runs the intake, the analysis and the storage of article batches as separate stages,
+  connected by bounded queues. While a batch is being stored, the next one can be analyzed
+  and the one after that can be read.
+  """
+
+  def __init__(
+    self,
+    batcher: ArticleBatcher,
+    max_queued_batches: int = 2,
+  ):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.__batcher = batcher
+
+    # bounded, so a slow stage blocks the previous one instead of piling up batches in memory
+    self.__analyze_queue = Queue(maxsize=max_queued_batches)
+    self.__store_queue = Queue(maxsize=max_queued_batches)
+
+    self.__analyze_thread = None
+    self.__store_thread = None
+
+  def consume_pipelined_articles(
+    self,
+    analyze: Callable[[list[dict]], Any],
+    store: Callable[[Any], Any],
+  ) -> None:
+    """
+    Consume the articles in batches, 'analyze' is called with each batch, 'store' with the result of 'analyze'.
+    The messages of a batch are ack-ed only after 'store' returns for that batch.
+    If 'analyze' returns None, there is nothing to store, the messages are ack-ed right away.
+    """
+
+    self.__analyze = analyze
+    self.__store = store
+
+    if self.__analyze_thread is None:
+      self.__analyze_thread = Thread(target=self.__run_analyze_stage, daemon=True)
+      self.__analyze_thread.start()
+
+    if self.__store_thread is None:
+      self.__store_thread = Thread(target=self.__run_store_stage, daemon=True)
+      self.__store_thread.start()
+
+    self.__batcher.consume_unacked_batches(self.__enqueue_batch)
+
+  def __enqueue_batch(self, batch: list[dict], acks: list[Callable[[], None]]) -> None:
+    # blocks the intake while the analysis stage is saturated
+    self.log.info(f"queueing batch of {len(batch)} articles for analysis")
+    self.__analyze_queue.put((batch, acks))
+
+  def __run_analyze_stage(self) -> None:
+    self.log.info("starting analysis stage")
+    while True:
+      batch, acks = self.__analyze_queue.get()
+      try:
+        result = self.__analyze(batch)
+      except Exception:
+        # the messages are not ack-ed, they stay pending and can be claimed again
+        self.log.exception(f"error while analyzing batch of {len(batch)} articles, skipping batch")
+        self.__batcher.release_messages(acks)
+        continue
+
+      # blocks the analysis while the storage stage is saturated
+      self.__store_queue.put((result, acks))
+
+  def __run_store_stage(self) -> None:
+    self.log.info("starting storage stage")
+    while True:
+      result, acks = self.__store_queue.get()
+      try:
+        if result is not None:
+          self.__store(result)
+      except Exception:
+        self.log.exception(f"error while storing batch, skipping ack for {len(acks)} messages")
+        self.__batcher.release_messages(acks)
+        continue
+
+      # ack the messages only after a successful write
+      try:
+        self.__batcher.ack_messages(acks)
+      except Exception:
+        # the messages stay pending and are claimed again, storing them again is idempotent
+        self.log.exception(f"error while acking {len(acks)} messages")
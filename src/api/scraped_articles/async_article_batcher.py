@@ -0,0 +1,131 @@
+from typing import Any, Awaitable, Callable
+from api.scraped_articles.async_article_consumer import AsyncScrapedArticleConsumer
+from api.scraped_articles.batch_sizing import (
+  AdaptiveBatchSize,
+  flushes_total,
+  queue_age_seconds,
+  flush_wait_seconds,
+  batch_sizes,
+)
+from utils import log_utils
+import asyncio
+import time
+
+
+class AsyncArticleBatcher:
+  """
+  The asyncio variant of 'ArticleBatcher'. A batch is flushed when it reaches the target batch size,
+  or 'max_batch_timeout_millis' after its first article arrived, by a timer task instead of the deadline thread.
+  Up to 'max_in_flight_batches' batches are processed concurrently while the next one is read,
+  reading waits when that many are in flight.
+  """
+
+  def __init__(
+    self,
+    consumer: AsyncScrapedArticleConsumer,
+    max_batch_size: int = 1000,
+    max_batch_timeout_millis: int = 5000,
+    max_in_flight_batches: int = 1,
+    min_batch_size: int = 1,
+    adaptive_batch_size: bool = True,
+  ):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.__consumer = consumer
+    self.__max_batch_size = max_batch_size
+    self.__max_batch_timeout_millis = max_batch_timeout_millis
+    self.__max_in_flight_batches = max_in_flight_batches
+    self.__batch_size = AdaptiveBatchSize(min_batch_size, max_batch_size, adaptive=adaptive_batch_size)
+
+    self.__queue = []
+    self.__acks_to_call = []
+    self.__timer = None
+    self.__in_flight = set()
+
+    # the articles keep arriving while batches are in flight, the next batch fills from the previous flush on
+    self.__oldest_arrival = None
+    self.__last_flush = time.monotonic()
+
+  async def consume_batched_articles(self, callback: Callable[[list[dict]], Awaitable[Any]], *callback_args) -> None:
+    """Consume the articles in batches, all messages of a batch are ack-ed after the callback returns."""
+    self.__consume_callback = callback
+    self.__consume_args = callback_args
+    self.__slots = asyncio.Semaphore(self.__max_in_flight_batches)
+
+    self.__consumer.set_read_capacity(self.__max_batch_size - len(self.__queue))
+    try:
+      await self.__consumer.consume_article(self._add_article)
+    finally:
+      if self.__timer is not None:
+        self.__timer.cancel()
+
+  async def _add_article(self, article: dict, ack: Callable[[], Awaitable[Any]]) -> None:
+    self.log.debug("adding article to queue")
+    self.__queue.append(article)
+    self.__acks_to_call.append(ack)
+
+    if len(self.__queue) == 1:
+      # the first article of the batch starts its timeout
+      self.__oldest_arrival = time.monotonic()
+      self.__timer = asyncio.create_task(self.__flush_after_timeout())
+
+    target = self.__batch_size.target
+    if len(self.__queue) >= target:
+      self.log.info(f"target batch size of {target} reached, calling callback")
+      await self.__flush("size")
+    else:
+      # lets the consumer read only as many articles as fit in the largest batch,
+      # a backlog read at once fills the next batches right away, which grows the target size
+      self.__consumer.set_read_capacity(self.__max_batch_size - len(self.__queue))
+
+  async def __flush_after_timeout(self) -> None:
+    await asyncio.sleep(self.__max_batch_timeout_millis / 1000)
+    # cleared first, so the flush doesn't cancel the task running it
+    self.__timer = None
+    if len(self.__queue) > 0:
+      self.log.info(f"batch timeout of {self.__max_batch_timeout_millis} millis reached, calling callback")
+      await self.__flush("deadline")
+
+  async def __flush(self, reason: str) -> None:
+    # swap the queue before the first await, so the batch isn't changed while waiting for a slot
+    batch, acks = self.__queue, self.__acks_to_call
+    self.__queue, self.__acks_to_call = [], []
+    if self.__timer is not None:
+      self.__timer.cancel()
+      self.__timer = None
+
+    flushed_at = time.monotonic()
+    flushes_total.inc(reason=reason)
+    batch_sizes.observe(len(batch), reason=reason)
+    flush_wait_seconds.set(flushed_at - self.__oldest_arrival)
+    queue_age_seconds.set(0)
+    fill_seconds = flushed_at - self.__last_flush
+    self.__oldest_arrival = None
+    self.__last_flush = flushed_at
+    self.__consumer.set_read_capacity(self.__max_batch_size)
+
+    # waits while too many batches are in flight, which stops the reading
+    await self.__slots.acquire()
+    task = asyncio.create_task(self.__process(batch, acks, fill_seconds))
+    self.__in_flight.add(task)
+    task.add_done_callback(self.__in_flight.discard)
+
+  async def __process(self, batch: list[dict], acks: list[Callable[[], Awaitable[Any]]], fill_seconds: float) -> None:
+    start = time.monotonic()
+    try:
+      await self.__consume_callback(batch, *self.__consume_args)
+    except Exception:
+      # the messages are not ack-ed, they stay pending and can be claimed again
+      self.log.exception(f"error while processing batch of {len(batch)} articles, skipping ack")
+      self.__consumer.release_batch(acks)
+      return
+    finally:
+      self.__slots.release()
+      self.__batch_size.observe(len(batch), fill_seconds, time.monotonic() - start)
+
+    try:
+      # ack the messages on successful processing
+      await self.__consumer.ack_batch(acks)
+    except Exception:
+      self.log.exception(f"error while acking {len(acks)} messages")
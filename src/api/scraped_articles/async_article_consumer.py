@@ -0,0 +1,24 @@
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable
+
+
+class AsyncScrapedArticleConsumer(ABC):
+  """The asyncio variant of 'ScrapedArticleConsumer', the callback and the 'ack' functions return awaitables."""
+
+  @abstractmethod
+  async def consume_article(self, callback: Callable[[dict, Callable[[], Awaitable[Any]]], Awaitable[None]], *callback_args) -> None:
+    """Consume a scraped article with a coroutine callback, which takes a 'dict', an 'ack' function, and args."""
+    raise NotImplementedError
+
+  async def ack_batch(self, acks: list[Callable[[], Awaitable[Any]]]) -> None:
+    """Ack the messages of a batch, implementations can override it to ack them in fewer round trips."""
+    for ack in acks:
+      await ack()
+
+  def release_batch(self, acks: list[Callable[[], Awaitable[Any]]]) -> None:
+    """Called with the messages of a batch which won't be ack-ed, implementations can free what they hold for them."""
+    pass
+
+  def set_read_capacity(self, capacity: int) -> None:
+    """Hint of how many more articles the caller can take right away, implementations can size their reads by it."""
+    pass
@@ -0,0 +1,67 @@
+from api.scraped_articles.async_article_consumer import AsyncScrapedArticleConsumer
+from api.async_redis_handler import AsyncRedisHandler
+from api.stream_read_tuner import StreamReadTuner
+from utils.in_flight_budget import InFlightBudget
+from typing import Any, Awaitable, Callable
+import orjson
+
+
+class AsyncRedisScrapedArticleConsumer(AsyncScrapedArticleConsumer):
+
+  def __init__(
+    self,
+    redis_handler: AsyncRedisHandler,
+    stream_name: str | list[str],
+    consumer_group,
+    delete_acked: bool = False,
+    max_read_count: int = 300,
+    max_read_block_millis: int = 5000,
+    in_flight_budget: InFlightBudget | None = None,
+  ):
+    self.rh = redis_handler
+    # several streams are read together, with one read tuner each
+    self.stream_names = [stream_name] if isinstance(stream_name, str) else list(stream_name)
+    self.consumer_group = consumer_group
+    self.read_tuners = {
+      name: StreamReadTuner(
+        name,
+        max_count=max_read_count,
+        max_block_millis=max_read_block_millis,
+      )
+      for name in self.stream_names
+    }
+
+    # delete the messages from the stream when they are ack-ed, so it doesn't have to be trimmed
+    self.delete_acked = delete_acked
+
+    # pauses the reads while too many messages are held, see 'RedisHandler.consume_streams'
+    self.in_flight_budget = in_flight_budget
+
+  async def consume_article(self, callback: Callable[[dict, Callable[[], Awaitable[Any]]], Awaitable[None]], *callback_args) -> None:
+
+    async def message_extractor_wrapper(message: tuple[str, dict[bytes, bytes]], ack: Callable[[], Awaitable[Any]]):
+      # parse the json redis message into a scraped article, straight from the bytes read
+      article = orjson.loads(message[1][b"article"])
+      await callback(article, ack, *callback_args)
+
+    await self.rh.consume_streams(
+      self.stream_names,
+      self.consumer_group,
+      message_extractor_wrapper,
+      delete_acked=self.delete_acked,
+      read_tuners=self.read_tuners,
+      in_flight_budget=self.in_flight_budget,
+    )
+
+  async def ack_batch(self, acks: list[Callable[[], Awaitable[Any]]]) -> None:
+    # one XACK for the whole batch instead of a round trip per message
+    await self.rh.ack_batch(acks)
+
+  def set_read_capacity(self, capacity: int) -> None:
+    # the streams share the capacity, see 'next_fair_read'
+    for tuner in self.read_tuners.values():
+      tuner.set_capacity(capacity)
+
+  def release_batch(self, acks: list[Callable[[], Awaitable[Any]]]) -> None:
+    # the messages stay pending, only the in-flight budget is given back
+    self.rh.release_batch(acks)
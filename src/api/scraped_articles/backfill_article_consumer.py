@@ -0,0 +1,164 @@
+from api.scraped_articles.article_consumer import ScrapedArticleConsumer
+from api.scraped_articles.backfill_sources import ArticleSource
+from threading import Event, Lock
+from functools import partial
+from typing import Any, Callable
+from datetime import datetime, timedelta
+from utils import log_utils
+import json
+import os
+import time
+
+
+class BackfillCheckpoint:
+  """The position of a backfill in its source, saved to 'path' after each ack-ed batch."""
+
+  def __init__(self, path: str | None):
+    self.path = path
+    # saved by the storage stage, and by the reader once it's done
+    self.__lock = Lock()
+
+  def load(self, source: ArticleSource) -> Any:
+    if self.path is None or not os.path.exists(self.path):
+      return None
+    with open(self.path) as f:
+      checkpoint = json.load(f)
+    if checkpoint.get("source") != source.description:
+      raise ValueError(f"checkpoint {self.path} is of {checkpoint.get('source')}, not of {source.description}")
+    return checkpoint.get("position")
+
+  def save(self, source: ArticleSource, position: Any, articles: int) -> None:
+    if self.path is None:
+      return
+    # written to a temporary file and renamed, so an interrupted write keeps the last checkpoint
+    tmp_path = f"{self.path}.tmp"
+    with self.__lock:
+      with open(tmp_path, "w") as f:
+        json.dump({
+          "source": source.description,
+          "position": position,
+          "articles": articles,
+          "updated_at": datetime.now().isoformat(),
+        }, f)
+      os.replace(tmp_path, self.path)
+
+
+class BackfillArticleConsumer(ScrapedArticleConsumer):
+  """
+  Reads the articles of a source instead of a stream, as fast as the batcher takes them, e.g. to re-analyze
+  the stored articles with new models. The checkpoint is the position before the oldest article which is
+  not ack-ed yet, so a restarted backfill reads again at most the batches which were in flight.
+  The articles of failed batches are never ack-ed, the checkpoint stays before them, and they're read again
+  by the next run. 'done' is set once every article is ack-ed or released.
+  """
+
+  def __init__(
+    self,
+    source: ArticleSource,
+    checkpoint: BackfillCheckpoint,
+    progress_interval_seconds: float = 10,
+  ):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.source = source
+    self.checkpoint = checkpoint
+    self.progress_interval_seconds = progress_interval_seconds
+
+    self.start_position = checkpoint.load(source)
+    self.done = Event()
+
+    self.__lock = Lock()
+    # the position to read again each article from, by the sequence number of the articles not ack-ed yet
+    self.__outstanding: dict[int, Any] = {}
+    self.__read_position = self.start_position
+    self.__read = 0
+    self.__acked = 0
+    self.__released = 0
+    self.__finished_reading = False
+
+    self.__started_at = None
+    self.__total = None
+    self.__last_progress_log = 0
+
+  @property
+  def acked(self) -> int:
+    return self.__acked
+
+  @property
+  def released(self) -> int:
+    return self.__released
+
+  def consume_article(self, callback: Callable[[dict, Callable[[], None]], None], *callback_args) -> None:
+    self.__started_at = time.monotonic()
+    self.__total = self.source.total(self.start_position)
+    self.log.info(f"backfilling from {self.source.description}, starting at {self.start_position}, total: {self.__total}")
+
+    for article, next_position in self.source.read(self.start_position):
+      with self.__lock:
+        seq = self.__read
+        self.__outstanding[seq] = self.__read_position
+        self.__read_position = next_position
+        self.__read += 1
+      # blocks while the batcher, or the pipeline behind it, is saturated
+      callback(article, partial(self.__ack, seq), *callback_args)
+
+    with self.__lock:
+      self.__finished_reading = True
+    self.log.info(f"read all {self.__read} articles, waiting for the last batches")
+    self.__check_done()
+
+  def ack_batch(self, acks: list[Callable[[], None]]) -> None:
+    for ack in acks:
+      ack()
+    with self.__lock:
+      position = self.__checkpoint_position()
+      acked = self.__acked
+    self.checkpoint.save(self.source, position, acked)
+    self.__log_progress(position)
+    self.__check_done()
+
+  def release_batch(self, acks: list[Callable[[], None]]) -> None:
+    with self.__lock:
+      self.__released += len(acks)
+    self.log.warning(f"{len(acks)} articles failed, the checkpoint stays before them")
+    self.__check_done()
+
+  def __ack(self, seq: int) -> None:
+    with self.__lock:
+      if seq in self.__outstanding:
+        del self.__outstanding[seq]
+        self.__acked += 1
+
+  def __checkpoint_position(self) -> Any:
+    # has to be called while holding the lock, the dict keeps the order of the reads
+    for seq in self.__outstanding:
+      return self.__outstanding[seq]
+    return self.__read_position
+
+  def __check_done(self) -> None:
+    with self.__lock:
+      done = self.__finished_reading and self.__acked + self.__released >= self.__read
+      position = self.__checkpoint_position()
+    if done and not self.done.is_set():
+      self.checkpoint.save(self.source, position, self.__acked)
+      self.log.info(f"backfill done, {self.__acked} articles ack-ed, {self.__released} failed, checkpoint at {position}")
+      self.done.set()
+
+  def __log_progress(self, position: Any) -> None:
+    now = time.monotonic()
+    if now - self.__last_progress_log < self.progress_interval_seconds:
+      return
+    self.__last_progress_log = now
+
+    elapsed = now - self.__started_at
+    progress = self.source.progress(self.start_position, position, self.__acked)
+    if not self.__total or progress <= 0:
+      self.log.info(f"backfilled {self.__acked} articles in {elapsed:.0f} seconds")
+      return
+
+    remaining_seconds = elapsed * (self.__total - progress) / progress
+    self.log.info(
+      f"backfilled {self.__acked} articles, {progress / self.__total * 100:.1f}% in {elapsed:.0f} seconds, "
+      f"{self.__acked / elapsed:.1f} articles/s, ETA {timedelta(seconds=round(remaining_seconds))}"
+    )
@@ -0,0 +1,153 @@
+from typing import Any, Iterator
+from elasticsearch import Elasticsearch
+from utils import log_utils
+import orjson
+import os
+
+
+class ArticleSource:
+  """
+  Stored or exported articles to re-analyze. 'read' yields each article with the position after it,
+  reading again from that position skips the article. Positions are JSON serializable, for the checkpoints.
+  The progress is measured in the units of 'total' and 'progress', e.g. bytes or articles.
+  """
+
+  description = "articles"
+
+  def read(self, position: Any = None) -> Iterator[tuple[dict, Any]]:
+    raise NotImplementedError
+
+  def total(self, position: Any = None) -> int | None:
+    """How much there is to read from 'position', None if unknown."""
+    return None
+
+  def progress(self, start: Any, position: Any, articles: int) -> int:
+    """How much was read between 'start' and 'position', 'articles' were read meanwhile."""
+    return articles
+
+
+class JsonlArticleSource(ArticleSource):
+  """Scraped articles, one JSON document per line, the position is the byte offset of the next line."""
+
+  def __init__(self, path: str):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.path = path
+    self.description = f"jsonl:{path}"
+
+  def read(self, position: int | None = None) -> Iterator[tuple[dict, int]]:
+    with open(self.path, "rb") as f:
+      f.seek(position or 0)
+      offset = position or 0
+      for line in f:
+        offset += len(line)
+        if line.strip() == b"":
+          continue
+        try:
+          yield orjson.loads(line), offset
+        except orjson.JSONDecodeError:
+          self.log.error(f"invalid JSON line before offset {offset} of {self.path}, skipping it")
+
+  def total(self, position: int | None = None) -> int:
+    return os.path.getsize(self.path) - (position or 0)
+
+  def progress(self, start: int | None, position: int | None, articles: int) -> int:
+    return (position or 0) - (start or 0)
+
+
+class ElasticsearchArticleSource(ArticleSource):
+  """
+  The stored articles of an index, read in 'page_size' pages with 'search_after' on a point in time,
+  so the pages are consistent while the articles are updated. They are sorted by their id,
+  which is the position, so a new point in time can resume where the last one stopped.
+  With 'skip_model_version', only the articles analyzed with another model version are read.
+  """
+
+  def __init__(
+    self,
+    es: Elasticsearch,
+    index: str,
+    page_size: int = 1000,
+    keep_alive: str = "5m",
+    skip_model_version: str | None = None,
+  ):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.es = es
+    self.index = index
+    self.page_size = page_size
+    self.keep_alive = keep_alive
+    self.skip_model_version = skip_model_version
+    self.description = f"elasticsearch:{index}"
+
+  def read(self, position: str | None = None) -> Iterator[tuple[dict, str]]:
+    pit_id = self.es.open_point_in_time(index=self.index, keep_alive=self.keep_alive)["id"]
+    try:
+      search_after = [position] if position is not None else None
+      while True:
+        res = self.es.search(
+          pit={"id": pit_id, "keep_alive": self.keep_alive},
+          query=self.__query(),
+          sort=[{"article.id": "asc"}],
+          search_after=search_after,
+          size=self.page_size,
+          # the embeddings are most of the document, and they are replaced anyway
+          source_includes=["article", "analyzer.category_ids"],
+          track_total_hits=False,
+        )
+        # the id of the point in time can change between the requests
+        pit_id = res.get("pit_id", pit_id)
+
+        hits = res["hits"]["hits"]
+        for hit in hits:
+          yield self.to_scraped_article(hit["_source"]), hit["sort"][0]
+        if len(hits) < self.page_size:
+          return
+        search_after = hits[-1]["sort"]
+    finally:
+      self.es.close_point_in_time(id=pit_id)
+
+  def total(self, position: str | None = None) -> int:
+    query = self.__query()
+    if position is not None:
+      query = {"bool": {"filter": [query, {"range": {"article.id": {"gt": position}}}]}}
+    return self.es.count(index=self.index, query=query)["count"]
+
+  def __query(self) -> dict:
+    if self.skip_model_version is None:
+      return {"match_all": {}}
+    return {"bool": {"must_not": [{"term": {"analyzer.model_version": self.skip_model_version}}]}}
+
+  @staticmethod
+  def to_scraped_article(source: dict) -> dict:
+    """Map a stored article back to the format of the scraper, which 'Analyzer' takes."""
+    article = source["article"]
+
+    # the stored categories are the merged ones, the metadata ones are those which weren't predicted,
+    # a category which was both is treated as predicted, and only kept if it's predicted again
+    predicted_ids = set(source.get("analyzer", {}).get("category_ids", []))
+    categories = article.get("categories", {})
+    metadata_categories = [
+      name for id, name in zip(categories.get("ids", []), categories.get("names", []))
+      if id not in predicted_ids
+    ]
+
+    components = [{"title": title} for title in article.get("title", [])]
+    components.append({"author": article.get("author", [])})
+    if article.get("publish_date") is not None:
+      components.append({"publish_date": article["publish_date"]})
+    components.append({"paragraphs": article.get("paragraphs", [])})
+    if article.get("image") is not None:
+      components.append({"image": article["image"]})
+
+    return {
+      "id": article["id"],
+      "url": article["url"],
+      "metadata": {
+        "source": article.get("source"),
+        "categories": metadata_categories,
+      },
+      "components": {"article": components},
+    }
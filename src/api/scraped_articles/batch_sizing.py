@@ -0,0 +1,100 @@
+from threading import Lock
+from utils import metrics
+import math
+
+# metrics shared by the batchers
+target_batch_size = metrics.gauge(
+  "analyzer_batcher_target_size",
+  "batch size at which the batcher flushes",
+)
+flushes_total = metrics.counter(
+  "analyzer_batcher_flushes_total",
+  "flushed batches by the reason of the flush, 'size' or 'deadline'",
+  ("reason",),
+)
+queue_age_seconds = metrics.gauge(
+  "analyzer_batcher_queue_age_seconds",
+  "age of the oldest article waiting in the batcher, 0 if it is empty",
+)
+flush_wait_seconds = metrics.gauge(
+  "analyzer_batcher_flush_wait_seconds",
+  "how long the oldest article of the last flushed batch waited in the batcher",
+)
+batch_seconds = metrics.gauge(
+  "analyzer_batcher_batch_seconds",
+  "processing time of the last batch",
+)
+batch_sizes = metrics.histogram(
+  "analyzer_batcher_batch_size",
+  "articles of the flushed batches by the reason of the flush",
+  ("reason",),
+  buckets=(1, 5, 10, 25, 50, 100, 200, 300, 500, 1000),
+)
+batch_processing_seconds = metrics.histogram(
+  "analyzer_batcher_processing_seconds",
+  "processing time of the batches, by the callback of the batcher",
+)
+
+
+class AdaptiveBatchSize:
+  """
+  Target size of the batches, the number of articles which arrive while a batch is processed.
+  Under load, when the articles arrive faster than they are processed, it grows up to 'max_size', and the overhead
+  per batch is spread over more articles. With little traffic, it shrinks down to 'min_size', so the articles
+  don't wait for a batch that won't fill up anyway. The measurements are smoothed over the batches by 'smoothing'.
+  """
+
+  # a batch fills up this much faster than it is processed only if the articles are read from a backlog
+  backlog_fill_ratio = 0.1
+  # a batch is never counted as cheaper than this, even if the callback returned right away
+  min_batch_seconds = 0.001
+
+  def __init__(self, min_size: int, max_size: int, smoothing: float = 0.3, adaptive: bool = True):
+    self.min_size = max(1, min(min_size, max_size))
+    self.max_size = max_size
+    self.smoothing = smoothing
+    self.adaptive = adaptive
+
+    # nothing is known before the first batch, start small, a backlog doubles it from batch to batch
+    self.__articles = None
+    self.__fill_seconds = None
+    self.__processing_seconds = None
+    self.__target = self.min_size if adaptive else max_size
+    self.__lock = Lock()
+    target_batch_size.set(self.__target)
+
+  @property
+  def target(self) -> int:
+    return self.__target
+
+  def observe(self, batch_size: int, fill_seconds: float, processing_seconds: float) -> None:
+    """
+    Record a processed batch, 'fill_seconds' is how long the batcher was taking articles for it,
+    'processing_seconds' how long the callback took.
+    """
+    batch_seconds.set(processing_seconds)
+    batch_processing_seconds.observe(processing_seconds)
+    if not self.adaptive or batch_size == 0:
+      return
+
+    with self.__lock:
+      self.__articles = self.__smooth(self.__articles, batch_size)
+      self.__fill_seconds = self.__smooth(self.__fill_seconds, fill_seconds)
+      self.__processing_seconds = self.__smooth(self.__processing_seconds, processing_seconds)
+
+      # the articles arriving while a batch is processed are taken by the next one
+      processing_seconds = max(self.__processing_seconds, self.min_batch_seconds)
+      arrival_rate = self.__articles / (self.__fill_seconds + processing_seconds)
+      target = math.ceil(arrival_rate * processing_seconds)
+
+      if self.__fill_seconds < self.backlog_fill_ratio * processing_seconds:
+        # reading from a backlog, the arrival rate is only as high as the throughput, grow until it's drained
+        target = max(target, 2 * self.__target)
+
+      self.__target = max(self.min_size, min(self.max_size, target))
+    target_batch_size.set(self.__target)
+
+  def __smooth(self, average: float | None, value: float) -> float:
+    if average is None:
+      return value
+    return average + self.smoothing * (value - average)
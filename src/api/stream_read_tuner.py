@@ -0,0 +1,174 @@
+from threading import Lock
+from itertools import zip_longest
+from utils import metrics
+import math
+import time
+
+read_count = metrics.gauge(
+  "analyzer_stream_read_count",
+  "COUNT of the next XREADGROUP",
+  ("stream",),
+)
+read_block_millis = metrics.gauge(
+  "analyzer_stream_read_block_millis",
+  "BLOCK of the next XREADGROUP in milliseconds",
+  ("stream",),
+)
+stream_lag = metrics.gauge(
+  "analyzer_stream_lag",
+  "estimated entries of the stream not yet delivered to the consumer group, -1 if unknown",
+  ("stream",),
+)
+read_capacity = metrics.gauge(
+  "analyzer_stream_read_capacity",
+  "articles the batcher can take before its batch is full",
+  ("stream",),
+)
+messages_total = metrics.counter(
+  "analyzer_stream_messages_total",
+  "messages read from the stream",
+  ("stream",),
+)
+reads_total = metrics.counter(
+  "analyzer_stream_reads_total",
+  "XREADGROUP calls by how much of the requested COUNT they returned",
+  ("stream", "result"),
+)
+
+
+class StreamReadTuner:
+  """
+  Picks the COUNT and BLOCK of the next stream read.
+  With a backlog, it reads as much as the batcher can take, up to 'max_count', without blocking,
+  so a backlog is drained in batch sized reads. With little or no backlog, it reads at most 'min_count',
+  which leaves new messages to the other consumers of the group, and blocks longer the longer the stream is idle.
+  """
+
+  def __init__(
+    self,
+    stream_name: str,
+    min_count: int = 10,
+    max_count: int = 300,
+    min_block_millis: int = 100,
+    max_block_millis: int = 5000,
+    lag_check_interval_millis: int = 1000,
+  ):
+    self.stream_name = stream_name
+    self.min_count = min(min_count, max_count)
+    self.max_count = max_count
+    self.min_block_millis = min_block_millis
+    self.max_block_millis = max_block_millis
+    self.lag_check_interval_seconds = lag_check_interval_millis / 1000
+
+    # None if the server can't tell the lag, only the reads are used then
+    self.__lag = None
+    self.__lag_checked_at = None
+    self.__capacity = max_count
+    self.__last_read_full = False
+    self.__block_millis = min_block_millis
+    self.__lock = Lock()
+
+  def lag_check_due(self) -> bool:
+    return self.__lag_checked_at is None or time.monotonic() - self.__lag_checked_at >= self.lag_check_interval_seconds
+
+  def set_lag(self, lag: int | None) -> None:
+    """Set the lag of the consumer group, from the 'lag' field of XINFO GROUPS."""
+    with self.__lock:
+      self.__lag = lag
+      self.__lag_checked_at = time.monotonic()
+    stream_lag.set(lag if lag is not None else -1, stream=self.stream_name)
+
+  def set_capacity(self, capacity: int) -> None:
+    """Set how many articles the batcher can take before its batch is full."""
+    with self.__lock:
+      self.__capacity = max(1, min(capacity, self.max_count))
+    read_capacity.set(capacity, stream=self.stream_name)
+
+  @property
+  def capacity(self) -> int:
+    return self.__capacity
+
+  def has_backlog(self) -> bool:
+    with self.__lock:
+      return self.__has_backlog()
+
+  def __has_backlog(self) -> bool:
+    return self.__last_read_full or (self.__lag is not None and self.__lag > 0)
+
+  def next_read(self, shares: int = 1) -> tuple[int, int]:
+    """
+    Returns the COUNT and the BLOCK in milliseconds of the next read.
+    With a backlog, the stream gets 1 / 'shares' of the capacity, when the capacity is shared by several streams.
+    """
+    with self.__lock:
+      backlog = self.__has_backlog()
+      capacity = max(1, math.ceil(self.__capacity / shares))
+
+      if backlog and self.__lag is not None:
+        count = max(self.min_count, min(self.__lag, capacity))
+      elif backlog:
+        count = capacity
+      else:
+        count = min(self.min_count, self.__capacity)
+
+      block_millis = self.min_block_millis if backlog else self.__block_millis
+
+    read_count.set(count, stream=self.stream_name)
+    read_block_millis.set(block_millis, stream=self.stream_name)
+    return (count, block_millis)
+
+  def observe_read(self, count: int, taken: int, left_over: int = 0) -> None:
+    """
+    Record the result of a read with the COUNT 'count', of which 'taken' messages were consumed,
+    and 'left_over' were over the read limit, left pending to be read again, see 'read_limit'.
+    """
+    returned = taken + left_over
+    with self.__lock:
+      self.__last_read_full = returned >= count
+      if self.__lag is not None:
+        # estimate the lag until the next check
+        self.__lag = max(0, self.__lag - taken)
+
+      if returned == 0:
+        # idle, back off to longer blocking reads
+        self.__block_millis = min(self.max_block_millis, self.__block_millis * 2)
+      else:
+        self.__block_millis = self.min_block_millis
+
+    messages_total.inc(taken, stream=self.stream_name)
+    if returned == 0:
+      result = "empty"
+    elif returned >= count:
+      result = "full"
+    else:
+      result = "partial"
+    reads_total.inc(stream=self.stream_name, result=result)
+
+
+def next_fair_read(tuners: list[StreamReadTuner]) -> tuple[int, int]:
+  """
+  Returns the COUNT and the BLOCK of a read of several streams at once.
+  The COUNT of XREADGROUP applies to each stream, so the capacity is split evenly between the streams with a backlog,
+  and a stream without one can't crowd out the others.
+  """
+  shares = max(1, sum(1 for tuner in tuners if tuner.has_backlog()))
+  reads = [tuner.next_read(shares) for tuner in tuners]
+  return (max(count for count, _ in reads), min(block for _, block in reads))
+
+
+def read_limit(tuners: list[StreamReadTuner], max_messages: int | None = None) -> int:
+  """
+  How many messages of a read of several streams are taken, at most the capacity, and 'max_messages' if set,
+  e.g. the room of the in-flight budget. The COUNT of XREADGROUP applies to each stream, so a read can return more,
+  the rest is left pending and read again with the pending messages, see 'RedisHandler.consume_streams'.
+  """
+  limit = max(tuner.capacity for tuner in tuners)
+  if max_messages is not None:
+    limit = min(limit, max_messages)
+  return max(1, limit)
+
+
+def interleave_streams(messages: list) -> list[tuple[str, tuple]]:
+  """Interleave the messages of a multi-stream read round-robin, as (stream name, message) pairs."""
+  per_stream = [[(stream, message) for message in stream_messages] for stream, stream_messages in messages]
+  return [pair for pairs in zip_longest(*per_stream) for pair in pairs if pair is not None]
@@ -0,0 +1,135 @@
+from analysis.classifier import CategoryClassifier, ModelContainer
+from analysis.embeddings import EmbeddingsModelContainer, EmbeddingsModel
+from analysis.analyzer import Analyzer
+from analysis.inference_pool import InferenceWorkerPool
+from analysis.article_deduplicator import ArticleDeduplicator
+from analysis.known_categories import KnownCategories
+
+from api.scraped_articles.article_batcher import ArticleBatcher
+from api.scraped_articles.article_pipeline import ArticlePipeline
+from api.scraped_articles.backfill_article_consumer import BackfillArticleConsumer, BackfillCheckpoint
+from api.scraped_articles.backfill_sources import JsonlArticleSource, ElasticsearchArticleSource
+
+from repository.analyzer import ElasticsearchRepository
+from utils import log_utils
+import argparse
+import sys
+import os
+
+# Re-analyzes articles with the current models, e.g. after shipping a new classifier. The articles are read
+# from a JSONL export of scraped articles, or from the articles index itself, in the largest batches, and only
+# their analysis is written back, with partial updates. The progress is checkpointed after every batch,
+# running it again with the same checkpoint resumes the backfill.
+# The models and Elasticsearch are configured with the same environment variables as 'main.py'.
+#   python src/backfill.py --index --skip-current --checkpoint backfill.json
+#   python src/backfill.py --jsonl articles.jsonl --checkpoint backfill.json
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="re-analyze stored articles with the current models")
+  source_group = parser.add_mutually_exclusive_group(required=True)
+  source_group.add_argument("--jsonl", help="file of scraped articles, one JSON document per line")
+  source_group.add_argument("--index", action="store_true", help="read the articles from the articles index")
+  parser.add_argument("--skip-current", action="store_true", help="skip the articles analyzed with the current models")
+  parser.add_argument("--checkpoint", help="file of the checkpoint, the backfill resumes from it if it exists")
+  parser.add_argument("--batch-size", type=int, default=1000)
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="inference processes, 0 runs the models in this one")
+  parser.add_argument("--threads-per-worker", type=int, default=1)
+  parser.add_argument("--max-queued-batches", type=int, default=2)
+  parser.add_argument("--progress-interval", type=float, default=10, help="seconds between the progress logs")
+  args = parser.parse_args()
+
+  # the same models, Elasticsearch and embeddings settings as the consumer, imported after the arguments
+  # so '--help' works without them, importing 'main' only reads the settings
+  from main import (
+    CAT_CLF_MODEL_PATH,
+    EMBEDDINGS_MODEL_PATH,
+    EMBEDDINGS_OPTIONS,
+    ELASTIC_CONN,
+    ELASTIC_USER,
+    ELASTIC_PASSWORD,
+    ELASTIC_CA_PATH,
+    ELASTIC_TLS_INSECURE,
+    ELASTIC_BULK_OPTIONS,
+    ELASTIC_EMBEDDINGS_OPTIONS,
+    KNOWN_CATEGORIES_MAX_ENTRIES,
+  )
+
+  log = log_utils.create_console_logger("Backfill")
+
+  repository = ElasticsearchRepository(
+    ELASTIC_CONN,
+    ELASTIC_USER,
+    ELASTIC_PASSWORD,
+    ELASTIC_CA_PATH,
+    not ELASTIC_TLS_INSECURE,
+    bulk_options=ELASTIC_BULK_OPTIONS,
+    embeddings_options=ELASTIC_EMBEDDINGS_OPTIONS,
+  )
+
+  # every core runs inference, reading and writing overlap with it in the pipeline
+  inference_pool = None
+  category_classifier = None
+  embeddings_model = None
+  if args.workers > 0:
+    inference_pool = InferenceWorkerPool(
+      CAT_CLF_MODEL_PATH,
+      EMBEDDINGS_MODEL_PATH,
+      workers=args.workers,
+      threads_per_worker=args.threads_per_worker,
+      embeddings_options=EMBEDDINGS_OPTIONS,
+    )
+    inference_pool.wait_ready()
+  else:
+    category_classifier = CategoryClassifier(ModelContainer.load(CAT_CLF_MODEL_PATH))
+    embeddings_model = EmbeddingsModel(EmbeddingsModelContainer.load(EMBEDDINGS_MODEL_PATH), **EMBEDDINGS_OPTIONS)
+
+  # 0 writes every category of every batch, like the consumer
+  known_categories = None
+  if KNOWN_CATEGORIES_MAX_ENTRIES > 0:
+    known_categories = KnownCategories(KNOWN_CATEGORIES_MAX_ENTRIES)
+    known_categories.warm(repository.get_category_ids(KNOWN_CATEGORIES_MAX_ENTRIES))
+
+  analyzer = Analyzer(
+    repository,
+    category_classifier,
+    embeddings_model,
+    inference_pool=inference_pool,
+    # the articles of an export which are already analyzed with the current models
+    deduplicator=ArticleDeduplicator(repository) if args.skip_current and args.jsonl else None,
+    concurrent_inference=inference_pool is None,
+    known_categories=known_categories,
+  )
+
+  if args.jsonl:
+    source = JsonlArticleSource(args.jsonl)
+  else:
+    source = ElasticsearchArticleSource(
+      repository.es,
+      repository.articles_index,
+      page_size=args.batch_size,
+      skip_model_version=analyzer.model_version if args.skip_current else None,
+    )
+
+  consumer = BackfillArticleConsumer(source, BackfillCheckpoint(args.checkpoint), args.progress_interval)
+
+  # the largest batches, the articles are read as fast as they are processed
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=1000,
+    adaptive_batch_size=False,
+  )
+  pipeline = ArticlePipeline(batcher, max_queued_batches=args.max_queued_batches)
+  pipeline.consume_pipelined_articles(
+    analyzer.analyze,
+    lambda analyzed: analyzer.store(analyzed, update_only=True),
+  )
+
+  consumer.done.wait()
+  if inference_pool is not None:
+    inference_pool.shutdown()
+
+  log.info(f"backfilled {consumer.acked} articles, {consumer.released} failed")
+  if consumer.released > 0:
+    sys.exit(1)
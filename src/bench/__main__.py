@@ -0,0 +1,132 @@
+from analysis.analyzer import Analyzer, stage_seconds
+from analysis.analysis_cache import AnalysisCache
+from analysis.article_deduplicator import ArticleDeduplicator
+from analysis.known_categories import KnownCategories
+from api.scraped_articles.article_batcher import ArticleBatcher
+from api.scraped_articles.article_pipeline import ArticlePipeline
+from api.scraped_articles.batch_sizing import batch_sizes
+from bench.articles import ArticleGenerator
+from bench.fakes import FakeArticleConsumer, InMemoryRepository, StubCategoryClassifier, StubEmbeddingsModel
+import numpy as np
+import argparse
+import resource
+import logging
+import json
+import time
+
+# End-to-end benchmark of the analyzer without any external service: synthetic scraped articles are read by
+# an in-memory consumer, batched by 'ArticleBatcher', processed by 'Analyzer' with stub models, and stored in
+# an in-memory repository. Prints the throughput, the latency from arrival to ack, the latencies of the stages
+# and the peak RSS as JSON, to compare runs with each other.
+# Run from the 'src' directory: python -m bench [--output results.json]
+
+
+def percentiles(values: list[float]) -> dict:
+  if len(values) == 0:
+    return {}
+  p50, p90, p99 = np.percentile(values, [50, 90, 99])
+  return {"p50": round(p50, 6), "p90": round(p90, 6), "p99": round(p99, 6), "max": round(max(values), 6)}
+
+
+def stage_latencies() -> dict:
+  # estimated from the buckets of the histograms, like a dashboard would
+  stages = {}
+  for labels, count in stage_seconds.samples():
+    stage = labels["stage"]
+    stages[stage] = {
+      "count": int(count),
+      "mean": round(stage_seconds.total(stage=stage) / count, 6),
+      **{f"p{round(q * 100)}": round(stage_seconds.quantile(q, stage=stage), 6) for q in (0.5, 0.9, 0.99)},
+    }
+  return stages
+
+
+def run(args) -> dict:
+  generator = ArticleGenerator(
+    seed=args.seed,
+    mean_paragraphs=args.paragraphs,
+    mean_paragraph_words=args.paragraph_words,
+    duplicate_text_rate=args.duplicate_text_rate,
+    duplicate_id_rate=args.duplicate_id_rate,
+    max_categories=args.max_categories,
+    invalid_rate=args.invalid_rate,
+  )
+  docs = generator.generate(args.articles)
+
+  consumer = FakeArticleConsumer(docs, arrival_rate=args.rate)
+  repository = InMemoryRepository(write_latency_seconds=args.write_latency)
+  analyzer = Analyzer(
+    repository,
+    StubCategoryClassifier(args.classify_latency),
+    StubEmbeddingsModel(args.embed_latency),
+    cache=AnalysisCache() if args.cache else None,
+    deduplicator=ArticleDeduplicator(repository) if args.dedup else None,
+    known_categories=KnownCategories() if args.known_categories else None,
+  )
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=args.batch_timeout_millis,
+    adaptive_batch_size=not args.fixed_batch_size,
+  )
+
+  start = time.perf_counter()
+  if args.pipelined:
+    ArticlePipeline(batcher).consume_pipelined_articles(analyzer.analyze, analyzer.store)
+  else:
+    batcher.consume_batched_articles(analyzer.process)
+  completed = consumer.all_acked.wait(timeout=args.timeout)
+  elapsed = time.perf_counter() - start
+
+  batches = sum(count for _, count in batch_sizes.samples())
+  return {
+    "config": vars(args),
+    "completed": completed,
+    "articles": len(docs),
+    "acked": consumer.acked,
+    "stored_articles": len(repository.articles),
+    "stored_categories": len(repository.categories),
+    "seconds": round(elapsed, 3),
+    "articles_per_second": round(consumer.acked / elapsed, 1),
+    "batches": int(batches),
+    "mean_batch_size": round(consumer.acked / batches, 1) if batches > 0 else None,
+    "latency_seconds": percentiles(consumer.latencies),
+    "stage_seconds": stage_latencies(),
+    # kilobytes on linux
+    "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(prog="python -m bench", description="end-to-end analyzer benchmark with stub models")
+  parser.add_argument("--articles", type=int, default=3000)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--rate", type=float, default=0, help="articles arriving per second, 0 reads them as a backlog")
+  parser.add_argument("--paragraphs", type=float, default=8, help="mean paragraphs per article")
+  parser.add_argument("--paragraph-words", type=float, default=60, help="mean words per paragraph")
+  parser.add_argument("--duplicate-text-rate", type=float, default=0.05, help="articles with the text of an earlier one")
+  parser.add_argument("--duplicate-id-rate", type=float, default=0.02, help="articles delivered again")
+  parser.add_argument("--max-categories", type=int, default=3, help="metadata categories per article")
+  parser.add_argument("--invalid-rate", type=float, default=0.01, help="articles missing a required field")
+  parser.add_argument("--batch-size", type=int, default=300, help="max batch size")
+  parser.add_argument("--batch-timeout-millis", type=int, default=1000)
+  parser.add_argument("--fixed-batch-size", action="store_true", help="always fill the batches up to the max size")
+  parser.add_argument("--classify-latency", type=float, default=0.0002, help="seconds per article classified")
+  parser.add_argument("--embed-latency", type=float, default=0.001, help="seconds per article embedded")
+  parser.add_argument("--write-latency", type=float, default=0.02, help="seconds per repository write")
+  parser.add_argument("--cache", action="store_true", help="use the analysis cache")
+  parser.add_argument("--dedup", action="store_true", help="skip the articles already analyzed")
+  parser.add_argument("--known-categories", action="store_true", help="only store the categories not known yet")
+  parser.add_argument("--pipelined", action="store_true", help="store a batch while the next one is analyzed")
+  parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for every article to be acked")
+  parser.add_argument("--output", help="also write the results to this file")
+  args = parser.parse_args()
+
+  # the skipped invalid articles are logged as errors
+  logging.disable(logging.CRITICAL)
+
+  results = run(args)
+  print(json.dumps(results, indent=2))
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
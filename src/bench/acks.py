@@ -0,0 +1,63 @@
+from api.redis_handler import RedisHandler, StreamAck
+from bench.fake_redis import FakeRedisServer
+import argparse
+import logging
+import json
+import time
+
+# Compares acking a batch of stream messages one XACK per message with a single multi-id XACK,
+# against a local Redis stand-in with a simulated network round trip.
+# Run from the 'src' directory: python -m bench.acks
+
+
+def measure(server: FakeRedisServer, ack_batch, acks: list[StreamAck], rounds: int) -> tuple[float, int]:
+  """Returns the seconds and the round trips per batch."""
+  round_trips = server.round_trips
+  start = time.perf_counter()
+  for _ in range(rounds):
+    ack_batch(acks)
+  elapsed = time.perf_counter() - start
+  return (elapsed / rounds, (server.round_trips - round_trips) // rounds)
+
+
+def ack_one_by_one(acks: list[StreamAck]) -> None:
+  for ack in acks:
+    ack()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="per-message vs batched stream acks")
+  parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100, 300])
+  parser.add_argument("--latency", type=float, default=0.0005, help="seconds per round trip")
+  parser.add_argument("--rounds", type=int, default=5)
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  server = FakeRedisServer(latency_seconds=args.latency).start()
+  handler = RedisHandler(server.host, server.port)
+
+  for batch_size in args.batch_sizes:
+    acks = [StreamAck(handler, "articles", "analyzer", f"{i}-0") for i in range(batch_size)]
+    deleting_acks = [StreamAck(handler, "articles", "analyzer", f"{i}-0", delete=True) for i in range(batch_size)]
+
+    results = {
+      "one_by_one": measure(server, ack_one_by_one, acks, args.rounds),
+      "batched": measure(server, handler.ack_batch, acks, args.rounds),
+      "batched_with_xdel": measure(server, handler.ack_batch, deleting_acks, args.rounds),
+    }
+    if len(server.acked[("articles", "analyzer")]) < batch_size:
+      raise AssertionError(f"not every message of the batch of {batch_size} was acked")
+
+    print(json.dumps({
+      "batch_size": batch_size,
+      "round_trip_millis": args.latency * 1000,
+      **{
+        f"{mode}_millis": round(seconds * 1000, 3) for mode, (seconds, _) in results.items()
+      },
+      **{
+        f"{mode}_round_trips": round_trips for mode, (_, round_trips) in results.items()
+      },
+    }))
+
+  server.stop()
@@ -0,0 +1,129 @@
+import numpy as np
+
+# Synthetic scraped articles in the format of the scraper, 'components.article' as 'Analyzer' maps it,
+# with lengths, duplicates, metadata and invalid documents drawn from configurable distributions.
+
+SOURCES = ["example", "daily-news", "the-gazette", "world-report", "tech-weekly"]
+CATEGORIES = [
+  "politics", "business", "technology", "science", "health", "sports", "entertainment", "world", "culture",
+  "travel", "education", "environment", "opinion", "local", "finance",
+]
+# the fields an invalid document is missing, 'Analyzer' skips it
+REQUIRED_FIELDS = ["id", "url", "components", "publish_date", "title", "paragraphs"]
+
+
+class ArticleGenerator:
+  """
+  Generates scraped articles. The number of paragraphs and the words per paragraph are log-normal around
+  'mean_paragraphs' and 'mean_paragraph_words'. 'duplicate_text_rate' of the articles reuse the text of an earlier
+  article under a new id, like the same story scraped from two sources, 'duplicate_id_rate' of them are an earlier
+  article delivered again. The metadata carries up to 'max_categories' categories, with the casing and whitespace
+  of scraped pages, 'invalid_rate' of the articles lack a required field.
+  """
+
+  def __init__(
+    self,
+    seed: int = 0,
+    vocabulary_size: int = 20000,
+    mean_paragraphs: float = 8,
+    mean_paragraph_words: float = 60,
+    length_sigma: float = 0.6,
+    duplicate_text_rate: float = 0.0,
+    duplicate_id_rate: float = 0.0,
+    max_categories: int = 3,
+    invalid_rate: float = 0.0,
+  ):
+    self.rng = np.random.default_rng(seed)
+    self.mean_paragraphs = mean_paragraphs
+    self.mean_paragraph_words = mean_paragraph_words
+    self.length_sigma = length_sigma
+    self.duplicate_text_rate = duplicate_text_rate
+    self.duplicate_id_rate = duplicate_id_rate
+    self.max_categories = max_categories
+    self.invalid_rate = invalid_rate
+
+    # a zipfian vocabulary, a few words are much more common than the rest, like in real text
+    self.vocabulary = np.array([self.__word(i) for i in range(vocabulary_size)])
+    weights = 1 / np.arange(1, vocabulary_size + 1)
+    self.word_probabilities = weights / weights.sum()
+
+    self.__generated: list[dict] = []
+
+  def generate(self, count: int) -> list[dict]:
+    return [self.next() for _ in range(count)]
+
+  def next(self) -> dict:
+    i = len(self.__generated)
+    draw = self.rng.random()
+    if i > 0 and draw < self.duplicate_id_rate:
+      doc = self.__generated[self.rng.integers(0, i)]
+    elif i > 0 and draw < self.duplicate_id_rate + self.duplicate_text_rate:
+      earlier = self.__generated[self.rng.integers(0, i)]
+      doc = {**earlier, "id": f"article-{i}", "url": f"https://{self.__source()}.com/articles/{i}"}
+    else:
+      doc = self.__article(i)
+
+    if self.rng.random() < self.invalid_rate:
+      doc = self.__without(doc, REQUIRED_FIELDS[self.rng.integers(0, len(REQUIRED_FIELDS))])
+
+    self.__generated.append(doc)
+    return doc
+
+  def __article(self, i: int) -> dict:
+    source = self.__source()
+    paragraphs = max(1, round(self.rng.lognormal(np.log(self.mean_paragraphs), self.length_sigma)))
+    components = [
+      {"title": self.__sentence(max(3, round(self.rng.normal(10, 3))))},
+      # a single author as a string, several as a list
+      {"author": self.__author() if self.rng.random() < 0.8 else [self.__author(), self.__author()]},
+      {"publish_date": f"2024-{self.rng.integers(1, 13):02d}-{self.rng.integers(1, 29):02d}T"
+                       f"{self.rng.integers(0, 24):02d}:{self.rng.integers(0, 60):02d}:{self.rng.integers(0, 60):02d}"},
+      {"paragraphs": [
+        self.__sentence(max(5, round(self.rng.lognormal(np.log(self.mean_paragraph_words), self.length_sigma))))
+        for _ in range(paragraphs)
+      ]},
+    ]
+    if self.rng.random() < 0.7:
+      components.append({"image": f"https://{source}.com/images/{i}.jpg"})
+
+    doc = {
+      "id": f"article-{i}",
+      "url": f"https://{source}.com/articles/{i}",
+      "components": {"article": components},
+    }
+    if self.rng.random() < 0.9:
+      categories = self.rng.choice(CATEGORIES, size=self.rng.integers(0, self.max_categories + 1), replace=False)
+      doc["metadata"] = {
+        "source": source,
+        "categories": [self.__scraped_casing(category) for category in categories],
+      }
+    return doc
+
+  def __without(self, doc: dict, field: str) -> dict:
+    if field in ("id", "url", "components"):
+      return {key: value for key, value in doc.items() if key != field}
+    components = [component for component in doc["components"]["article"] if field not in component]
+    return {**doc, "components": {"article": components}}
+
+  def __sentence(self, words: int) -> str:
+    return " ".join(self.rng.choice(self.vocabulary, size=words, p=self.word_probabilities)).capitalize() + "."
+
+  def __author(self) -> str:
+    return f"{self.__word(self.rng.integers(0, 500)).capitalize()} {self.__word(self.rng.integers(500, 5000)).capitalize()}"
+
+  def __source(self) -> str:
+    return SOURCES[self.rng.integers(0, len(SOURCES))]
+
+  def __scraped_casing(self, category: str) -> str:
+    return f" {category.title()}" if self.rng.random() < 0.3 else category
+
+  @staticmethod
+  def __word(i: int) -> str:
+    # pronounceable, deterministic words of 2 to 4 syllables
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vo", "zi", "po", "da", "fe", "gu", "hi", "ja", "bo"]
+    word = ""
+    i += 16
+    while i > 0:
+      word += syllables[i % len(syllables)]
+      i //= len(syllables)
+    return word
@@ -0,0 +1,99 @@
+from api.redis_handler import RedisHandler
+from api.scraped_articles.redis_article_consumer import RedisScrapedArticleConsumer
+from api.scraped_articles.article_batcher import ArticleBatcher
+from api.scraped_articles.article_pipeline import ArticlePipeline
+from bench.fake_redis import FakeRedisServer
+from bench.fakes import make_docs
+from utils.in_flight_budget import InFlightBudget
+from threading import Thread, Event
+import argparse
+import logging
+import json
+import time
+
+# Runs the pipeline over a stream backlog while the storage is in a brownout, and samples the messages
+# read and not ack-ed yet, with and without an in-flight budget.
+# Run from the 'src' directory: python -m bench.backpressure
+
+
+def run(args, budget: InFlightBudget | None) -> dict:
+  server = FakeRedisServer().start()
+  docs = make_docs(args.articles, paragraphs=args.paragraphs)
+  server.add_entries("articles", [{"article": json.dumps(doc)} for doc in docs])
+  message_bytes = sum(len("article") + len(json.dumps(doc)) for doc in docs) / len(docs)
+
+  consumer = RedisScrapedArticleConsumer(
+    RedisHandler(server.host, server.port),
+    "articles",
+    "analyzer",
+    max_read_count=args.batch_size,
+    in_flight_budget=budget,
+  )
+  # batches of a fixed size, comparable between the runs
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=200,
+    adaptive_batch_size=False,
+  )
+
+  start = time.monotonic()
+  stored = 0
+  done = Event()
+
+  def store(batch: list[dict]) -> None:
+    nonlocal stored
+    # the storage is slow during the brownout, and recovers afterwards
+    in_brownout = time.monotonic() - start < args.brownout_seconds
+    time.sleep(args.brownout_write_seconds if in_brownout else args.write_seconds)
+    stored += len(batch)
+    if stored >= args.articles:
+      done.set()
+
+  def in_flight() -> int:
+    with server.lock:
+      delivered = server.groups.get(("articles", "analyzer"), 0)
+      return delivered - len(server.acked.get(("articles", "analyzer"), set()))
+
+  samples = []
+
+  def sample() -> None:
+    while not done.is_set():
+      samples.append((time.monotonic() - start, in_flight()))
+      time.sleep(0.005)
+
+  pipeline = ArticlePipeline(batcher)
+  Thread(target=pipeline.consume_pipelined_articles, args=(lambda batch: batch, store), daemon=True).start()
+  Thread(target=sample, daemon=True).start()
+  done.wait()
+  elapsed = time.monotonic() - start
+  server.stop()
+
+  in_brownout = [count for t, count in samples if t < args.brownout_seconds]
+  peak = max(count for _, count in samples)
+  return {
+    "budget": None if budget is None else {"messages": budget.max_messages, "bytes": budget.max_bytes},
+    "articles": args.articles,
+    "seconds": round(elapsed, 3),
+    "peak_in_flight_messages": peak,
+    "peak_in_flight_mib": round(peak * message_bytes / 2**20, 2),
+    "mean_in_flight_messages_during_brownout": round(sum(in_brownout) / len(in_brownout)),
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="messages held in memory during a storage brownout")
+  parser.add_argument("--articles", type=int, default=6000)
+  parser.add_argument("--paragraphs", type=int, default=20)
+  parser.add_argument("--batch-size", type=int, default=300)
+  parser.add_argument("--brownout-seconds", type=float, default=4)
+  parser.add_argument("--brownout-write-seconds", type=float, default=1, help="seconds per bulk write in the brownout")
+  parser.add_argument("--write-seconds", type=float, default=0.01, help="seconds per bulk write otherwise")
+  parser.add_argument("--budget-messages", type=int, default=600)
+  parser.add_argument("--budget-mib", type=float, default=16)
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  print(json.dumps(run(args, None)))
+  print(json.dumps(run(args, InFlightBudget(args.budget_messages, int(args.budget_mib * 2**20)))))
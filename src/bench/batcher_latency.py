@@ -0,0 +1,91 @@
+from api.scraped_articles.article_consumer import ScrapedArticleConsumer
+from api.scraped_articles.article_batcher import ArticleBatcher
+from typing import Callable
+from threading import Thread, Event
+import numpy as np
+import argparse
+import logging
+import json
+import time
+
+# Latency of the articles through the batcher, from their arrival until their batch is processed,
+# and the batch sizes, with a fixed and with an adaptive target batch size, at a trickle and under load.
+# Run from the 'src' directory: python -m bench.batcher_latency
+
+
+class PoissonArticleConsumer(ScrapedArticleConsumer):
+  """Delivers articles with exponentially distributed gaps, 'rate' articles per second on average, without end."""
+
+  def __init__(self, rate: float, seed: int = 0):
+    self.rate = rate
+    self.rng = np.random.default_rng(seed)
+
+  def consume_article(self, callback: Callable[[dict, Callable[[], None]], None], *callback_args) -> None:
+    next_arrival = time.monotonic()
+    i = 0
+    while True:
+      next_arrival += self.rng.exponential(1 / self.rate)
+      delay = next_arrival - time.monotonic()
+      if delay > 0:
+        time.sleep(delay)
+      # a backlog builds up while a batch is processed, those articles arrived when they were due
+      callback({"id": i, "arrival": min(next_arrival, time.monotonic())}, lambda: None, *callback_args)
+      i += 1
+
+
+def run(args, rate: float, adaptive: bool) -> dict:
+  count = int(rate * args.seconds)
+  # the traffic goes on after the measured articles, so the last of them don't wait for a batch which never fills
+  consumer = PoissonArticleConsumer(rate)
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.max_batch_size,
+    max_batch_timeout_millis=args.max_wait_millis,
+    adaptive_batch_size=adaptive,
+  )
+
+  latencies = []
+  batch_sizes = []
+  done = Event()
+
+  def process(batch: list[dict]) -> None:
+    time.sleep(args.batch_overhead + args.article_seconds * len(batch))
+    if done.is_set():
+      return
+    now = time.monotonic()
+    latencies.extend(now - doc["arrival"] for doc in batch if doc["id"] < count)
+    batch_sizes.append(len(batch))
+    if len(latencies) >= count:
+      done.set()
+
+  Thread(target=batcher.consume_batched_articles, args=(process,), daemon=True).start()
+  done.wait()
+
+  latencies = np.array(latencies) * 1000
+  return {
+    "rate": rate,
+    "target_size": "adaptive" if adaptive else "fixed",
+    "articles": count,
+    "batches": len(batch_sizes),
+    "mean_batch_size": round(float(np.mean(batch_sizes)), 1),
+    "p50_millis": round(float(np.percentile(latencies, 50)), 1),
+    "p99_millis": round(float(np.percentile(latencies, 99)), 1),
+    "max_millis": round(float(np.max(latencies)), 1),
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="end-to-end latency through the batcher")
+  parser.add_argument("--rates", type=float, nargs="+", default=[5, 200, 3000], help="articles per second")
+  parser.add_argument("--seconds", type=float, default=4)
+  parser.add_argument("--max-batch-size", type=int, default=300)
+  parser.add_argument("--max-wait-millis", type=int, default=1000)
+  parser.add_argument("--batch-overhead", type=float, default=0.02, help="seconds per batch")
+  parser.add_argument("--article-seconds", type=float, default=0.0002, help="seconds per article")
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  for rate in args.rates:
+    for adaptive in (False, True):
+      print(json.dumps(run(args, rate, adaptive)))
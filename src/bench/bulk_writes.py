@@ -0,0 +1,115 @@
+from repository.analyzer.elasticsearch_repository import ElasticsearchRepository
+from bench.fake_elasticsearch import FakeElasticsearchServer
+from domain import Article, Category
+from elasticsearch import helpers
+from datetime import datetime
+import numpy as np
+import argparse
+import logging
+import json
+import time
+
+# Writes analyzed articles to a mock '_bulk' endpoint, the way the repository wrote them before the bulk writer,
+# materialized and with the default chunks of 'streaming_bulk', and with the bulk writer at several numbers
+# of requests in flight, and reports the documents and bytes per second.
+# Run from the 'src' directory: python -m bench.bulk_writes
+
+
+def make_articles(count: int, paragraphs: int, dims: int = 384) -> list[Article]:
+  rng = np.random.default_rng(0)
+  categories = [Category(id="news", name="news")]
+  return [
+    Article(
+      id=f"article-{i}",
+      url=f"https://example.com/articles/{i}",
+      source="example",
+      publish_date=datetime(2024, 3, 5, 21, 58, 25),
+      author=["Jane Doe"],
+      title=[f"Title of article {i}"],
+      paragraphs=[f"Paragraph {j} of article {i}, with some words in it." for j in range(paragraphs)],
+      analyze_time=datetime(2024, 3, 6),
+      categories=categories,
+      analyzed_categories=categories,
+      embeddings=rng.standard_normal(dims).tolist(),
+      analyzer_version="bench",
+    )
+    for i in range(count)
+  ]
+
+
+def store_before(repository: ElasticsearchRepository, articles: list[Article]) -> int:
+  # the documents mapped into a list first, then one 'streaming_bulk' request at a time
+  docs = [repository.map_to_repo_doc(article) for article in articles]
+  actions = ({"_id": doc["article"]["id"], "_index": repository.articles_index, **doc} for doc in docs)
+  return sum(1 for ok, _ in helpers.streaming_bulk(repository.es, actions) if ok)
+
+
+def run(args, articles: list[Article], max_in_flight: int | None) -> dict:
+  server = FakeElasticsearchServer(
+    latency_seconds=args.latency,
+    bytes_per_second=args.mib_per_second * 2**20,
+    reject_ratio=args.reject_ratio,
+    max_concurrent_requests=args.max_concurrent_requests,
+  ).start()
+  repository = ElasticsearchRepository(
+    server.url,
+    "elastic",
+    "password",
+    None,
+    verify_certs=False,
+    bulk_options={
+      "max_chunk_bytes": int(args.chunk_mib * 2**20),
+      "max_in_flight": max_in_flight or 1,
+      "initial_backoff": args.initial_backoff,
+    },
+  )
+
+  start = time.perf_counter()
+  errors = None
+  try:
+    for i in range(0, len(articles), args.batch_size):
+      batch = articles[i:i + args.batch_size]
+      if max_in_flight is None:
+        store_before(repository, batch)
+      else:
+        repository.store_analyzed_articles(batch)
+  except helpers.BulkIndexError as e:
+    errors = len(e.errors)
+  elapsed = time.perf_counter() - start
+  server.stop()
+
+  stored = len(server.docs.get(repository.articles_index, {}))
+  return {
+    "writer": "before" if max_in_flight is None else f"bulk_writer_in_flight_{max_in_flight}",
+    "reject_ratio": args.reject_ratio,
+    "stored": stored,
+    "failed": errors,
+    "seconds": round(elapsed, 3),
+    "docs_per_second": round(stored / elapsed, 1),
+    "mib_per_second": round(server.bytes / elapsed / 2**20, 2),
+    "requests": server.requests,
+    "rejected_items": server.rejected_items,
+    "rejected_requests": server.rejected_requests,
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="bulk write throughput against a mock Elasticsearch")
+  parser.add_argument("--articles", type=int, default=6000)
+  parser.add_argument("--batch-size", type=int, default=3000, help="articles per 'store_analyzed_articles' call")
+  parser.add_argument("--paragraphs", type=int, default=10)
+  parser.add_argument("--latency", type=float, default=0.02, help="seconds per bulk request")
+  parser.add_argument("--mib-per-second", type=float, default=50, help="bulk bytes taken in per second per request")
+  parser.add_argument("--chunk-mib", type=float, default=2)
+  parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 2, 4])
+  parser.add_argument("--reject-ratio", type=float, default=0, help="ratio of the items rejected with 429")
+  parser.add_argument("--max-concurrent-requests", type=int, default=1 << 30)
+  parser.add_argument("--initial-backoff", type=float, default=0.05)
+  args = parser.parse_args()
+
+  logging.disable(logging.WARNING)
+
+  articles = make_articles(args.articles, args.paragraphs)
+  print(json.dumps(run(args, articles, None)))
+  for max_in_flight in args.in_flight:
+    print(json.dumps(run(args, articles, max_in_flight)))
@@ -0,0 +1,122 @@
+from analysis.embeddings import EmbeddingsModel, EmbeddingsModelContainer
+from analysis.embeddings.embeddings_backend import EmbeddingsBackend, cosine_parity
+import numpy as np
+import argparse
+import logging
+import json
+import zlib
+
+# Checks that the chunked embeddings with 'mean' pooling of documents which fit into a single window are the
+# embeddings of the whole text, embedded in a single pass. The documents are embedded with a deterministic stub
+# model, a word tokenizer and the mean of fixed token vectors, or with the real model given by '--model-path'.
+# The longer documents, split into several chunks, are only reported.
+# Run from the 'src' directory: python -m bench.chunk_pooling [--model-path models/embeddings/....pkl]
+
+
+class WordTokenizer:
+  """A word tokenizer with the interface of the Hugging Face tokenizers used by 'EmbeddingsModel'."""
+
+  cls_id = 101
+  sep_id = 102
+
+  def __init__(self, vocabulary_size: int):
+    self.vocabulary_size = vocabulary_size
+
+  def __call__(self, texts: list[str], add_special_tokens: bool = True, truncation: bool = False, max_length=None):
+    input_ids = []
+    for text in texts:
+      ids = [1000 + zlib.crc32(word.encode()) % (self.vocabulary_size - 1000) for word in text.split()]
+      if add_special_tokens:
+        if truncation and max_length is not None:
+          ids = ids[:max_length - self.num_special_tokens_to_add()]
+        ids = self.build_inputs_with_special_tokens(ids)
+      input_ids.append(ids)
+    return {"input_ids": input_ids}
+
+  def num_special_tokens_to_add(self, pair: bool = False) -> int:
+    return 2
+
+  def build_inputs_with_special_tokens(self, ids: list[int]) -> list[int]:
+    return [self.cls_id] + ids + [self.sep_id]
+
+
+class MeanTokensStub:
+  """Stands in for the sentence-transformers model, the embedding is the mean of the vectors of the tokens."""
+
+  def __init__(self, dims: int = 384, vocabulary_size: int = 30000, max_seq_length: int = 256, seed: int = 0):
+    self.tokenizer = WordTokenizer(vocabulary_size)
+    self.max_seq_length = max_seq_length
+    self.vectors = np.random.default_rng(seed).standard_normal((vocabulary_size, dims)).astype(np.float32)
+
+  def get_sentence_embedding_dimension(self) -> int:
+    return self.vectors.shape[1]
+
+  def embed_ids(self, input_ids: list[list[int]]) -> np.ndarray:
+    return np.stack([self.vectors[ids].mean(axis=0) for ids in input_ids])
+
+  def encode(self, docs: list[str]) -> np.ndarray:
+    # the single pass of 'SentenceTransformer.encode'
+    return self.embed_ids(self.tokenizer(docs, truncation=True, max_length=self.max_seq_length)["input_ids"])
+
+
+class MeanTokensBackend(EmbeddingsBackend):
+  """Runs the forward pass of 'MeanTokensStub' on the tokenized micro-batches."""
+
+  name = "torch"
+
+  def forward(self, input_ids: list[list[int]]) -> np.ndarray:
+    return self.model.embed_ids(input_ids)
+
+
+def make_articles(count: int, paragraphs: int, paragraph_words: int, seed: int) -> list[tuple[str, list[str]]]:
+  rng = np.random.default_rng(seed)
+  vocabulary = [f"word{i}" for i in range(5000)]
+  return [
+    (
+      " ".join(rng.choice(vocabulary, size=8)),
+      [" ".join(rng.choice(vocabulary, size=paragraph_words)) for _ in range(rng.integers(1, paragraphs + 1))],
+    )
+    for _ in range(count)
+  ]
+
+
+def compare(single: EmbeddingsModel, chunked: EmbeddingsModel, articles: list[tuple[str, list[str]]]) -> dict:
+  # the whole text of an article, as it is embedded in a single pass
+  texts = ["\n".join([title, *paragraphs]) for title, paragraphs in articles]
+  return cosine_parity(single.encode(texts), chunked.encode_chunked(articles))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="parity of the chunked mean pooling with the single-pass embeddings")
+  parser.add_argument("--model-path", help="pickled EmbeddingsModelContainer, the stub model is used without it")
+  parser.add_argument("--articles", type=int, default=200)
+  parser.add_argument("--tolerance", type=float, default=1e-5, help="of the cosine similarity of the short documents")
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  if args.model_path:
+    container = EmbeddingsModelContainer.load(args.model_path)
+  else:
+    container = EmbeddingsModelContainer(MeanTokensStub(), "mean-tokens-stub")
+  single = EmbeddingsModel(container)
+  chunked = EmbeddingsModel(container, chunk_pooling="mean")
+  if not args.model_path:
+    single.backend = MeanTokensBackend(container.embeddings_model)
+    chunked.backend = MeanTokensBackend(container.embeddings_model)
+
+  results = []
+  # short documents fit into one window, a few paragraphs of 20 words, and long ones are split into several
+  for name, paragraphs, paragraph_words in (("short", 3, 20), ("long", 20, 60)):
+    parity = compare(single, chunked, make_articles(args.articles, paragraphs, paragraph_words, seed=1))
+    results.append({
+      "documents": name,
+      "articles": args.articles,
+      **{k: round(v, 7) for k, v in parity.items()},
+      "ok": parity["min_cosine"] >= 1 - args.tolerance if name == "short" else None,
+    })
+
+  for r in results:
+    print(json.dumps(r))
+  if not results[0]["ok"]:
+    raise SystemExit(1)
@@ -0,0 +1,56 @@
+from analysis.classifier import CategoryClassifier
+from bench.fakes import make_model_container
+import numpy as np
+import argparse
+import logging
+import json
+import time
+
+# Compares the per-classifier and the stacked, vectorized scoring of 'CategoryClassifier'
+# by category count and batch size, and checks that both predict the same labels.
+# Run from the 'src' directory: python -m bench.classifier
+
+
+def make_texts(count: int, seed: int) -> list[str]:
+  rng = np.random.default_rng(seed)
+  vocabulary = [f"word{i}" for i in range(2000)]
+  return [" ".join(rng.choice(vocabulary, size=300)) for _ in range(count)]
+
+
+def measure(predict, texts: list[str], rounds: int) -> float:
+  start = time.perf_counter()
+  for _ in range(rounds):
+    predict(texts)
+  return (time.perf_counter() - start) / rounds
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="vectorized one-vs-rest scoring")
+  parser.add_argument("--categories", type=int, nargs="+", default=[10, 50, 200])
+  parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 300])
+  parser.add_argument("--rounds", type=int, default=20)
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  for categories in args.categories:
+    mc = make_model_container(categories=categories)
+    # thresholds around the predicted probabilities, so some categories are hit
+    mc.thresholds = list(np.linspace(0.3, 0.7, categories))
+    per_classifier = CategoryClassifier(mc, vectorize=False)
+    stacked = CategoryClassifier(mc)
+
+    for batch_size in args.batch_sizes:
+      texts = make_texts(batch_size, seed=batch_size)
+      if per_classifier.predict_batch(texts) != stacked.predict_batch(texts):
+        raise AssertionError(f"labels differ for {categories} categories, batch size {batch_size}")
+
+      per_classifier_seconds = measure(per_classifier.predict_batch, texts, args.rounds)
+      stacked_seconds = measure(stacked.predict_batch, texts, args.rounds)
+      print(json.dumps({
+        "categories": categories,
+        "batch_size": batch_size,
+        "per_classifier_millis": round(per_classifier_seconds * 1000, 3),
+        "stacked_millis": round(stacked_seconds * 1000, 3),
+        "speedup": round(per_classifier_seconds / stacked_seconds, 2),
+      }))
@@ -0,0 +1,97 @@
+from api.redis_handler import RedisHandler
+from api.scraped_articles.redis_article_consumer import RedisScrapedArticleConsumer
+from api.scraped_articles.article_batcher import ArticleBatcher
+from bench.fake_redis import FakeRedisServer
+from bench.articles import ArticleGenerator
+from threading import Thread, Event
+import argparse
+import logging
+import orjson
+import json
+import time
+
+# Decodes the stream messages of real-sized articles, as the consumers did, the fields decoded to 'str' by the
+# client and parsed with 'json', and as they do now, parsed with 'orjson' straight from the bytes read.
+# Then drains a stream of them through the Redis consumer, against a local Redis stand-in.
+# Run from the 'src' directory: python -m bench.decode
+
+
+def decode_only(args, messages: list[bytes]) -> list[dict]:
+  results = []
+  for name, decode in (
+    ("json_str", lambda value: json.loads(value.decode())),
+    ("orjson_bytes", orjson.loads),
+  ):
+    best = float("inf")
+    for _ in range(args.repeat):
+      start = time.perf_counter()
+      for value in messages:
+        decode(value)
+      best = min(best, time.perf_counter() - start)
+    results.append({
+      "decode": name,
+      "messages": len(messages),
+      "mean_message_bytes": round(sum(len(m) for m in messages) / len(messages)),
+      "messages_per_second": round(len(messages) / best),
+      "megabytes_per_second": round(sum(len(m) for m in messages) / best / 1e6, 1),
+    })
+  return results
+
+
+def drain(args, messages: list[bytes]) -> dict:
+  server = FakeRedisServer().start()
+  server.add_entries("articles", [{"article": message.decode()} for message in messages])
+
+  consumer = RedisScrapedArticleConsumer(
+    RedisHandler(server.host, server.port),
+    "articles",
+    "analyzer",
+    max_read_count=args.batch_size,
+  )
+
+  processed = 0
+  done = Event()
+
+  def process(batch: list[dict]) -> None:
+    nonlocal processed
+    processed += len(batch)
+    if processed >= len(messages):
+      done.set()
+
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=1000,
+    adaptive_batch_size=False,
+  )
+
+  start = time.perf_counter()
+  Thread(target=batcher.consume_batched_articles, args=(process,), daemon=True).start()
+  done.wait()
+  elapsed = time.perf_counter() - start
+  server.stop()
+
+  return {
+    "drain": "redis_consumer",
+    "messages": len(messages),
+    "seconds": round(elapsed, 3),
+    "messages_per_second": round(len(messages) / elapsed, 1),
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="decoding of the stream messages, json vs orjson")
+  parser.add_argument("--articles", type=int, default=5000)
+  parser.add_argument("--mean-paragraphs", type=float, default=12)
+  parser.add_argument("--repeat", type=int, default=5, help="the best of the repeats is reported")
+  parser.add_argument("--batch-size", type=int, default=300)
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  generator = ArticleGenerator(seed=1, mean_paragraphs=args.mean_paragraphs)
+  messages = [json.dumps(doc).encode() for doc in generator.generate(args.articles)]
+
+  for result in decode_only(args, messages):
+    print(json.dumps(result))
+  print(json.dumps(drain(args, messages)))
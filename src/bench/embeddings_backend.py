@@ -0,0 +1,58 @@
+from analysis.embeddings import EmbeddingsModel, EmbeddingsModelContainer
+from analysis.embeddings.embeddings_backend import export_onnx, cosine_parity
+from bench.embeddings_batching import make_texts
+import argparse
+import logging
+import json
+import time
+import os
+
+# Compares the embeddings backends with the fp32 PyTorch model: articles/sec, and cosine similarity on a sample set.
+# Exports the ONNX model to '--onnx-path' first, if it doesn't exist yet.
+# Run from the 'src' directory:
+# python -m bench.embeddings_backend --model-path models/embeddings/....pkl --onnx-path models/embeddings/model.onnx
+
+
+def measure(model: EmbeddingsModel, texts: list[str], rounds: int) -> tuple[float, object]:
+  embeddings = model.encode(texts[:10])
+  start = time.perf_counter()
+  for _ in range(rounds):
+    embeddings = model.encode(texts)
+  return (len(texts) * rounds / (time.perf_counter() - start), embeddings)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="embeddings backend throughput and parity")
+  parser.add_argument("--model-path", required=True, help="pickled EmbeddingsModelContainer")
+  parser.add_argument("--onnx-path", help="exported ONNX model, created if it doesn't exist")
+  parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+  parser.add_argument("--texts", type=int, default=300)
+  parser.add_argument("--token-budget", type=int, default=8192)
+  parser.add_argument("--rounds", type=int, default=3)
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  container = EmbeddingsModelContainer.load(args.model_path)
+  texts = make_texts(args.texts, seed=0)
+
+  if "onnx" in args.backends:
+    if args.onnx_path is None:
+      parser.error("the onnx backend needs --onnx-path")
+    if not os.path.exists(args.onnx_path):
+      export_onnx(container.embeddings_model, args.onnx_path)
+
+  reference = None
+  for backend in args.backends:
+    model = EmbeddingsModel(container, token_budget=args.token_budget, backend=backend, onnx_path=args.onnx_path)
+    articles_per_second, embeddings = measure(model, texts, args.rounds)
+    if reference is None:
+      # the first backend is the reference, fp32 torch by default
+      reference = embeddings
+
+    print(json.dumps({
+      "backend": backend,
+      "articles_per_second": round(articles_per_second, 1),
+      "dims": embeddings.shape[1],
+      **{k: round(v, 5) for k, v in cosine_parity(reference, embeddings).items()},
+    }))
@@ -0,0 +1,78 @@
+from analysis.embeddings import EmbeddingsModel, EmbeddingsModelContainer
+from analysis.embeddings.embeddings_model import make_token_budget_batches
+import numpy as np
+import argparse
+import logging
+import json
+import time
+
+# Compares the padding of the default sentence-transformers batching
+# (sorted by characters, 32 texts per batch) with the token budget micro-batches.
+# With '--model-path' the tokens/sec of both are measured with the real model,
+# without it the token lengths are estimated from the word counts.
+# Run from the 'src' directory: python -m bench.embeddings_batching
+
+
+def make_texts(count: int, seed: int) -> list[str]:
+  # mostly short briefs, with a long tail of feature pieces
+  rng = np.random.default_rng(seed)
+  word_counts = np.clip(rng.lognormal(mean=4.5, sigma=1.0, size=count), 10, 5000).astype(int)
+  return [" ".join(f"word{j % 997}" for j in range(words)) for words in word_counts]
+
+
+def padding_ratio(lengths: list[int], batches: list[list[int]]) -> float:
+  padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+  return padded / sum(lengths)
+
+
+def default_batches(texts: list[str], batch_size: int = 32) -> list[list[int]]:
+  # what 'SentenceTransformer.encode' does by default
+  order = np.argsort([-len(text) for text in texts], kind="stable")
+  return [[int(i) for i in order[start:start + batch_size]] for start in range(0, len(order), batch_size)]
+
+
+def measure(encode, texts: list[str], rounds: int) -> float:
+  start = time.perf_counter()
+  for _ in range(rounds):
+    encode(texts)
+  return (time.perf_counter() - start) / rounds
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="token budget embedding micro-batches")
+  parser.add_argument("--texts", type=int, default=300)
+  parser.add_argument("--token-budget", type=int, default=8192)
+  parser.add_argument("--model-path", help="pickled EmbeddingsModelContainer")
+  parser.add_argument("--rounds", type=int, default=3)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  texts = make_texts(args.texts, args.seed)
+
+  model = None
+  if args.model_path:
+    model = EmbeddingsModel(EmbeddingsModelContainer.load(args.model_path), token_budget=args.token_budget)
+    lengths = [len(ids) for ids in model.tokenize(texts)]
+  else:
+    # rough estimate for a wordpiece tokenizer, truncated like MiniLM
+    lengths = [min(int(len(text.split()) * 1.3) + 2, 256) for text in texts]
+
+  results = {
+    "texts": len(texts),
+    "tokens": sum(lengths),
+    "default": {"padding_ratio": round(padding_ratio(lengths, default_batches(texts)), 3)},
+    "token_budget": {
+      "budget": args.token_budget,
+      "padding_ratio": round(padding_ratio(lengths, make_token_budget_batches(lengths, args.token_budget)), 3),
+    },
+  }
+
+  if model is not None:
+    seconds = measure(model.ec.embeddings_model.encode, texts, args.rounds)
+    results["default"]["tokens_per_second"] = round(sum(lengths) / seconds, 1)
+    seconds = measure(model.encode, texts, args.rounds)
+    results["token_budget"]["tokens_per_second"] = round(sum(lengths) / seconds, 1)
+
+  print(json.dumps(results))
@@ -0,0 +1,94 @@
+from repository.analyzer.embeddings_storage import EmbeddingsStorage, quantize_to_bytes
+import numpy as np
+import argparse
+import json
+
+# Recall@k of exact kNN queries over the embeddings as they are stored with each 'EmbeddingsStorage' option,
+# against the float embeddings, on clustered synthetic normalized vectors. Reports the size of the embeddings
+# in the bulk requests, and per vector in the kNN graph and on disk.
+# Run from the 'src' directory: python -m bench.embeddings_storage
+
+
+def make_embeddings(rng: np.random.Generator, count: int, centers: np.ndarray, spread: float) -> np.ndarray:
+  assigned = centers[rng.integers(0, len(centers), count)]
+  vectors = assigned + spread * rng.standard_normal(assigned.shape).astype(np.float32)
+  return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def top_k(docs: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+  # cosine similarity, the vectors are not normalized after quantization
+  docs = docs / np.linalg.norm(docs, axis=1, keepdims=True)
+  queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+  scores = queries @ docs.T
+  return np.argpartition(-scores, k, axis=1)[:, :k]
+
+
+def int8_scalar_quantize(docs: np.ndarray, queries: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  # like the 'int8_hnsw' index: the values are clipped to the quantiles of the confidence interval of the segment,
+  # 1 - 1 / (dims + 1) by default, and mapped to 0..127, the queries with the same quantiles
+  confidence = 1 - 1 / (docs.shape[1] + 1)
+  lower, upper = np.quantile(docs, [(1 - confidence) / 2, 1 - (1 - confidence) / 2])
+  scale = 127 / (upper - lower)
+
+  def quantize(vectors: np.ndarray) -> np.ndarray:
+    return np.rint((np.clip(vectors, lower, upper) - lower) * scale) / scale + lower
+
+  return quantize(docs), quantize(queries)
+
+
+def recall(expected: np.ndarray, found: np.ndarray) -> float:
+  hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+  return hits / expected.size
+
+
+def payload_bytes(storage: EmbeddingsStorage, docs: np.ndarray, sample: int = 200) -> float:
+  # the embeddings come out of the analyzer as python floats of float32 values
+  return float(np.mean([len(json.dumps(storage.encode(doc.tolist()))) for doc in docs[:sample]]))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="recall and size of the embeddings storage options")
+  parser.add_argument("--docs", type=int, default=20000)
+  parser.add_argument("--queries", type=int, default=200)
+  parser.add_argument("--dims", type=int, default=384)
+  parser.add_argument("--clusters", type=int, default=200)
+  parser.add_argument("--spread", type=float, default=0.06, help="noise around the cluster centers per dimension")
+  parser.add_argument("--k", type=int, default=10)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  centers = rng.standard_normal((args.clusters, args.dims)).astype(np.float32) / np.sqrt(args.dims)
+  docs = make_embeddings(rng, args.docs, centers, args.spread)
+  queries = make_embeddings(rng, args.queries, centers, args.spread)
+  expected = top_k(docs, queries, args.k)
+
+  float_bytes = 4 * args.dims
+  variants = [
+    ("float", EmbeddingsStorage(args.dims), docs, queries, float_bytes, float_bytes),
+  ]
+  for precision in (4, 3, 2):
+    storage = EmbeddingsStorage(args.dims, precision=precision)
+    trimmed = np.round(docs.astype(np.float64), precision)
+    # trimmed in the bulk requests, still stored as floats
+    variants.append((f"float_precision_{precision}", storage, trimmed, queries, float_bytes, float_bytes))
+
+  int8_docs, int8_queries = int8_scalar_quantize(docs, queries)
+  # the float vectors are kept next to the quantized ones, the graph only reads the quantized ones and their offset
+  variants.append((
+    "int8_hnsw", EmbeddingsStorage(args.dims, index_type="int8_hnsw"),
+    int8_docs, int8_queries, args.dims + 4, float_bytes + args.dims + 4,
+  ))
+  variants.append((
+    "byte", EmbeddingsStorage(args.dims, index_type="hnsw", element_type="byte"),
+    quantize_to_bytes(docs).astype(np.float32), quantize_to_bytes(queries).astype(np.float32), args.dims, args.dims,
+  ))
+
+  for name, storage, stored_docs, stored_queries, graph_bytes, disk_bytes in variants:
+    print(json.dumps({
+      "storage": name,
+      "mapping": storage.mapping(),
+      f"recall_at_{args.k}": round(recall(expected, top_k(stored_docs, stored_queries, args.k)), 4),
+      "bulk_bytes_per_vector": round(payload_bytes(storage, docs)),
+      "graph_bytes_per_vector": graph_bytes,
+      "disk_bytes_per_vector": disk_bytes,
+    }))
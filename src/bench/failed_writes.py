@@ -0,0 +1,104 @@
+from analysis.analyzer import Analyzer
+from analysis.async_analyzer import AsyncAnalyzer
+from api.scraped_articles.article_batcher import ArticleBatcher
+from api.scraped_articles.article_pipeline import ArticlePipeline
+from api.scraped_articles.async_article_batcher import AsyncArticleBatcher
+from bench.fakes import (
+  make_docs,
+  FakeArticleConsumer,
+  AsyncFakeArticleConsumer,
+  InMemoryRepository,
+  AsyncInMemoryRepository,
+  StubCategoryClassifier,
+  StubEmbeddingsModel,
+)
+import argparse
+import asyncio
+import logging
+import json
+import time
+
+# Checks that a batch whose categories or articles fail to be written is not ack-ed, but released, with the
+# synchronous batcher, the pipelined mode and the async batcher. The writes fail with 'BulkIndexError',
+# like the items which still fail after the retries of the bulk writer.
+# Run from the 'src' directory: python -m bench.failed_writes
+
+
+def run_sync(args, failing_write: str | None, pipelined: bool) -> dict:
+  docs = make_docs(args.articles)
+  consumer = FakeArticleConsumer(docs)
+  repository = InMemoryRepository(failing_writes=(failing_write,) if failing_write else ())
+  analyzer = Analyzer(repository, StubCategoryClassifier(), StubEmbeddingsModel())
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=100,
+    adaptive_batch_size=False,
+  )
+
+  if pipelined:
+    ArticlePipeline(batcher).consume_pipelined_articles(analyzer.analyze, analyzer.store)
+  else:
+    batcher.consume_batched_articles(analyzer.process)
+  consumer.all_settled.wait(timeout=args.timeout)
+
+  return result("pipelined" if pipelined else "sync", failing_write, len(docs), consumer, repository)
+
+
+async def run_async(args, failing_write: str | None) -> dict:
+  docs = make_docs(args.articles)
+  consumer = AsyncFakeArticleConsumer(docs)
+  repository = InMemoryRepository(failing_writes=(failing_write,) if failing_write else ())
+  analyzer = AsyncAnalyzer(
+    Analyzer(repository, StubCategoryClassifier(), StubEmbeddingsModel()),
+    AsyncInMemoryRepository(repository),
+  )
+  batcher = AsyncArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=100,
+    adaptive_batch_size=False,
+  )
+
+  await batcher.consume_batched_articles(analyzer.process)
+  deadline = time.monotonic() + args.timeout
+  while consumer.acked + consumer.released < len(docs) and time.monotonic() < deadline:
+    await asyncio.sleep(0.01)
+
+  return result("async", failing_write, len(docs), consumer, repository)
+
+
+def result(mode: str, failing_write: str | None, articles: int, consumer, repository: InMemoryRepository) -> dict:
+  # a failed write has to leave every message of its batch un-acked, and give it back
+  expected_acked = articles if failing_write is None else 0
+  return {
+    "mode": mode,
+    "failing_write": failing_write,
+    "articles": articles,
+    "acked": consumer.acked,
+    "released": consumer.released,
+    "stored_articles": len(repository.articles),
+    "ok": consumer.acked == expected_acked and consumer.acked + consumer.released == articles,
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="failed writes leave their batches un-acked")
+  parser.add_argument("--articles", type=int, default=100)
+  parser.add_argument("--batch-size", type=int, default=20)
+  parser.add_argument("--timeout", type=float, default=10)
+  args = parser.parse_args()
+
+  # the failures are logged with their tracebacks
+  logging.disable(logging.CRITICAL)
+
+  results = []
+  for failing_write in (None, "store_categories", "store_analyzed_articles"):
+    results.append(run_sync(args, failing_write, pipelined=False))
+    results.append(run_sync(args, failing_write, pipelined=True))
+    results.append(asyncio.run(run_async(args, failing_write)))
+
+  for r in results:
+    print(json.dumps(r))
+  if not all(r["ok"] for r in results):
+    raise SystemExit(1)
@@ -0,0 +1,218 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import urlsplit, parse_qs
+import random
+import json
+import time
+
+# A minimal Elasticsearch stand-in over HTTP, used by the benchmarks with the real client.
+# It creates indices, answers 'match_all' searches of the ids, and '_bulk' requests, each taking 'latency_seconds'
+# plus the time to take in the body at 'bytes_per_second'. It rejects 'reject_ratio' of the items with 429,
+# and whole requests with 429 while more than 'max_concurrent_requests' are being handled, like a full write queue.
+# Creating a document which exists fails with 409. Updates merge their 'doc' into the stored document,
+# and fail with 404 if it doesn't exist, unless they're 'doc_as_upsert'. '_mget' returns the stored sources,
+# only their '_source_includes' fields if given, 'mget_bytes' counts the bytes of its replies.
+
+
+class FakeElasticsearchServer:
+
+  def __init__(
+    self,
+    latency_seconds: float = 0.005,
+    bytes_per_second: float = 200 * 1024 * 1024,
+    reject_ratio: float = 0,
+    max_concurrent_requests: int = 1 << 30,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    seed: int = 0,
+  ):
+    self.latency_seconds = latency_seconds
+    self.bytes_per_second = bytes_per_second
+    self.reject_ratio = reject_ratio
+    self.max_concurrent_requests = max_concurrent_requests
+    self.rng = random.Random(seed)
+
+    self.lock = Lock()
+    self.requests = 0
+    self.rejected_requests = 0
+    self.rejected_items = 0
+    self.bytes = 0
+    self.mget_bytes = 0
+    self.docs: dict[str, dict[str, bytes]] = {}
+    self.concurrent = 0
+
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, *args):
+        pass
+
+      def do_GET(self):
+        self.__reply(200, {"version": {"number": "8.12.1"}, "tagline": "You Know, for Search"})
+
+      def do_HEAD(self):
+        self.__reply(200, {})
+
+      def do_PUT(self):
+        body = self.__read_body()
+        # the client sends '_bulk' requests with PUT
+        if self.path.split("?")[0].endswith("/_bulk"):
+          self.__reply(*server.bulk(body))
+          return
+        self.__reply(200, {"acknowledged": True, "index": self.path.strip("/").split("/")[0]})
+
+      def do_POST(self):
+        body = self.__read_body()
+        if self.path.split("?")[0].endswith("/_search"):
+          self.__reply(200, server.search(self.path.strip("/").split("/")[0]))
+          return
+        if self.path.split("?")[0].endswith("/_mget"):
+          query = parse_qs(urlsplit(self.path).query)
+          includes = query["_source_includes"][0].split(",") if "_source_includes" in query else None
+          self.__reply(200, server.mget(self.path.strip("/").split("/")[0], json.loads(body), includes))
+          return
+        if not self.path.split("?")[0].endswith("/_bulk"):
+          self.__reply(404, {"error": f"unknown path {self.path}"})
+          return
+        self.__reply(*server.bulk(body))
+
+      def __read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+      def __reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        # the client refuses to talk to a server without it
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    self.http = ThreadingHTTPServer((host, port), Handler)
+    self.http.daemon_threads = True
+    self.host, self.port = self.http.server_address
+    self.url = f"http://{self.host}:{self.port}"
+
+  def start(self) -> "FakeElasticsearchServer":
+    Thread(target=self.http.serve_forever, daemon=True).start()
+    return self
+
+  def stop(self) -> None:
+    self.http.shutdown()
+    self.http.server_close()
+
+  def search(self, index: str) -> dict:
+    # only the ids, as for a 'match_all' query without the source
+    with self.lock:
+      ids = list(self.docs.get(index, {}))
+    return {"hits": {"total": {"value": len(ids), "relation": "eq"}, "hits": [{"_index": index, "_id": id} for id in ids]}}
+
+  def mget(self, index: str, body: dict, includes: list[str] | None = None) -> dict:
+    with self.lock:
+      stored = self.docs.get(index, {})
+      found = {id: stored[id] for id in body.get("ids", []) if id in stored}
+    reply = {"docs": [
+      {"_index": index, "_id": id, "found": True, "_source": self.__included(json.loads(found[id]), includes)} 
+      if id in found
+      else {"_index": index, "_id": id, "found": False}
+      for id in body.get("ids", [])
+    ]}
+    with self.lock:
+      self.mget_bytes += len(json.dumps(reply))
+    return reply
+
+  @staticmethod
+  def __included(source: dict, includes: list[str] | None) -> dict:
+    # the dotted paths of 'includes', and everything below them
+    if includes is None:
+      return source
+    included = {}
+    for path in includes:
+      keys = path.split(".")
+      value = source
+      for key in keys:
+        if not isinstance(value, dict) or key not in value:
+          break
+        value = value[key]
+      else:
+        target = included
+        for key in keys[:-1]:
+          target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return included
+
+  def bulk(self, body: bytes) -> tuple[int, dict]:
+    with self.lock:
+      self.requests += 1
+      self.bytes += len(body)
+      self.concurrent += 1
+      overloaded = self.concurrent > self.max_concurrent_requests
+      if overloaded:
+        self.rejected_requests += 1
+    try:
+      if overloaded:
+        return 429, {"error": {"type": "es_rejected_execution_exception"}, "status": 429}
+
+      time.sleep(self.latency_seconds + len(body) / self.bytes_per_second)
+
+      lines = body.split(b"\n")
+      items = []
+      took_errors = False
+      i = 0
+      while i < len(lines) and lines[i]:
+        header = json.loads(lines[i])
+        op, meta = next(iter(header.items()))
+        source = lines[i + 1] if op != "delete" else None
+        i += 1 if op == "delete" else 2
+
+        with self.lock:
+          index = self.docs.setdefault(meta.get("_index", ""), {})
+          rejected = self.rng.random() < self.reject_ratio
+          conflict = not rejected and op == "create" and meta.get("_id") in index
+          missing = False
+          if rejected:
+            self.rejected_items += 1
+          elif op == "update":
+            update = json.loads(source)
+            missing = meta.get("_id") not in index and not update.get("doc_as_upsert", False)
+            if not missing:
+              stored = json.loads(index.get(meta.get("_id", ""), b"{}"))
+              index[meta.get("_id", "")] = json.dumps(merge(stored, update["doc"])).encode()
+          elif source is not None and not conflict:
+            index[meta.get("_id", "")] = source
+        if missing:
+          took_errors = True
+          items.append({op: {"_index": meta.get("_index"), "_id": meta.get("_id"), "status": 404, "error": {
+            "type": "document_missing_exception",
+          }}})
+        elif conflict:
+          took_errors = True
+          items.append({op: {"_index": meta.get("_index"), "_id": meta.get("_id"), "status": 409, "error": {
+            "type": "version_conflict_engine_exception",
+          }}})
+        elif rejected:
+          took_errors = True
+          items.append({op: {"_index": meta.get("_index"), "_id": meta.get("_id"), "status": 429, "error": {
+            "type": "es_rejected_execution_exception",
+          }}})
+        else:
+          items.append({op: {"_index": meta.get("_index"), "_id": meta.get("_id"), "status": 201, "result": "created"}})
+
+      return 200, {"took": 1, "errors": took_errors, "items": items}
+    finally:
+      with self.lock:
+        self.concurrent -= 1
+
+
+def merge(stored: dict, doc: dict) -> dict:
+  # like a partial update, the objects are merged, everything else is replaced
+  for key, value in doc.items():
+    if isinstance(value, dict) and isinstance(stored.get(key), dict):
+      merge(stored[key], value)
+    else:
+      stored[key] = value
+  return stored
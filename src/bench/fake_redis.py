@@ -0,0 +1,235 @@
+from socketserver import ThreadingTCPServer, BaseRequestHandler
+from threading import Thread, Lock
+import time
+
+# A minimal Redis stand-in speaking RESP2 over TCP, used by the benchmarks with the real redis client.
+# It only knows the commands the benchmarks need, and waits 'latency_seconds' per round trip,
+# i.e. once for all the commands of a pipeline which arrive together.
+
+
+class FakeRedisServer:
+
+  def __init__(self, latency_seconds: float = 0, host: str = "127.0.0.1", port: int = 0):
+    self.latency_seconds = latency_seconds
+    self.round_trips = 0
+    # the most messages returned by a single XREADGROUP, of all the streams together
+    self.largest_reply = 0
+    self.calls: dict[str, int] = {}
+    self.acked: dict[tuple[str, str], set[str]] = {}
+    self.deleted: dict[str, set[str]] = {}
+    self.lock = Lock()
+
+    # stream name -> entries as (id, fields), group -> index of the next entry to deliver
+    self.streams: dict[str, list[tuple[str, dict[str, str]]]] = {}
+    self.groups: dict[tuple[str, str], int] = {}
+    # (stream, group, consumer) -> ids delivered and not acked yet
+    self.pending: dict[tuple[str, str, str], list[str]] = {}
+
+    server = self
+
+    class Handler(BaseRequestHandler):
+
+      def handle(self):
+        buffer = b""
+        while True:
+          data = self.request.recv(65536)
+          if not data:
+            return
+          buffer += data
+
+          replies = []
+          while True:
+            parsed = _parse_command(buffer)
+            if parsed is None:
+              break
+            command, buffer = parsed
+            replies.append(server.execute(command))
+
+          if len(replies) > 0:
+            with server.lock:
+              server.round_trips += 1
+            if server.latency_seconds > 0:
+              time.sleep(server.latency_seconds)
+            self.request.sendall(b"".join(replies))
+
+    ThreadingTCPServer.allow_reuse_address = True
+    self.tcp = ThreadingTCPServer((host, port), Handler)
+    self.tcp.daemon_threads = True
+    self.host, self.port = self.tcp.server_address
+
+  def start(self) -> "FakeRedisServer":
+    Thread(target=self.tcp.serve_forever, daemon=True).start()
+    return self
+
+  def stop(self) -> None:
+    self.tcp.shutdown()
+    self.tcp.server_close()
+
+  def add_entries(self, stream_name: str, entries: list[dict[str, str]]) -> None:
+    """Append entries to a stream directly, without a round trip per XADD."""
+    with self.lock:
+      stream = self.streams.setdefault(stream_name, [])
+      for fields in entries:
+        stream.append((f"{len(stream) + 1}-0", fields))
+
+  def execute(self, command: list[bytes]) -> bytes:
+    name = command[0].decode().upper()
+    args = [a.decode() for a in command[1:]]
+    if name == "XREADGROUP":
+      return self.__xreadgroup(args)
+
+    with self.lock:
+      self.calls[name] = self.calls.get(name, 0) + 1
+
+      if name == "PING":
+        return b"+PONG\r\n"
+      if name == "CLIENT":
+        return b"+OK\r\n"
+      if name == "XACK":
+        stream, group, ids = args[0], args[1], args[2:]
+        acked = self.acked.setdefault((stream, group), set())
+        new = [i for i in ids if i not in acked]
+        acked.update(new)
+        return _integer(len(new))
+      if name == "XDEL":
+        stream, ids = args[0], args[1:]
+        deleted = self.deleted.setdefault(stream, set())
+        new = [i for i in ids if i not in deleted]
+        deleted.update(new)
+        return _integer(len(new))
+      if name == "XGROUP" and args[0].upper() == "CREATE":
+        stream, group = args[1], args[2]
+        if (stream, group) in self.groups:
+          return b"-BUSYGROUP Consumer Group name already exists\r\n"
+        self.streams.setdefault(stream, [])
+        self.groups[(stream, group)] = 0
+        return b"+OK\r\n"
+      if name == "XINFO" and args[0].upper() == "GROUPS":
+        stream = args[1]
+        groups = []
+        for (s, group), next_index in self.groups.items():
+          if s != stream:
+            continue
+          pending = sum(len(ids) for (ps, pg, _), ids in self.pending.items() if (ps, pg) == (s, group))
+          groups.append(_array([
+            _bulk("name"), _bulk(group),
+            _bulk("consumers"), _integer(len([k for k in self.pending if k[:2] == (s, group)])),
+            _bulk("pending"), _integer(pending),
+            _bulk("entries-read"), _integer(next_index),
+            _bulk("lag"), _integer(len(self.streams[stream]) - next_index),
+          ]))
+        return _array(groups)
+      if name == "XAUTOCLAIM":
+        return _array([_bulk("0-0"), _array([]), _array([])])
+
+    return f"-ERR unknown command '{name}'\r\n".encode()
+
+  def __xreadgroup(self, args: list[str]) -> bytes:
+    # XREADGROUP GROUP group consumer [COUNT count] [BLOCK millis] STREAMS stream [stream ...] id [id ...]
+    options = {}
+    i = 0
+    while args[i].upper() != "STREAMS":
+      key = args[i].upper()
+      if key == "GROUP":
+        options["group"], options["consumer"] = args[i + 1], args[i + 2]
+        i += 3
+      else:
+        options[key] = args[i + 1]
+        i += 2
+    keys = args[i + 1:]
+    streams = list(zip(keys[:len(keys) // 2], keys[len(keys) // 2:]))
+    group, consumer = options["group"], options["consumer"]
+    count = int(options.get("COUNT", 1 << 30))
+    deadline = time.monotonic() + int(options["BLOCK"]) / 1000 if "BLOCK" in options else 0
+
+    with self.lock:
+      self.calls["XREADGROUP"] = self.calls.get("XREADGROUP", 0) + 1
+
+    while True:
+      with self.lock:
+        replies = []
+        for stream, id in streams:
+          entries = self.streams[stream]
+          pending = self.pending.setdefault((stream, group, consumer), [])
+
+          if id != ">":
+            # the pending entries of the consumer after the id, the stream is in the reply even if there are none
+            acked = self.acked.get((stream, group), set())
+            pending[:] = [p for p in pending if p not in acked]
+            after = _id_tuple(id)
+            ids = [p for p in pending if _id_tuple(p) > after][:count]
+            by_id = dict(entries)
+            replies.append((stream, [(p, by_id[p]) for p in ids]))
+            continue
+
+          start = self.groups[(stream, group)]
+          delivered = entries[start:start + count]
+          if len(delivered) > 0:
+            self.groups[(stream, group)] = start + len(delivered)
+            pending.extend(entry_id for entry_id, _ in delivered)
+            replies.append((stream, delivered))
+
+        if len(replies) > 0:
+          self.largest_reply = max(self.largest_reply, sum(len(messages) for _, messages in replies))
+          return _read_reply(replies)
+        if time.monotonic() >= deadline:
+          return b"*-1\r\n"
+
+      time.sleep(0.001)
+
+
+def _integer(value: int) -> bytes:
+  return f":{value}\r\n".encode()
+
+
+def _bulk(value: str) -> bytes:
+  encoded = value.encode()
+  return b"$%d\r\n%s\r\n" % (len(encoded), encoded)
+
+
+def _array(items: list[bytes]) -> bytes:
+  return b"*%d\r\n%s" % (len(items), b"".join(items))
+
+
+def _read_reply(streams: list[tuple[str, list[tuple[str, dict[str, str]]]]]) -> bytes:
+  replies = []
+  for stream, entries in streams:
+    messages = []
+    for entry_id, fields in entries:
+      flat = [_bulk(v) for kv in fields.items() for v in kv]
+      messages.append(_array([_bulk(entry_id), _array(flat)]))
+    replies.append(_array([_bulk(stream), _array(messages)]))
+  return _array(replies)
+
+
+def _id_tuple(id: str) -> tuple[int, int]:
+  ms, _, seq = id.partition("-")
+  return (int(ms), int(seq or 0))
+
+
+def _parse_command(buffer: bytes) -> tuple[list[bytes], bytes] | None:
+  """Parse one RESP array of bulk strings, returns None if the buffer doesn't contain a whole command yet."""
+  if not buffer.startswith(b"*"):
+    if len(buffer) > 0:
+      raise ValueError(f"unsupported request {buffer[:20]!r}")
+    return None
+
+  end = buffer.find(b"\r\n")
+  if end < 0:
+    return None
+  count = int(buffer[1:end])
+  position = end + 2
+
+  parts = []
+  for _ in range(count):
+    end = buffer.find(b"\r\n", position)
+    if end < 0:
+      return None
+    length = int(buffer[position + 1:end])
+    start = end + 2
+    if len(buffer) < start + length + 2:
+      return None
+    parts.append(buffer[start:start + length])
+    position = start + length + 2
+
+  return (parts, buffer[position:])
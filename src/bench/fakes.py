@@ -0,0 +1,253 @@
+from api.scraped_articles.article_consumer import ScrapedArticleConsumer
+from api.scraped_articles.async_article_consumer import AsyncScrapedArticleConsumer
+from repository.analyzer import AnalyzerRepository, AsyncAnalyzerRepository
+from elasticsearch.helpers import BulkIndexError
+from domain import Article, Category
+from threading import Event, Lock
+from functools import partial
+from typing import Callable
+import numpy as np
+import time
+import zlib
+
+# In-memory stand-ins for the consumer, the repository and the models, used by the benchmarks.
+
+
+def make_docs(count: int, paragraphs: int = 5) -> list[dict]:
+  """Create 'count' scraped articles in the format the analyzer expects."""
+  docs = []
+  for i in range(count):
+    docs.append({
+      "id": f"article-{i}",
+      "url": f"https://example.com/articles/{i}",
+      "metadata": {
+        "source": "example",
+        "categories": ["news"],
+      },
+      "components": {
+        "article": [
+          {"title": f"Title of article {i}"},
+          {"author": "Jane Doe"},
+          {"publish_date": "2024-03-05T21:58:25"},
+          {"paragraphs": [f"Paragraph {j} of article {i}, with some words in it." for j in range(paragraphs)]},
+        ]
+      },
+    })
+  return docs
+
+
+class FakeArticleConsumer(ScrapedArticleConsumer):
+  """
+  Feeds a fixed list of articles to the callback, optionally waiting 'read_latency_seconds' per article.
+  With an 'arrival_rate', the articles arrive at that many per second, like messages in a stream,
+  and the ones which arrived while the callback was busy are read right away.
+  Records the seconds from the arrival, or the read, to the ack of each article in 'latencies'.
+  'all_settled' is set once every article is ack-ed or released.
+  """
+
+  def __init__(self, docs: list[dict], read_latency_seconds: float = 0, arrival_rate: float = 0):
+    self.docs = docs
+    self.read_latency_seconds = read_latency_seconds
+    self.arrival_rate = arrival_rate
+    self.acked = 0
+    self.released = 0
+    self.latencies: list[float] = []
+    self.all_acked = Event()
+    self.all_settled = Event()
+    self.__ack_lock = Lock()
+
+  def consume_article(self, callback: Callable[[dict, Callable[[], None]], None], *callback_args) -> None:
+    start = time.perf_counter()
+    for i, doc in enumerate(self.docs):
+      if self.read_latency_seconds > 0:
+        time.sleep(self.read_latency_seconds)
+      if self.arrival_rate > 0:
+        arrived_at = start + i / self.arrival_rate
+        time.sleep(max(0, arrived_at - time.perf_counter()))
+      else:
+        arrived_at = time.perf_counter()
+      callback(doc, partial(self.__ack, arrived_at), *callback_args)
+
+  def __ack(self, arrived_at: float) -> None:
+    acked_at = time.perf_counter()
+    with self.__ack_lock:
+      self.latencies.append(acked_at - arrived_at)
+      self.acked += 1
+      if self.acked == len(self.docs):
+        self.all_acked.set()
+      self.__check_settled()
+
+  def release_batch(self, acks: list[Callable[[], None]]) -> None:
+    with self.__ack_lock:
+      self.released += len(acks)
+      self.__check_settled()
+
+  def __check_settled(self) -> None:
+    # has to be called while holding the ack lock
+    if self.acked + self.released >= len(self.docs):
+      self.all_settled.set()
+
+
+class AsyncFakeArticleConsumer(AsyncScrapedArticleConsumer):
+  """Feeds a fixed list of articles to the coroutine callback, counts the ack-ed and the released ones."""
+
+  def __init__(self, docs: list[dict]):
+    self.docs = docs
+    self.acked = 0
+    self.released = 0
+
+  async def consume_article(self, callback, *callback_args) -> None:
+    for doc in self.docs:
+      await callback(doc, self.__ack, *callback_args)
+
+  async def __ack(self) -> None:
+    self.acked += 1
+
+  def release_batch(self, acks: list) -> None:
+    self.released += len(acks)
+
+
+class InMemoryRepository(AnalyzerRepository):
+  """
+  Keeps the stored articles and categories in dicts, waits 'write_latency_seconds' per write call.
+  The writes named in 'failing_writes' raise 'BulkIndexError', like items which still fail after the retries.
+  """
+
+  def __init__(self, write_latency_seconds: float = 0, failing_writes: tuple[str, ...] = ()):
+    self.write_latency_seconds = write_latency_seconds
+    self.failing_writes = set(failing_writes)
+    self.articles: dict[str, Article] = {}
+    self.categories: dict[str, Category] = {}
+
+  def store_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
+    self.__fail_if_failing("store_analyzed_articles", len(analyzed_articles))
+    if self.write_latency_seconds > 0:
+      time.sleep(self.write_latency_seconds)
+    for article in analyzed_articles:
+      self.articles[article.id] = article
+    return [article.id for article in analyzed_articles]
+
+  def update_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
+    self.__fail_if_failing("update_analyzed_articles", len(analyzed_articles))
+    if self.write_latency_seconds > 0:
+      time.sleep(self.write_latency_seconds)
+    updated = [article for article in analyzed_articles if article.id in self.articles]
+    for article in updated:
+      self.articles[article.id] = article
+    return [article.id for article in updated]
+
+  def store_categories(self, categories: list[Category]) -> list[str]:
+    self.__fail_if_failing("store_categories", len(categories))
+    created = [category.id for category in categories if category.id not in self.categories]
+    for category in categories:
+      self.categories.setdefault(category.id, category)
+    return created
+
+  def get_category_ids(self, max_count: int) -> list[str]:
+    return list(self.categories)[:max_count]
+
+  def get_analyzed_versions(self, article_ids: list[str]) -> dict[str, str | None]:
+    return {id: self.articles[id].analyzer_version for id in article_ids if id in self.articles}
+
+  def __fail_if_failing(self, write: str, count: int) -> None:
+    if write in self.failing_writes:
+      raise BulkIndexError(f"{count} document(s) failed to index.", [])
+
+
+class AsyncInMemoryRepository(AsyncAnalyzerRepository):
+  """An 'InMemoryRepository' behind the async interface."""
+
+  def __init__(self, repository: InMemoryRepository):
+    self.repository = repository
+
+  async def store_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
+    return self.repository.store_analyzed_articles(analyzed_articles)
+
+  async def store_categories(self, categories: list[Category]) -> list[str]:
+    return self.repository.store_categories(categories)
+
+  async def get_category_ids(self, max_count: int) -> list[str]:
+    return self.repository.get_category_ids(max_count)
+
+  async def get_analyzed_versions(self, article_ids: list[str]) -> dict[str, str | None]:
+    return self.repository.get_analyzed_versions(article_ids)
+
+
+class StubCategoryClassifier:
+  """Stands in for 'CategoryClassifier', waits 'seconds_per_doc' per document."""
+
+  def __init__(self, seconds_per_doc: float = 0):
+    self.seconds_per_doc = seconds_per_doc
+    self.version = "stub"
+
+  def predict_batch(self, texts: list[str]) -> list[list[str]]:
+    if self.seconds_per_doc > 0:
+      time.sleep(self.seconds_per_doc * len(texts))
+    return [["stub"] for _ in texts]
+
+
+class StubEmbeddingsModel:
+  """Stands in for 'EmbeddingsModel', waits 'seconds_per_doc' per document."""
+
+  def __init__(self, seconds_per_doc: float = 0, dims: int = 384):
+    self.seconds_per_doc = seconds_per_doc
+    self.dims = dims
+    self.version = "stub"
+    self.chunk_pooling = None
+
+  def encode(self, docs: list[str]) -> np.ndarray:
+    if self.seconds_per_doc > 0:
+      time.sleep(self.seconds_per_doc * len(docs))
+    return np.zeros((len(docs), self.dims), dtype=np.float32)
+
+
+class MatmulEmbeddingsStub:
+  """
+  CPU-bound stand-in for the pickled sentence-transformers model, its cost grows with the text length.
+  Can be pickled into an 'EmbeddingsModelContainer'.
+  """
+
+  def __init__(self, dims: int = 384, layers: int = 6, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    self.dims = dims
+    self.weights = [rng.standard_normal((dims, dims), dtype=np.float32) / np.sqrt(dims) for _ in range(layers)]
+
+  def encode(self, docs: list[str]) -> np.ndarray:
+    embeddings = np.empty((len(docs), self.dims), dtype=np.float32)
+    for i, doc in enumerate(docs):
+      # one row per word, like the token embeddings of a transformer
+      words = doc.split()[:256] or [""]
+      x = np.zeros((len(words), self.dims), dtype=np.float32)
+      x[np.arange(len(words)), [zlib.crc32(w.encode()) % self.dims for w in words]] = 1
+      for w in self.weights:
+        x = np.tanh(x @ w)
+      embeddings[i] = x.mean(axis=0)
+    return embeddings
+
+
+def make_model_container(categories: int = 10, train_docs: int = 500, seed: int = 0):
+  """Train a small TF-IDF + one-vs-rest logistic regression model on random text."""
+  from analysis.classifier import ModelContainer
+  from sklearn.feature_extraction.text import TfidfVectorizer
+  from sklearn.linear_model import LogisticRegression
+
+  rng = np.random.default_rng(seed)
+  vocabulary = [f"word{i}" for i in range(2000)]
+  texts = [" ".join(rng.choice(vocabulary, size=50)) for _ in range(train_docs)]
+
+  tfidf = TfidfVectorizer()
+  x = tfidf.fit_transform(texts)
+
+  clfs = []
+  for _ in range(categories):
+    y = rng.integers(0, 2, size=train_docs)
+    clfs.append(LogisticRegression(max_iter=200).fit(x, y))
+
+  return ModelContainer(
+    tfidf=tfidf,
+    clfs=clfs,
+    thresholds=[0.5] * categories,
+    target_names=[f"category{i}" for i in range(categories)],
+    results=None,
+    train_date=None,
+  )
@@ -0,0 +1,72 @@
+from analysis.classifier import CategoryClassifier
+from analysis.embeddings import EmbeddingsModel, EmbeddingsModelContainer
+from analysis.inference_pool import InferenceWorkerPool
+from bench.fakes import MatmulEmbeddingsStub, make_model_container
+import tempfile
+import argparse
+import logging
+import json
+import time
+import os
+
+# Measures the articles/sec of the inference worker pool as workers are added.
+# Run from the 'src' directory: python -m bench.inference_pool --workers 1 2 4
+
+
+def make_texts(count: int, words: int) -> list[str]:
+  return [" ".join(f"word{(i * 7 + j) % 2000}" for j in range(words)) for i in range(count)]
+
+
+def measure(analyze, texts: list[str], rounds: int) -> float:
+  # warm up
+  analyze(texts[:10])
+  start = time.perf_counter()
+  for _ in range(rounds):
+    analyze(texts)
+  return len(texts) * rounds / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="inference worker pool scaling")
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+  parser.add_argument("--threads-per-worker", type=int, default=1)
+  parser.add_argument("--batch-size", type=int, default=300)
+  parser.add_argument("--words", type=int, default=200)
+  parser.add_argument("--rounds", type=int, default=3)
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  texts = make_texts(args.batch_size, args.words)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    cat_clf_path = os.path.join(tmp, "clf.pkl")
+    embeddings_path = os.path.join(tmp, "embeddings.pkl")
+    make_model_container().save(cat_clf_path)
+    EmbeddingsModelContainer(MatmulEmbeddingsStub(), "matmul-stub").save(embeddings_path)
+
+    # baseline, the models in this process
+    classifier = CategoryClassifier(make_model_container())
+    embeddings_model = EmbeddingsModel(EmbeddingsModelContainer.load(embeddings_path))
+    def analyze_in_process(texts):
+      classifier.predict_batch(texts)
+      embeddings_model.encode(texts)
+    print(json.dumps({
+      "workers": 0,
+      "articles_per_second": round(measure(analyze_in_process, texts, args.rounds), 1),
+    }))
+
+    for workers in args.workers:
+      pool = InferenceWorkerPool(
+        cat_clf_path,
+        embeddings_path,
+        workers=workers,
+        threads_per_worker=args.threads_per_worker,
+      )
+      pool.wait_ready()
+      print(json.dumps({
+        "workers": workers,
+        "threads_per_worker": args.threads_per_worker,
+        "articles_per_second": round(measure(pool.analyze_batch, texts, args.rounds), 1),
+      }))
+      pool.shutdown()
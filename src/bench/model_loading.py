@@ -0,0 +1,68 @@
+from analysis.classifier import ModelContainer
+from bench.fakes import make_model_container
+import subprocess
+import tempfile
+import argparse
+import json
+import sys
+import os
+
+# Compares the cold start time and the memory of loading the pickled models and the memory-mapped artifacts.
+# Every load runs in a fresh interpreter. 'rss_file_kb' is the part of the memory backed by files,
+# which is shared between the processes loading the same artifact.
+# Without model paths, a generated classifier is converted and measured.
+# Run from the 'src' directory:
+# python -m bench.model_loading --cat-clf-model models/....pkl --embeddings-model models/....pkl
+
+LOAD_SCRIPT = """
+import time, json, sys
+start = time.perf_counter()
+from analysis.classifier import ModelContainer, CategoryClassifier
+from analysis.embeddings import EmbeddingsModelContainer, EmbeddingsModel
+kind, path = sys.argv[1], sys.argv[2]
+if kind == "classifier":
+  CategoryClassifier(ModelContainer.load(path)).predict_batch(["warm up"])
+else:
+  EmbeddingsModel(EmbeddingsModelContainer.load(path)).encode(["warm up"])
+seconds = time.perf_counter() - start
+status = dict(line.split(":", 1) for line in open("/proc/self/status") if ":" in line)
+kb = lambda name: int(status.get(name, "0 kB").split()[0])
+print(json.dumps({
+  "seconds": round(seconds, 3),
+  "rss_kb": kb("VmRSS"),
+  "rss_anon_kb": kb("RssAnon"),
+  "rss_file_kb": kb("RssFile"),
+}))
+"""
+
+
+def measure(kind: str, path: str) -> dict:
+  out = subprocess.run(
+    [sys.executable, "-c", LOAD_SCRIPT, kind, path],
+    capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(__file__)),
+  ).stdout
+  return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="pickle vs memory-mapped artifact loading")
+  parser.add_argument("--cat-clf-model", help="pickled ModelContainer")
+  parser.add_argument("--embeddings-model", help="pickled EmbeddingsModelContainer")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    cat_clf_model = args.cat_clf_model
+    if cat_clf_model is None:
+      cat_clf_model = os.path.join(tmp, "clf.pkl")
+      make_model_container(categories=50).save(cat_clf_model)
+
+    models = [("classifier", cat_clf_model, ModelContainer)]
+    if args.embeddings_model:
+      from analysis.embeddings import EmbeddingsModelContainer
+      models.append(("embeddings", args.embeddings_model, EmbeddingsModelContainer))
+
+    for kind, pickle_path, container in models:
+      artifact_path = os.path.join(tmp, f"{kind}_artifact")
+      container.load(pickle_path).save_artifact(artifact_path)
+      for fmt, path in (("pickle", pickle_path), ("artifact", artifact_path)):
+        print(json.dumps({"model": kind, "format": fmt, **measure(kind, path)}))
@@ -0,0 +1,115 @@
+from api.redis_handler import RedisHandler
+from api.scraped_articles.redis_article_consumer import RedisScrapedArticleConsumer
+from api.scraped_articles.article_batcher import ArticleBatcher
+from bench.fake_redis import FakeRedisServer
+from bench.fakes import make_docs
+from threading import Thread, Event
+from utils import metrics
+import argparse
+import logging
+import json
+import time
+
+# Consumes several streams with uneven backlogs into the same batches, and reports how the batches were shared
+# between the streams, and after how many batches each stream was drained. With '--burst', the other streams
+# get that many new messages each after the first batch. XREADGROUP returns up to COUNT messages of each stream,
+# the messages taken from a read have to fit in a batch nevertheless.
+# Run from the 'src' directory: python -m bench.multi_stream
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="fan-in of several streams into one batcher")
+  parser.add_argument("--backlogs", type=int, nargs="+", default=[6000, 900, 150])
+  parser.add_argument("--batch-size", type=int, default=300)
+  parser.add_argument("--latency", type=float, default=0.001, help="seconds per round trip")
+  parser.add_argument("--burst", type=int, default=0, help="new messages of each other stream after the first batch")
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  server = FakeRedisServer(latency_seconds=args.latency).start()
+  stream_names = [f"articles-{i}" for i in range(len(args.backlogs))]
+  for stream_name, backlog in zip(stream_names, args.backlogs):
+    docs = make_docs(backlog, paragraphs=1)
+    for doc in docs:
+      doc["metadata"]["source"] = stream_name
+    server.add_entries(stream_name, [{"article": json.dumps(doc)} for doc in docs])
+
+  consumer = RedisScrapedArticleConsumer(
+    RedisHandler(server.host, server.port),
+    stream_names,
+    "analyzer",
+    max_read_count=args.batch_size,
+  )
+
+  # the messages passed to the batcher, by the XREADGROUP they were read by
+  taken_per_read = {}
+  consume_article = consumer.consume_article
+
+  def count_taken(callback, *callback_args) -> None:
+    def counted(article, ack, *args):
+      read = server.calls.get("XREADGROUP", 0)
+      taken_per_read[read] = taken_per_read.get(read, 0) + 1
+      callback(article, ack, *args)
+    consume_article(counted, *callback_args)
+
+  consumer.consume_article = count_taken
+
+  batches = []
+  done = Event()
+  total = sum(args.backlogs) + args.burst * (len(stream_names) - 1)
+
+  def process(batch: list[dict]) -> None:
+    shares = {stream_name: 0 for stream_name in stream_names}
+    for doc in batch:
+      shares[doc["metadata"]["source"]] += 1
+    batches.append(shares)
+    if len(batches) == 1 and args.burst > 0:
+      # the streams which were idle until now
+      for stream_name in stream_names[1:]:
+        docs = make_docs(args.burst, paragraphs=1)
+        for doc in docs:
+          doc["metadata"]["source"] = stream_name
+        server.add_entries(stream_name, [{"article": json.dumps(doc)} for doc in docs])
+    if sum(sum(b.values()) for b in batches) >= total:
+      done.set()
+
+  # batches of a fixed size, comparable between the runs
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=1000,
+    adaptive_batch_size=False,
+  )
+
+  start = time.perf_counter()
+  Thread(target=batcher.consume_batched_articles, args=(process,), daemon=True).start()
+  done.wait()
+  elapsed = time.perf_counter() - start
+  server.stop()
+
+  drained_after = {}
+  remaining = {
+    stream_name: backlog + (args.burst if i > 0 else 0) 
+    for i, (stream_name, backlog) in enumerate(zip(stream_names, args.backlogs))
+  }
+  for i, shares in enumerate(batches):
+    for stream_name, count in shares.items():
+      remaining[stream_name] -= count
+      if remaining[stream_name] == 0 and stream_name not in drained_after:
+        drained_after[stream_name] = i + 1
+
+  values = metrics.snapshot()
+  print(json.dumps({
+    "backlogs": dict(zip(stream_names, args.backlogs)),
+    "seconds": round(elapsed, 3),
+    "batches": len(batches),
+    "first_batches": batches[:3],
+    "drained_after_batches": drained_after,
+    "messages_read": {s: values.get(f"analyzer_stream_messages_total{{stream={s}}}") for s in stream_names},
+    "largest_reply": server.largest_reply,
+    "largest_read_taken": max(taken_per_read.values()),
+    "xreadgroup_calls": server.calls.get("XREADGROUP", 0),
+    "xack_calls": server.calls.get("XACK", 0),
+    "round_trips": server.round_trips,
+  }, indent=2))
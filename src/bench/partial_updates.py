@@ -0,0 +1,87 @@
+from repository.analyzer.elasticsearch_repository import ElasticsearchRepository
+from bench.fake_elasticsearch import FakeElasticsearchServer
+from bench.bulk_writes import make_articles
+import numpy as np
+import argparse
+import logging
+import json
+
+# Bytes of the bulk requests of the 'index' and the 'update' write modes, when new articles are stored, and when
+# the stored articles are analyzed again, and how many of the topics written meanwhile by another service are kept.
+# A share of the articles analyzed again were edited, like re-scraped articles, their new text has to be stored,
+# the 'update' mode tells them by the content hashes it looks up.
+# Run from the 'src' directory: python -m bench.partial_updates
+
+
+def run(args, write_mode: str) -> dict:
+  server = FakeElasticsearchServer(latency_seconds=0).start()
+  repository = ElasticsearchRepository(
+    server.url,
+    "elastic",
+    "password",
+    None,
+    verify_certs=False,
+    write_mode=write_mode,
+    embeddings_options={"precision": args.precision},
+  )
+  articles = make_articles(args.articles, args.paragraphs)
+
+  def store(articles) -> tuple[int, int]:
+    before, mget_before = server.bytes, server.mget_bytes
+    for i in range(0, len(articles), args.batch_size):
+      repository.store_analyzed_articles(articles[i:i + args.batch_size])
+    return server.bytes - before, server.mget_bytes - mget_before
+
+  new_bytes, _ = store(articles)
+
+  # the topic modeler updates the stored documents
+  stored = server.docs[repository.articles_index]
+  for id, source in stored.items():
+    stored[id] = json.dumps({**json.loads(source), "topics": {"topic_ids": ["topic-1"]}}).encode()
+
+  # analyzed again with other models, some of them edited
+  rng = np.random.default_rng(1)
+  edited = set(range(0, len(articles), round(1 / args.edited_rate))) if args.edited_rate > 0 else set()
+  reanalyzed = [
+    article.model_copy(update={
+      "embeddings": rng.standard_normal(len(article.embeddings)).tolist(), 
+      "analyzer_version": "new",
+      **({"title": [f"{article.title[0]} (updated)"]} if i in edited else {}),
+    })
+    for i, article in enumerate(articles)
+  ]
+  reanalysis_bytes, lookup_bytes = store(reanalyzed)
+
+  kept_topics = sum(1 for source in stored.values() if "topics" in json.loads(source))
+  current_edits = sum(
+    1 for i in edited 
+    if json.loads(stored[reanalyzed[i].id])["article"]["title"] == reanalyzed[i].title
+  )
+  server.stop()
+  return {
+    "write_mode": write_mode,
+    "articles": len(articles),
+    "new_articles_bulk_bytes": new_bytes,
+    "reanalysis_bulk_bytes": reanalysis_bytes,
+    "reanalysis_bytes_per_article": round(reanalysis_bytes / len(articles)),
+    # the stored fields fetched to tell the edited articles
+    "lookup_bytes_per_article": round(lookup_bytes / len(articles)),
+    "topics_kept": kept_topics,
+    "edited_articles": len(edited),
+    "edited_articles_stored": current_edits,
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="bulk bytes of the index and the update write modes")
+  parser.add_argument("--articles", type=int, default=3000)
+  parser.add_argument("--paragraphs", type=int, default=60, help="of about 50 bytes each")
+  parser.add_argument("--batch-size", type=int, default=300)
+  parser.add_argument("--precision", type=int, default=None, help="decimals of the embeddings in the requests")
+  parser.add_argument("--edited-rate", type=float, default=0.1, help="of the articles analyzed again")
+  args = parser.parse_args()
+
+  logging.disable(logging.WARNING)
+
+  for write_mode in ElasticsearchRepository.write_modes:
+    print(json.dumps(run(args, write_mode)))
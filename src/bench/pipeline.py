@@ -0,0 +1,65 @@
+from analysis.analyzer import Analyzer
+from api.scraped_articles.article_batcher import ArticleBatcher
+from api.scraped_articles.article_pipeline import ArticlePipeline
+from bench.fakes import (
+  make_docs,
+  FakeArticleConsumer,
+  InMemoryRepository,
+  StubCategoryClassifier,
+  StubEmbeddingsModel,
+)
+import argparse
+import logging
+import json
+import time
+
+# Compares the throughput of the synchronous batcher with the pipelined mode.
+# Run from the 'src' directory: python -m bench.pipeline
+
+
+def run(args, pipelined: bool) -> dict:
+  consumer = FakeArticleConsumer(make_docs(args.articles), read_latency_seconds=args.read_latency)
+  repository = InMemoryRepository(write_latency_seconds=args.write_latency)
+  analyzer = Analyzer(
+    repository,
+    StubCategoryClassifier(args.classify_latency),
+    StubEmbeddingsModel(args.embed_latency),
+  )
+  # batches of a fixed size, comparable between the runs
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=100,
+    adaptive_batch_size=False,
+  )
+
+  start = time.perf_counter()
+  if pipelined:
+    ArticlePipeline(batcher).consume_pipelined_articles(analyzer.analyze, analyzer.store)
+  else:
+    batcher.consume_batched_articles(analyzer.process)
+  consumer.all_acked.wait()
+  elapsed = time.perf_counter() - start
+
+  return {
+    "mode": "pipelined" if pipelined else "sync",
+    "articles": args.articles,
+    "seconds": round(elapsed, 3),
+    "articles_per_second": round(args.articles / elapsed, 1),
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="pipelined vs synchronous batch processing throughput")
+  parser.add_argument("--articles", type=int, default=1800)
+  parser.add_argument("--batch-size", type=int, default=300)
+  parser.add_argument("--read-latency", type=float, default=0.0005, help="seconds per article read")
+  parser.add_argument("--classify-latency", type=float, default=0.0005, help="seconds per article classified")
+  parser.add_argument("--embed-latency", type=float, default=0.002, help="seconds per article embedded")
+  parser.add_argument("--write-latency", type=float, default=0.5, help="seconds per bulk write")
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  for pipelined in (False, True):
+    print(json.dumps(run(args, pipelined)))
@@ -0,0 +1,77 @@
+from api.redis_handler import RedisHandler
+from api.stream_read_tuner import StreamReadTuner
+from api.scraped_articles.redis_article_consumer import RedisScrapedArticleConsumer
+from api.scraped_articles.article_batcher import ArticleBatcher
+from bench.fake_redis import FakeRedisServer
+from bench.fakes import make_docs
+from threading import Thread, Event
+import argparse
+import logging
+import json
+import time
+
+# Drains a stream backlog through the Redis consumer and the batcher, with the old fixed reads
+# (COUNT 10) and with the adaptive reads, against a local Redis stand-in with a simulated round trip.
+# Run from the 'src' directory: python -m bench.stream_reads
+
+
+def run(args, adaptive: bool) -> dict:
+  server = FakeRedisServer(latency_seconds=args.latency).start()
+  server.add_entries("articles", [{"article": json.dumps(doc)} for doc in make_docs(args.articles, paragraphs=2)])
+
+  consumer = RedisScrapedArticleConsumer(
+    RedisHandler(server.host, server.port),
+    "articles",
+    "analyzer",
+    max_read_count=args.batch_size,
+  )
+  if not adaptive:
+    consumer.read_tuners["articles"] = StreamReadTuner("articles", min_count=10, max_count=10, min_block_millis=10000)
+
+  processed = 0
+  done = Event()
+
+  def process(batch: list[dict]) -> None:
+    nonlocal processed
+    # stands in for the models, 'model_latency' seconds per article
+    time.sleep(args.model_latency * len(batch))
+    processed += len(batch)
+    if processed >= args.articles:
+      done.set()
+
+  # batches of a fixed size, comparable between the runs
+  batcher = ArticleBatcher(
+    consumer,
+    max_batch_size=args.batch_size,
+    max_batch_timeout_millis=1000,
+    adaptive_batch_size=False,
+  )
+
+  start = time.perf_counter()
+  Thread(target=batcher.consume_batched_articles, args=(process,), daemon=True).start()
+  done.wait()
+  elapsed = time.perf_counter() - start
+  server.stop()
+
+  return {
+    "mode": "adaptive" if adaptive else "fixed",
+    "articles": args.articles,
+    "seconds": round(elapsed, 3),
+    "articles_per_second": round(args.articles / elapsed, 1),
+    "xreadgroup_calls": server.calls.get("XREADGROUP", 0),
+    "round_trips": server.round_trips,
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="fixed vs adaptive stream reads while draining a backlog")
+  parser.add_argument("--articles", type=int, default=6000)
+  parser.add_argument("--batch-size", type=int, default=300)
+  parser.add_argument("--latency", type=float, default=0.001, help="seconds per round trip")
+  parser.add_argument("--model-latency", type=float, default=0.0002, help="seconds per article processed")
+  args = parser.parse_args()
+
+  logging.disable(logging.INFO)
+
+  for adaptive in (False, True):
+    print(json.dumps(run(args, adaptive)))
@@ -0,0 +1,25 @@
+from analysis.classifier import ModelContainer
+from analysis.embeddings import EmbeddingsModelContainer
+import argparse
+
+# Converts the pickled model containers into artifact directories, which are memory-mapped when loaded.
+# The artifact directories can be used in place of the pickles in CAT_CLF_MODEL_PATH and EMBEDDINGS_MODEL_PATH.
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="convert pickled models to memory-mappable artifacts")
+  parser.add_argument("--cat-clf-model", help="pickled ModelContainer")
+  parser.add_argument("--cat-clf-artifact", help="output directory of the classifier artifact")
+  parser.add_argument("--embeddings-model", help="pickled EmbeddingsModelContainer")
+  parser.add_argument("--embeddings-artifact", help="output directory of the embeddings artifact")
+  args = parser.parse_args()
+
+  if args.cat_clf_model:
+    if not args.cat_clf_artifact:
+      parser.error("--cat-clf-model needs --cat-clf-artifact")
+    ModelContainer.load(args.cat_clf_model).save_artifact(args.cat_clf_artifact)
+
+  if args.embeddings_model:
+    if not args.embeddings_artifact:
+      parser.error("--embeddings-model needs --embeddings-artifact")
+    EmbeddingsModelContainer.load(args.embeddings_model).save_artifact(args.embeddings_artifact)
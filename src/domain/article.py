@@ -27,6 +27,9 @@ class Article(pydantic.BaseModel):
   analyzed_categories: list[Category] # subset of 'categories', only contains the categories that were assigned by the analyzer
   embeddings: list[float]
 
+  # identifies the models which produced the analysis
+  analyzer_version: str | None = None
+
   # topics part
   # topics are optional, will be added later by the topic modeler
   topics: list[ArticleTopic] | None = None
@@ -1,21 +1,87 @@
+import time
+
+# startup times are measured from here, before the imports
+START_TIME = time.monotonic()
+
 from analysis.classifier import CategoryClassifier, ModelContainer
 from analysis.embeddings import EmbeddingsModelContainer, EmbeddingsModel
 from analysis.analyzer import Analyzer
+from analysis.inference_pool import InferenceWorkerPool
+from analysis.analysis_cache import AnalysisCache
+from analysis.article_deduplicator import ArticleDeduplicator
+from analysis.known_categories import KnownCategories
+from analysis.async_analyzer import AsyncAnalyzer
 
 from api.scraped_articles.redis_article_consumer import RedisScrapedArticleConsumer
 from api.scraped_articles.article_batcher import ArticleBatcher
+from api.scraped_articles.article_pipeline import ArticlePipeline
+from api.scraped_articles.async_article_batcher import AsyncArticleBatcher
+from api.scraped_articles.async_redis_article_consumer import AsyncRedisScrapedArticleConsumer
 from api.redis_handler import RedisHandler
+from api.async_redis_handler import AsyncRedisHandler
+from api.health_server import HealthServer
 
 from domain import *
 from utils import log_utils
 from repository.analyzer import *
-from utils.check_env import check_env
+from utils.check_env import check_env, check_env_bool
+from utils.readiness import Readiness
+from utils.deferred import Deferred
+from utils.in_flight_budget import InFlightBudget
+
+from concurrent.futures import ThreadPoolExecutor, Future
+import asyncio
+import os
 
 
 # ML models
 CAT_CLF_MODEL_PATH = check_env('CAT_CLF_MODEL_PATH')
 EMBEDDINGS_MODEL_PATH = check_env('EMBEDDINGS_MODEL_PATH')
 
+# max tokens per embeddings micro-batch including padding, 0 lets the model batch the texts itself,
+# off by default until the micro-batches are checked for parity with 'SentenceTransformer.encode' on the real model
+EMBEDDINGS_TOKEN_BUDGET = int(check_env('EMBEDDINGS_TOKEN_BUDGET', 0))
+
+# embed long articles in chunks pooled into one vector, 'mean' or 'title_weighted', empty disables chunking
+EMBEDDINGS_CHUNK_POOLING = check_env('EMBEDDINGS_CHUNK_POOLING', '') or None
+EMBEDDINGS_MAX_CHUNKS = int(check_env('EMBEDDINGS_MAX_CHUNKS', 8))
+
+# 'torch' (fp32), 'int8' (dynamically quantized) or 'onnx' (ONNX Runtime, needs the exported model)
+EMBEDDINGS_BACKEND = check_env('EMBEDDINGS_BACKEND', 'torch')
+EMBEDDINGS_ONNX_PATH = check_env('EMBEDDINGS_ONNX_PATH', '') or None
+
+# also read by 'backfill.py'
+EMBEDDINGS_OPTIONS = {
+  "token_budget": EMBEDDINGS_TOKEN_BUDGET,
+  "chunk_pooling": EMBEDDINGS_CHUNK_POOLING,
+  "max_chunks": EMBEDDINGS_MAX_CHUNKS,
+  "backend": EMBEDDINGS_BACKEND,
+  "onnx_path": EMBEDDINGS_ONNX_PATH,
+}
+
+# Inference worker processes, 0 runs the models in the consumer process
+INFERENCE_WORKERS = int(check_env('INFERENCE_WORKERS', 0))
+INFERENCE_THREADS_PER_WORKER = int(check_env('INFERENCE_THREADS_PER_WORKER', 1))
+
+# Analysis cache, off by default, 0 entries disables it, the on-disk tier is optional
+ANALYSIS_CACHE_MAX_ENTRIES = int(check_env('ANALYSIS_CACHE_MAX_ENTRIES', 0))
+ANALYSIS_CACHE_PATH = check_env('ANALYSIS_CACHE_PATH', '') or None
+ANALYSIS_CACHE_MAX_DISK_ENTRIES = int(check_env('ANALYSIS_CACHE_MAX_DISK_ENTRIES', 1000000))
+
+# Skip articles which are already stored with the current model versions
+DEDUP_MODE = check_env_bool('DEDUP_MODE', False)
+DEDUP_MAX_RECENT_IDS = int(check_env('DEDUP_MAX_RECENT_IDS', 100000))
+
+# only the categories which are not known to be stored are written, the known ones are loaded at startup,
+# 0 writes every category of every batch
+KNOWN_CATEGORIES_MAX_ENTRIES = int(check_env('KNOWN_CATEGORIES_MAX_ENTRIES', 10000))
+
+# Run the classification and the embeddings of a batch in parallel
+CONCURRENT_INFERENCE = check_env_bool('CONCURRENT_INFERENCE', False)
+
+# Health, readiness and metrics endpoints, 0 disables the server
+HEALTH_PORT = int(check_env('HEALTH_PORT', 8080))
+
 # Redis
 REDIS_HOST = check_env('REDIS_HOST', 'localhost')
 REDIS_PORT = int(check_env('REDIS_PORT', 6379))
@@ -24,6 +90,15 @@ REDIS_PORT = int(check_env('REDIS_PORT', 6379))
 REDIS_CONSUMER_GROUP = check_env('REDIS_CONSUMER_GROUP', 'article_analyzer')
 REDIS_STREAM_NAME = check_env('REDIS_STREAM_NAME', 'scraped_articles')
 
+# comma separated streams consumed by this process into the same batches, defaults to REDIS_STREAM_NAME
+REDIS_STREAM_NAMES = [name.strip() for name in check_env('REDIS_STREAM_NAMES', REDIS_STREAM_NAME).split(',') if name.strip()]
+
+# delete the messages from the stream once they are ack-ed, in the same round trip as the XACK
+REDIS_DELETE_ACKED = check_env_bool('REDIS_DELETE_ACKED', False)
+
+# longest BLOCK of a stream read when the stream is idle, the COUNT adapts to the backlog up to MAX_BATCH_SIZE
+REDIS_MAX_READ_BLOCK_MILLIS = int(check_env('REDIS_MAX_READ_BLOCK_MILLIS', 5000))
+
 # Elasticsearch
 ELASTIC_USER = check_env('ELASTIC_USER', 'elastic')
 ELASTIC_PASSWORD = check_env('ELASTIC_PASSWORD')
@@ -31,44 +106,255 @@ ELASTIC_CONN = check_env('ELASTIC_HOST', 'https://localhost:9200')
 ELASTIC_CA_PATH = check_env('ELASTIC_CA_PATH', 'certs/_data/ca/ca.crt')
 ELASTIC_TLS_INSECURE = bool(check_env('ELASTIC_TLS_INSECURE', False))
 
+# bulk writes in chunks of at most this many bytes and documents, with this many requests in flight,
+# the items rejected with 429 are retried with an exponential backoff
+ELASTIC_BULK_OPTIONS = {
+  "max_chunk_bytes": int(check_env('ELASTIC_BULK_MAX_CHUNK_BYTES', 5 * 1024 * 1024)),
+  "max_chunk_docs": int(check_env('ELASTIC_BULK_MAX_CHUNK_DOCS', 500)),
+  "max_in_flight": int(check_env('ELASTIC_BULK_MAX_IN_FLIGHT', 2)),
+  "max_retries": int(check_env('ELASTIC_BULK_MAX_RETRIES', 5)),
+}
+
+# 'index' writes whole documents, 'update' sends only the analysis of the articles which are already stored
+# with the same text, as partial updates, and keeps the fields written by other services, like the topics
+ELASTIC_WRITE_MODE = check_env('ELASTIC_WRITE_MODE', 'index')
+
+# storage of the embeddings, only applied when the articles index is created: 'int8_hnsw' quantizes the kNN graph,
+# 'byte' elements store the vectors scaled by 127, the precision rounds the floats sent in the bulk requests
+ELASTIC_EMBEDDINGS_PRECISION = check_env('ELASTIC_EMBEDDINGS_PRECISION', '')
+ELASTIC_EMBEDDINGS_OPTIONS = {
+  "index_type": check_env('ELASTIC_EMBEDDINGS_INDEX_TYPE', '') or None,
+  "element_type": check_env('ELASTIC_EMBEDDINGS_ELEMENT_TYPE', 'float'),
+  "precision": int(ELASTIC_EMBEDDINGS_PRECISION) if ELASTIC_EMBEDDINGS_PRECISION else None,
+}
+
 # Article batcher
 MAX_BATCH_SIZE = int(check_env('MAX_BATCH_SIZE', 300))
 MAX_BATCH_TIMEOUT_MILLIS = int(check_env('MAX_BATCH_TIMEOUT_MILLIS', 5000))
 
+# the target batch size adapts to the load between MIN_BATCH_SIZE and MAX_BATCH_SIZE, MAX_BATCH_TIMEOUT_MILLIS
+# is the longest an article waits for its batch
+ADAPTIVE_BATCH_SIZE = check_env_bool('ADAPTIVE_BATCH_SIZE', True)
+MIN_BATCH_SIZE = int(check_env('MIN_BATCH_SIZE', 1))
 
-log = log_utils.create_console_logger("Main")
-log.info(f"Initializing dependencies")
+# Pipelined processing, overlaps reading, analyzing and storing batches
+PIPELINE_MODE = check_env_bool('PIPELINE_MODE', False)
+PIPELINE_MAX_QUEUED_BATCHES = int(check_env('PIPELINE_MAX_QUEUED_BATCHES', 2))
 
-category_classifier = CategoryClassifier(ModelContainer.load(CAT_CLF_MODEL_PATH))
-embeddings_model = EmbeddingsModel(EmbeddingsModelContainer.load(EMBEDDINGS_MODEL_PATH))
+# Asyncio consumer and repository on one event loop, the inference runs in an executor
+ASYNC_MODE = check_env_bool('ASYNC_MODE', False)
+ASYNC_MAX_IN_FLIGHT_BATCHES = int(check_env('ASYNC_MAX_IN_FLIGHT_BATCHES', 2))
 
-repository: AnalyzerRepository = ElasticsearchRepository(
-  ELASTIC_CONN, 
-  ELASTIC_USER, 
-  ELASTIC_PASSWORD, 
-  ELASTIC_CA_PATH, 
-  not ELASTIC_TLS_INSECURE
-)
+# Backpressure, the stream reads pause while this many messages, or bytes of messages, are read and not ack-ed yet,
+# the unread messages stay in the streams for the other consumers
+MAX_IN_FLIGHT_MESSAGES = int(check_env('MAX_IN_FLIGHT_MESSAGES', 4 * MAX_BATCH_SIZE))
+MAX_IN_FLIGHT_BYTES = int(check_env('MAX_IN_FLIGHT_BYTES', 64 * 1024 * 1024))
 
-redis_handler = RedisHandler(
-  REDIS_HOST,
-  REDIS_PORT,
-)
 
-redis_consumer = RedisScrapedArticleConsumer(
-  redis_handler,
-  stream_name=REDIS_STREAM_NAME,
-  consumer_group=REDIS_CONSUMER_GROUP,
-)
+# the worker processes of the inference pool import this module too, only initialize in the main process
+if __name__ == '__main__':
+  log = log_utils.create_console_logger("Main")
+  log.info(f"Initializing dependencies")
 
-article_batcher = ArticleBatcher(
-  redis_consumer,
-  max_batch_size=MAX_BATCH_SIZE,
-  max_batch_timeout_millis=MAX_BATCH_TIMEOUT_MILLIS,
-)
+  if INFERENCE_WORKERS > 0:
+    readiness = Readiness(["inference_pool", "elasticsearch", "redis"], start_time=START_TIME)
+  else:
+    readiness = Readiness(["classifier", "embeddings", "elasticsearch", "redis"], start_time=START_TIME)
 
-analyzer = Analyzer(repository, category_classifier, embeddings_model)
+  if HEALTH_PORT > 0:
+    HealthServer(HEALTH_PORT, readiness).start()
 
+  # the dependencies are initialized concurrently, the models keep loading while the connections are made
+  init_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="init")
 
-if __name__ == '__main__':
-  article_batcher.consume_batched_articles(analyzer.process)
+  def init(component: str, fn, *args, **kwargs) -> Future:
+    def on_done(f: Future):
+      if f.exception() is not None:
+        log.error(f"failed to initialize {component}", exc_info=f.exception())
+        # nothing can be processed without it, let the orchestration restart the process
+        os._exit(1)
+      readiness.set_ready(component)
+
+    future = init_executor.submit(fn, *args, **kwargs)
+    future.add_done_callback(on_done)
+    return future
+
+  def create_inference_pool() -> InferenceWorkerPool:
+    # the workers load the models themselves
+    pool = InferenceWorkerPool(
+      CAT_CLF_MODEL_PATH,
+      EMBEDDINGS_MODEL_PATH,
+      workers=INFERENCE_WORKERS,
+      threads_per_worker=INFERENCE_THREADS_PER_WORKER,
+      embeddings_options=EMBEDDINGS_OPTIONS,
+    )
+    pool.wait_ready()
+    return pool
+
+  inference_pool = None
+  category_classifier = None
+  embeddings_model = None
+  if INFERENCE_WORKERS > 0:
+    inference_pool = Deferred(init("inference_pool", create_inference_pool))
+  else:
+    category_classifier = Deferred(init(
+      "classifier",
+      lambda: CategoryClassifier(ModelContainer.load(CAT_CLF_MODEL_PATH)),
+    ))
+    embeddings_model = Deferred(init(
+      "embeddings",
+      lambda: EmbeddingsModel(EmbeddingsModelContainer.load(EMBEDDINGS_MODEL_PATH), **EMBEDDINGS_OPTIONS),
+    ))
+
+  # in async mode, the connections are made on the event loop, the synchronous repository is only
+  # needed for the lookups of the deduplicator, which run in the inference executor
+  repository_future = None
+  if not ASYNC_MODE or DEDUP_MODE:
+    repository_future = init(
+      "elasticsearch",
+      ElasticsearchRepository,
+      ELASTIC_CONN, 
+      ELASTIC_USER, 
+      ELASTIC_PASSWORD, 
+      ELASTIC_CA_PATH, 
+      not ELASTIC_TLS_INSECURE,
+      bulk_options=ELASTIC_BULK_OPTIONS,
+      embeddings_options=ELASTIC_EMBEDDINGS_OPTIONS,
+      write_mode=ELASTIC_WRITE_MODE,
+    )
+
+  redis_future = None
+  if not ASYNC_MODE:
+    redis_future = init(
+      "redis",
+      RedisHandler,
+      REDIS_HOST,
+      REDIS_PORT,
+    )
+
+  # the consumer needs the connections, the models are only waited for by the first batch
+  repository: AnalyzerRepository | None = repository_future.result() if repository_future is not None else None
+
+  analysis_cache = None
+  if ANALYSIS_CACHE_MAX_ENTRIES > 0:
+    analysis_cache = AnalysisCache(
+      max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+      disk_path=ANALYSIS_CACHE_PATH,
+      max_disk_entries=ANALYSIS_CACHE_MAX_DISK_ENTRIES,
+    )
+
+  known_categories = None
+  if KNOWN_CATEGORIES_MAX_ENTRIES > 0:
+    known_categories = KnownCategories(KNOWN_CATEGORIES_MAX_ENTRIES)
+    if repository is not None:
+      known_categories.warm(repository.get_category_ids(KNOWN_CATEGORIES_MAX_ENTRIES))
+
+  analyzer = Analyzer(
+    repository, 
+    category_classifier, 
+    embeddings_model, 
+    inference_pool=inference_pool, 
+    cache=analysis_cache,
+    deduplicator=ArticleDeduplicator(repository, DEDUP_MAX_RECENT_IDS) if DEDUP_MODE else None,
+    concurrent_inference=CONCURRENT_INFERENCE,
+    known_categories=known_categories,
+  )
+
+  in_flight_budget = InFlightBudget(MAX_IN_FLIGHT_MESSAGES, MAX_IN_FLIGHT_BYTES)
+
+  if ASYNC_MODE:
+
+    async def consume_async():
+      async_repository = AsyncElasticsearchRepository(
+        ELASTIC_CONN, 
+        ELASTIC_USER, 
+        ELASTIC_PASSWORD, 
+        ELASTIC_CA_PATH, 
+        not ELASTIC_TLS_INSECURE,
+        bulk_options=ELASTIC_BULK_OPTIONS,
+        embeddings_options=ELASTIC_EMBEDDINGS_OPTIONS,
+        write_mode=ELASTIC_WRITE_MODE,
+      )
+      async_redis_handler = AsyncRedisHandler(REDIS_HOST, REDIS_PORT)
+
+      async def connect_redis():
+        await async_redis_handler.connect()
+        readiness.set_ready("redis")
+
+      async def assert_indices():
+        await async_repository.assert_indices()
+        if repository is None:
+          readiness.set_ready("elasticsearch")
+
+      await asyncio.gather(connect_redis(), assert_indices())
+      if known_categories is not None and repository is None:
+        known_categories.warm(await async_repository.get_category_ids(KNOWN_CATEGORIES_MAX_ENTRIES))
+
+      async_analyzer = AsyncAnalyzer(analyzer, async_repository)
+
+      async def process(docs: list[dict]) -> list[str]:
+        ids = await async_analyzer.process(docs)
+        readiness.first_batch_done()
+        return ids
+
+      batcher = AsyncArticleBatcher(
+        AsyncRedisScrapedArticleConsumer(
+          async_redis_handler,
+          stream_name=REDIS_STREAM_NAMES,
+          consumer_group=REDIS_CONSUMER_GROUP,
+          delete_acked=REDIS_DELETE_ACKED,
+          max_read_count=MAX_BATCH_SIZE,
+          max_read_block_millis=REDIS_MAX_READ_BLOCK_MILLIS,
+          in_flight_budget=in_flight_budget,
+        ),
+        max_batch_size=MAX_BATCH_SIZE,
+        max_batch_timeout_millis=MAX_BATCH_TIMEOUT_MILLIS,
+        max_in_flight_batches=ASYNC_MAX_IN_FLIGHT_BATCHES,
+        min_batch_size=MIN_BATCH_SIZE,
+        adaptive_batch_size=ADAPTIVE_BATCH_SIZE,
+      )
+      try:
+        await batcher.consume_batched_articles(process)
+      finally:
+        await async_redis_handler.close()
+        await async_repository.close()
+
+    log.info(f"starting in async mode")
+    asyncio.run(consume_async())
+
+  else:
+    redis_handler = redis_future.result()
+
+    redis_consumer = RedisScrapedArticleConsumer(
+      redis_handler,
+      stream_name=REDIS_STREAM_NAMES,
+      consumer_group=REDIS_CONSUMER_GROUP,
+      delete_acked=REDIS_DELETE_ACKED,
+      max_read_count=MAX_BATCH_SIZE,
+      max_read_block_millis=REDIS_MAX_READ_BLOCK_MILLIS,
+      in_flight_budget=in_flight_budget,
+    )
+
+    article_batcher = ArticleBatcher(
+      redis_consumer,
+      max_batch_size=MAX_BATCH_SIZE,
+      max_batch_timeout_millis=MAX_BATCH_TIMEOUT_MILLIS,
+      min_batch_size=MIN_BATCH_SIZE,
+      adaptive_batch_size=ADAPTIVE_BATCH_SIZE,
+    )
+
+    def first_batch_done(fn):
+      def wrapper(*args):
+        result = fn(*args)
+        readiness.first_batch_done()
+        return result
+      return wrapper
+
+    if PIPELINE_MODE:
+      log.info(f"starting in pipeline mode")
+      ArticlePipeline(
+        article_batcher, 
+        max_queued_batches=PIPELINE_MAX_QUEUED_BATCHES,
+      ).consume_pipelined_articles(analyzer.analyze, first_batch_done(analyzer.store))
+    else:
+      article_batcher.consume_batched_articles(first_batch_done(analyzer.process))
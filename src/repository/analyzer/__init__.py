@@ -1,2 +1,4 @@
 from repository.analyzer.analyzer_repository import AnalyzerRepository
-from repository.analyzer.elasticsearch_repository import ElasticsearchRepository
\ No newline at end of file
+from repository.analyzer.elasticsearch_repository import ElasticsearchRepository
+from repository.analyzer.async_analyzer_repository import AsyncAnalyzerRepository
+from repository.analyzer.async_elasticsearch_repository import AsyncElasticsearchRepository
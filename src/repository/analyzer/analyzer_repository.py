@@ -10,7 +10,24 @@ class AnalyzerRepository(ABC):
     raise NotImplementedError 
   
   @abstractmethod
-  def store_categories(self, categories: list[Category]) -> bool:
-    """Store a list of categories in the repository."""
+  def update_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
+    """
+    Update only the analysis of articles which are already stored, e.g. when re-analyzing them,
+    return the ids of the updated articles, the ones which aren't stored are skipped.
+    """
     raise NotImplementedError
 
+  @abstractmethod
+  def store_categories(self, categories: list[Category]) -> list[str]:
+    """Store the categories which don't exist yet in the repository, return the ids of the created ones."""
+    raise NotImplementedError
+
+  @abstractmethod
+  def get_category_ids(self, max_count: int) -> list[str]:
+    """Return the ids of the stored categories, at most 'max_count' of them."""
+    raise NotImplementedError
+
+  @abstractmethod
+  def get_analyzed_versions(self, article_ids: list[str]) -> dict[str, str | None]:
+    """Return the model versions of the articles which are already stored, keyed by article id."""
+    raise NotImplementedError
@@ -0,0 +1,26 @@
+from abc import ABC, abstractmethod
+from domain import Article, Category
+
+
+class AsyncAnalyzerRepository(ABC):
+  """The asyncio variant of 'AnalyzerRepository'."""
+
+  @abstractmethod
+  async def store_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
+    """Store a list of analyzed article objects in the repository, return the ids of the stored articles."""
+    raise NotImplementedError
+
+  @abstractmethod
+  async def store_categories(self, categories: list[Category]) -> list[str]:
+    """Store the categories which don't exist yet in the repository, return the ids of the created ones."""
+    raise NotImplementedError
+
+  @abstractmethod
+  async def get_category_ids(self, max_count: int) -> list[str]:
+    """Return the ids of the stored categories, at most 'max_count' of them."""
+    raise NotImplementedError
+
+  @abstractmethod
+  async def get_analyzed_versions(self, article_ids: list[str]) -> dict[str, str | None]:
+    """Return the model versions of the articles which are already stored, keyed by article id."""
+    raise NotImplementedError
@@ -0,0 +1,195 @@
+from utils import log_utils
+from domain import Article, Category
+from typing import Iterable
+import logging
+from elasticsearch import AsyncElasticsearch, exceptions, helpers
+from repository.analyzer.async_analyzer_repository import AsyncAnalyzerRepository
+from repository.analyzer.elasticsearch_repository import ElasticsearchRepository
+from repository.analyzer.bulk_writer import (
+  streaming_bulk_options,
+  bulk_item_id,
+  bulk_item_status,
+  bulk_write_seconds,
+  bulk_write_failures_total,
+)
+from repository.analyzer.embeddings_storage import EmbeddingsStorage
+
+
+class AsyncElasticsearchRepository(AsyncAnalyzerRepository):
+  """
+  The asyncio variant of 'ElasticsearchRepository', with the same indices and documents.
+  Several bulk writes can be in flight at once on its connection pool. Call 'assert_indices' before using it.
+  """
+
+  articles_index = ElasticsearchRepository.articles_index
+  categories_index = ElasticsearchRepository.categories_index
+  indices = {
+    ElasticsearchRepository.articles_index: ElasticsearchRepository.articles_mappings,
+    ElasticsearchRepository.topics_index: ElasticsearchRepository.topics_mappings,
+    ElasticsearchRepository.topic_batches_index: ElasticsearchRepository.topic_batches_mappings,
+    ElasticsearchRepository.categories_index: ElasticsearchRepository.categories_mappings,
+  }
+
+  @classmethod
+  def configure_logging(cls, level: int):
+    cls.log = log_utils.create_console_logger(
+      name=cls.__name__,
+      level=level
+    )
+
+  def __init__(
+      self, 
+      conn: str, 
+      user: str, 
+      password: str, 
+      cacerts: str, 
+      verify_certs: bool = True,
+      log_level: int = logging.INFO,
+      bulk_options: dict | None = None,
+      embeddings_options: dict | None = None,
+      write_mode: str = "index",
+  ):
+    self.configure_logging(log_level)
+
+    # 'index' writes the whole documents, 'update' only the analysis of the articles which are already stored
+    self.write_mode = ElasticsearchRepository.check_write_mode(write_mode)
+
+    # quantized index and storage of the embeddings, trimmed precision, see 'EmbeddingsStorage'
+    self.embeddings_storage = EmbeddingsStorage(**(embeddings_options or {}))
+    self.indices = {
+      **self.indices,
+      self.articles_index: ElasticsearchRepository.articles_mappings_with(self.embeddings_storage),
+    }
+
+    self.log.info(f"connecting to Elasticsearch at {conn}")
+    self.es = AsyncElasticsearch(conn, basic_auth=(user, password), ca_certs=cacerts, verify_certs=verify_certs)
+
+    # the chunk sizes and the retries of 'BulkWriter', the writes of the batches in flight are concurrent already
+    self.bulk_options = streaming_bulk_options(**(bulk_options or {}))
+    # the transport would retry a rejected request right away, 'async_streaming_bulk' backs off instead
+    self.__bulk_client = self.es.options(retry_on_status=(502, 503, 504))
+
+  async def close(self) -> None:
+    await self.es.close()
+
+  async def assert_indices(self):
+    for index_name, index_mappings in self.indices.items():
+      await self.assert_index(index_name, index_mappings)
+
+  async def assert_index(self, index_name: str, index_mappings: dict):
+    try:
+      self.log.info(f"creating/asserting index '{index_name}'")
+      await self.es.indices.create(index=index_name, mappings=index_mappings)
+    except exceptions.BadRequestError as e:
+      if e.message == "resource_already_exists_exception":
+        self.log.info(f"index '{index_name}' already exists")
+
+  async def store_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
+    """
+    Store the analyzed articles in 'streaming bulk' mode, the documents are mapped as they are written.
+    In 'update' write mode, only the analysis of the stored articles is sent, see 'article_update_action'.
+    """
+
+    if self.write_mode == "update":
+      stored = await self.get_analyzer_fields([article.id for article in analyzed_articles])
+      actions = (
+        ElasticsearchRepository.article_update_action(
+          article, 
+          not ElasticsearchRepository.article_changed(article, stored.get(article.id)), 
+          self.embeddings_storage,
+        )
+        for article in analyzed_articles
+      )
+    else:
+      actions = (
+        {
+          "_id": article.id,
+          "_index": self.articles_index,
+          **ElasticsearchRepository.map_to_repo_doc(article, self.embeddings_storage),
+        }
+        for article in analyzed_articles
+      )
+    self.log.info(f"attempting to insert {len(analyzed_articles)} articles in {self.articles_index}")
+    return await self.__streaming_bulk(actions, "article")
+
+  async def store_categories(self, categories: list[Category]) -> list[str]:
+    """Create the categories which don't exist yet in 'streaming bulk' mode, return the ids of the created ones."""
+
+    actions = (
+      {
+        "_op_type": "create",
+        "_id": category.id,
+        "_index": self.categories_index,
+        "name": category.name,
+      }
+      for category in categories
+    )
+    self.log.info(f"attempting to insert {len(categories)} categories in {self.categories_index}")
+    return await self.__streaming_bulk(actions, "category")
+
+  async def __streaming_bulk(self, actions: Iterable[dict], kind: str) -> list[str]:
+    with bulk_write_seconds.time(kind=kind):
+      try:
+        return await self.__write_and_check(actions, kind)
+      except Exception:
+        bulk_write_failures_total.inc(kind=kind)
+        raise
+
+  async def __write_and_check(self, actions: Iterable[dict], kind: str) -> list[str]:
+    ids = []
+    errors = []
+    async for ok, item in helpers.async_streaming_bulk(
+      self.__bulk_client, 
+      actions, 
+      raise_on_error=False, 
+      raise_on_exception=False, 
+      **self.bulk_options,
+    ):
+      if not ok and bulk_item_status(item) == 409:
+        # created with 'op_type=create' by someone else meanwhile
+        self.log.debug(f"{kind} already exists: {item}")
+        continue
+      if not ok and bulk_item_status(item) == 404:
+        # updated, but deleted since it was looked up
+        self.log.warning(f"{kind} to update doesn't exist: {bulk_item_id(item)}")
+        continue
+      if not ok:
+        self.log.error(f"failed to bulk store {kind}: {item}")
+        errors.append(item)
+        continue
+      ids.append(bulk_item_id(item))
+      self.log.debug(f"successfully stored {kind}: {item}")
+
+    if len(errors) > 0:
+      # after the retries, the batch fails and its messages are not ack-ed
+      raise helpers.BulkIndexError(f"{len(errors)} {kind} document(s) failed to index", errors)
+    return ids
+
+  async def get_category_ids(self, max_count: int) -> list[str]:
+    """Return the ids of the stored categories, at most 'max_count', and at most the index's 'max_result_window'."""
+
+    res = await self.es.search(
+      index=self.categories_index, 
+      query={"match_all": {}}, 
+      size=min(max_count, 10000), 
+      source=False,
+    )
+    return [hit["_id"] for hit in res["hits"]["hits"]]
+
+  async def get_analyzer_fields(self, article_ids: list[str]) -> dict[str, dict]:
+    """See 'ElasticsearchRepository.get_analyzer_fields'."""
+
+    if len(article_ids) == 0:
+      return {}
+
+    res = await self.es.mget(
+      index=self.articles_index, 
+      ids=article_ids, 
+      source_includes=ElasticsearchRepository.analyzer_fields,
+    )
+    return ElasticsearchRepository.map_analyzer_fields(res)
+
+  async def get_analyzed_versions(self, article_ids: list[str]) -> dict[str, str | None]:
+    """Look up the stored articles with a single multi-get, only fetching their model versions."""
+    fields = await self.get_analyzer_fields(article_ids)
+    return {id: stored.get("model_version") for id, stored in fields.items()}
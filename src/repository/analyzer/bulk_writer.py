@@ -0,0 +1,172 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from typing import Any, Iterable, Iterator
+from elasticsearch import Elasticsearch, helpers
+from utils import log_utils
+from utils import metrics
+
+bulk_requests_total = metrics.counter(
+  "analyzer_es_bulk_requests_total",
+  "bulk requests sent to Elasticsearch, without the retries",
+)
+bulk_bytes_total = metrics.counter(
+  "analyzer_es_bulk_bytes_total",
+  "bytes of the bulk requests sent to Elasticsearch, without the retries",
+)
+bulk_items_total = metrics.counter(
+  "analyzer_es_bulk_items_total",
+  "bulk items by their result, 'ok', 'conflict', 'missing' or 'error'",
+  ("result",),
+)
+bulk_chunk_seconds = metrics.histogram(
+  "analyzer_es_bulk_chunk_seconds",
+  "time to write a chunk of the bulk writer, with the retries of its rejected items",
+)
+bulk_write_seconds = metrics.histogram(
+  "analyzer_es_bulk_write_seconds",
+  "time to write the documents of a batch, by the kind of the documents",
+  ("kind",),
+)
+bulk_write_failures_total = metrics.counter(
+  "analyzer_es_bulk_write_failures_total",
+  "batch writes which failed after the retries, by the kind of the documents",
+  ("kind",),
+)
+
+
+class BulkWriter:
+  """
+  Writes bulk actions to Elasticsearch. The actions are read lazily and serialized once, into chunks
+  of at most 'max_chunk_bytes' and 'max_chunk_docs', and up to 'max_in_flight' chunks are sent at once.
+  Items rejected with 429, or whole requests, are retried with an exponential backoff
+  from 'initial_backoff' to 'max_backoff' seconds, at most 'max_retries' times.
+  """
+
+  def __init__(
+    self,
+    es: Elasticsearch,
+    max_chunk_bytes: int = 5 * 1024 * 1024,
+    max_chunk_docs: int = 500,
+    max_in_flight: int = 2,
+    max_retries: int = 5,
+    initial_backoff: float = 0.5,
+    max_backoff: float = 30,
+  ):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.es = es
+    self.max_chunk_bytes = max_chunk_bytes
+    self.max_chunk_docs = max_chunk_docs
+    self.max_in_flight = max(1, max_in_flight)
+    self.max_retries = max_retries
+    self.initial_backoff = initial_backoff
+    self.max_backoff = max_backoff
+
+    self.__serializer = es.transport.serializers.get_serializer("application/json")
+    # the transport would retry a rejected request right away, the writer backs off instead
+    self.__bulk_client = es.options(retry_on_status=(502, 503, 504))
+    # the requests share the connection pool of the client
+    self.__executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="bulk")
+
+  def write(self, actions: Iterable[dict]) -> Iterator[tuple[bool, dict]]:
+    """
+    Write the actions, in the format of 'helpers.bulk', yield an '(ok, item)' tuple per action in their order.
+    While a chunk is written, the next ones are serialized and sent.
+    """
+    in_flight: deque[Future] = deque()
+    for chunk, chunk_bytes in self.__chunks(actions):
+      if len(in_flight) == self.max_in_flight:
+        yield from in_flight.popleft().result()
+      in_flight.append(self.__executor.submit(self.__send, chunk, chunk_bytes))
+
+    while len(in_flight) > 0:
+      yield from in_flight.popleft().result()
+
+  def __chunks(self, actions: Iterable[dict]) -> Iterator[tuple[list[tuple[dict, bytes | None]], int]]:
+    chunk = []
+    chunk_bytes = 0
+    for action in actions:
+      header, body = helpers.expand_action(action)
+      if body is not None:
+        # serialized here once, the client sends the bytes as they are
+        body = self.__serializer.dumps(body)
+
+      # the header, the body and their new lines
+      size = len(self.__serializer.dumps(header)) + 1 + (len(body) + 1 if body is not None else 0)
+      if len(chunk) > 0 and (chunk_bytes + size > self.max_chunk_bytes or len(chunk) == self.max_chunk_docs):
+        yield chunk, chunk_bytes
+        chunk, chunk_bytes = [], 0
+
+      chunk.append((header, body))
+      chunk_bytes += size
+
+    if len(chunk) > 0:
+      yield chunk, chunk_bytes
+
+  def __send(self, chunk: list[tuple[dict, bytes | None]], chunk_bytes: int) -> list[tuple[bool, dict]]:
+    bulk_requests_total.inc()
+    bulk_bytes_total.inc(chunk_bytes)
+
+    # one request for the chunk, 'streaming_bulk' retries the rejected items of it
+    with bulk_chunk_seconds.time():
+      results = list(helpers.streaming_bulk(
+        self.__bulk_client,
+        chunk,
+        chunk_size=len(chunk),
+        max_chunk_bytes=chunk_bytes,
+        expand_action_callback=lambda action: action,
+        raise_on_error=False,
+        raise_on_exception=False,
+        max_retries=self.max_retries,
+        initial_backoff=self.initial_backoff,
+        max_backoff=self.max_backoff,
+      ))
+
+    # a conflict is up to the caller, e.g. a document created with 'op_type=create' which exists already
+    conflicts = sum(1 for ok, item in results if not ok and bulk_item_status(item) == 409)
+    # and an update of a document which doesn't exist
+    missing = sum(1 for ok, item in results if not ok and bulk_item_status(item) == 404)
+    failed = sum(1 for ok, _ in results if not ok) - conflicts - missing
+    bulk_items_total.inc(len(results) - failed - conflicts - missing, result="ok")
+    bulk_items_total.inc(conflicts, result="conflict")
+    bulk_items_total.inc(missing, result="missing")
+    if failed > 0:
+      bulk_items_total.inc(failed, result="error")
+      self.log.warning(f"{failed} of {len(chunk)} bulk items failed")
+    return results
+
+
+def streaming_bulk_options(
+  max_chunk_bytes: int = 5 * 1024 * 1024,
+  max_chunk_docs: int = 500,
+  max_in_flight: int = 2,
+  max_retries: int = 5,
+  initial_backoff: float = 0.5,
+  max_backoff: float = 30,
+) -> dict:
+  """
+  The options of a 'BulkWriter' as arguments of 'helpers.async_streaming_bulk', which writes one chunk at a time,
+  'max_in_flight' is left to the caller.
+  """
+  return {
+    "chunk_size": max_chunk_docs,
+    "max_chunk_bytes": max_chunk_bytes,
+    "max_retries": max_retries,
+    "initial_backoff": initial_backoff,
+    "max_backoff": max_backoff,
+  }
+
+
+def bulk_item_id(item: dict[str, Any]) -> str | None:
+  """The document id of an '(ok, item)' result of a bulk write, whatever its operation was."""
+  for result in item.values():
+    return result.get("_id")
+  return None
+
+
+def bulk_item_status(item: dict[str, Any]) -> int | None:
+  """The HTTP status of an '(ok, item)' result of a bulk write."""
+  for result in item.values():
+    return result.get("status")
+  return None
@@ -3,6 +3,17 @@ from domain import Article, Category
 import logging
 from elasticsearch import Elasticsearch, exceptions, helpers
 from repository.analyzer.analyzer_repository import AnalyzerRepository
+from repository.analyzer.bulk_writer import (
+  BulkWriter,
+  bulk_item_id,
+  bulk_item_status,
+  bulk_write_seconds,
+  bulk_write_failures_total,
+)
+from repository.analyzer.embeddings_storage import EmbeddingsStorage
+import hashlib
+import orjson
+import copy
 
 
 class ElasticsearchRepository(AnalyzerRepository):
@@ -33,6 +44,14 @@ class ElasticsearchRepository(AnalyzerRepository):
             "type": "dense_vector",
             "dims": 384, # depends on the embeddings model
           },
+          "model_version": {
+            "type": "keyword",
+          },
+          "content_hash": {
+            # only fetched by id, to tell if a re-scraped article was edited
+            "index": "false",
+            "type": "keyword",
+          },
         }
       },
       "article": {
@@ -91,6 +110,9 @@ class ElasticsearchRepository(AnalyzerRepository):
     }
   }
 
+  # the small fields of the stored articles which are looked up before writing
+  analyzer_fields = ["analyzer.model_version", "analyzer.content_hash"]
+
   categories_index = "categories"
   categories_mappings = {
     "properties": {
@@ -196,6 +218,14 @@ class ElasticsearchRepository(AnalyzerRepository):
     }
   }
 
+  write_modes = ("index", "update")
+
+  @classmethod
+  def check_write_mode(cls, write_mode: str) -> str:
+    if write_mode not in cls.write_modes:
+      raise ValueError(f"unknown write mode '{write_mode}', use one of {cls.write_modes}")
+    return write_mode
+
   @classmethod
   def configure_logging(cls, level: int):
     cls.log = log_utils.create_console_logger(
@@ -210,15 +240,28 @@ class ElasticsearchRepository(AnalyzerRepository):
       password: str, 
       cacerts: str, 
       verify_certs: bool = True,
-      log_level: int = logging.INFO
+      log_level: int = logging.INFO,
+      bulk_options: dict | None = None,
+      embeddings_options: dict | None = None,
+      write_mode: str = "index",
   ):
     self.configure_logging(log_level)
 
+    # 'index' writes the whole documents, 'update' only the analysis of the articles which are already stored
+    self.write_mode = self.check_write_mode(write_mode)
+
+    # quantized index and storage of the embeddings, trimmed precision, see 'EmbeddingsStorage'
+    self.embeddings_storage = EmbeddingsStorage(**(embeddings_options or {}))
+    self.articles_mappings = self.articles_mappings_with(self.embeddings_storage)
+
     # TODO: add some form of auth
     self.log.info(f"connecting to Elasticsearch at {conn}")
     self.es = Elasticsearch(conn, basic_auth=(user, password), ca_certs=cacerts, verify_certs=verify_certs)
     self.assert_indices()
 
+    # chunk sizes, parallel requests and retries of the bulk writes, see 'BulkWriter'
+    self.bulk_writer = BulkWriter(self.es, **(bulk_options or {}))
+
   def assert_indices(self):
     self.assert_index(self.articles_index, self.articles_mappings)
     self.assert_index(self.topics_index, self.topics_mappings)
@@ -235,36 +278,84 @@ class ElasticsearchRepository(AnalyzerRepository):
 
   
   def store_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
-    """Store the analyzed articles in 'streaming bulk' mode."""
+    """
+    Store the analyzed articles with the bulk writer, the documents are mapped as they are written.
+    In 'update' write mode, only the analysis of the stored articles is sent, see 'article_update_action'.
+    """
 
-    docs = [self.__map_to_repo_doc(art) for art in analyzed_articles] 
-    ids = []
-    self.log.info(f"attempting to insert {len(docs)} articles in {self.articles_index}")
-    for ok, action in helpers.streaming_bulk(self.es, self.__generate_article_actions(docs)):
-      if not ok:
-        self.log.error(f"failed to bulk store article: {action}")
-        continue
-      ids.append(action["index"]["_id"])
-      self.log.debug(f"successfully stored article: {action}")
-    return ids
+    self.log.info(f"attempting to insert {len(analyzed_articles)} articles in {self.articles_index}")
+    if self.write_mode == "update":
+      # a re-scraped article can be edited, only the unchanged ones get the analysis alone
+      stored = self.get_analyzer_fields([article.id for article in analyzed_articles])
+      actions = (
+        self.article_update_action(
+          article, 
+          not self.article_changed(article, stored.get(article.id)), 
+          self.embeddings_storage,
+        )
+        for article in analyzed_articles
+      )
+      return self.__bulk_write(actions, "article")
+
+    return self.__bulk_write(self.__generate_article_actions(analyzed_articles), "article")
+
+  def update_analyzed_articles(self, analyzed_articles: list[Article]) -> list[str]:
+    """
+    Update the analysis of stored articles with partial updates, the rest of the documents isn't sent,
+    and the fields written by other services, like the topics, are kept.
+    """
+
+    self.log.info(f"attempting to update {len(analyzed_articles)} articles in {self.articles_index}")
+    return self.__bulk_write(self.__generate_analysis_update_actions(analyzed_articles), "article")
   
-  def __map_to_repo_doc(self, article: Article) -> dict:
+  def get_analyzed_versions(self, article_ids: list[str]) -> dict[str, str | None]:
+    """Look up the stored articles with a single multi-get, only fetching their model versions."""
+    return {id: fields.get("model_version") for id, fields in self.get_analyzer_fields(article_ids).items()}
+
+  def get_analyzer_fields(self, article_ids: list[str]) -> dict[str, dict]:
+    """
+    Look up the stored articles with a single multi-get, only fetching their model versions and content hashes,
+    keyed by article id, see 'article_changed'.
+    """
+
+    if len(article_ids) == 0:
+      return {}
+
+    res = self.es.mget(
+      index=self.articles_index, 
+      ids=article_ids, 
+      source_includes=self.analyzer_fields,
+    )
+    return self.map_analyzer_fields(res)
+
+  @staticmethod
+  def map_analyzer_fields(res: dict) -> dict[str, dict]:
+    return {
+      doc["_id"]: doc.get("_source", {}).get("analyzer", {})
+      for doc in res["docs"]
+      if doc.get("found", False)
+    }
+
+  @classmethod
+  def articles_mappings_with(cls, embeddings_storage: EmbeddingsStorage) -> dict:
+    """The mappings of the articles index, with the embeddings mapped as 'embeddings_storage' stores them."""
+    mappings = copy.deepcopy(cls.articles_mappings)
+    mappings["properties"]["analyzer"]["properties"]["embeddings"] = embeddings_storage.mapping()
+    return mappings
+
+  @staticmethod
+  def map_to_repo_doc(article: Article, embeddings_storage: EmbeddingsStorage | None = None) -> dict:
     # create repository model from analyzed article
     return {
       "analyze_time": article.analyze_time.isoformat(),
       "analyzer": {
         "category_ids": [cat.id for cat in article.analyzed_categories],
-        "embeddings": article.embeddings,
+        "embeddings": embeddings_storage.encode(article.embeddings) if embeddings_storage else article.embeddings,
+        "model_version": article.analyzer_version,
+        "content_hash": ElasticsearchRepository.content_hash(article),
       },
       "article": {
-        "id" : article.id,
-        "url": article.url,
-        "source": article.source,
-        "publish_date": article.publish_date.isoformat(),
-        "image": article.image,
-        "author": article.author,
-        "title": article.title,
-        "paragraphs": article.paragraphs,
+        **ElasticsearchRepository.map_to_scraped_fields(article),
         "categories": {
           "ids": [cat.id for cat in article.categories],
           "names": [cat.name for cat in article.categories],
@@ -272,33 +363,145 @@ class ElasticsearchRepository(AnalyzerRepository):
       }, 
       # topics are NOT added here, they will be added by the topic modeler
     }
+
+  @staticmethod
+  def map_to_scraped_fields(article: Article) -> dict:
+    # the fields of 'article' as they were scraped, the categories are merged with the analyzed ones
+    return {
+      "id" : article.id,
+      "url": article.url,
+      "source": article.source,
+      "publish_date": article.publish_date.isoformat(),
+      "image": article.image,
+      "author": article.author,
+      "title": article.title,
+      "paragraphs": article.paragraphs,
+    }
+
+  @staticmethod
+  def content_hash(article: Article) -> str:
+    # fingerprint of the scraped fields, stored with the analysis, so an edit is noticed without fetching the text
+    return hashlib.sha1(orjson.dumps(ElasticsearchRepository.map_to_scraped_fields(article))).hexdigest()
+
+  @classmethod
+  def article_changed(cls, article: Article, stored_fields: dict | None) -> bool:
+    """
+    If the scraped fields of the article differ from the stored ones, e.g. a re-scraped article was edited,
+    compared by the content hash of 'get_analyzer_fields'. A missing article, or one without a hash, has changed.
+    """
+    if stored_fields is None:
+      return True
+    return stored_fields.get("content_hash") != cls.content_hash(article)
   
-  def __generate_article_actions(self, articles: list[dict]):
-    for i in range(len(articles)):
+  @staticmethod
+  def map_to_analysis_doc(article: Article, embeddings_storage: EmbeddingsStorage | None = None) -> dict:
+    # the fields of 'map_to_repo_doc' which change when an article is analyzed again
+    doc = ElasticsearchRepository.map_to_repo_doc(article, embeddings_storage)
+    # the content hash is of the stored text, which isn't sent
+    analyzer = {key: value for key, value in doc["analyzer"].items() if key != "content_hash"}
+    return {
+      "analyze_time": doc["analyze_time"],
+      "analyzer": analyzer,
+      "article": {
+        "categories": doc["article"]["categories"],
+      },
+    }
+
+  @classmethod
+  def article_update_action(
+    cls,
+    article: Article,
+    analysis_only: bool,
+    embeddings_storage: EmbeddingsStorage | None = None,
+  ) -> dict:
+    """
+    A partial update of the article, merged into the stored document, so the fields written by other services,
+    like the topics, are kept. With 'analysis_only', only the analysis is sent, for a stored and unchanged article,
+    otherwise the whole document, created if it doesn't exist.
+    """
+    if analysis_only:
+      return {
+        "_op_type": "update",
+        "_id": article.id,
+        "_index": cls.articles_index,
+        "doc": cls.map_to_analysis_doc(article, embeddings_storage),
+      }
+    return {
+      "_op_type": "update",
+      "_id": article.id,
+      "_index": cls.articles_index,
+      "doc": cls.map_to_repo_doc(article, embeddings_storage),
+      "doc_as_upsert": True,
+    }
+
+  def __generate_analysis_update_actions(self, articles: list[Article]):
+    for article in articles:
+      yield self.article_update_action(article, True, self.embeddings_storage)
+
+  def __generate_article_actions(self, articles: list[Article]):
+    for article in articles:
       action = {
-        "_id": articles[i]["article"]["id"],
+        "_id": article.id,
         "_index": self.articles_index,
-        **articles[i]
+        **self.map_to_repo_doc(article, self.embeddings_storage)
       }
       yield action
-  
 
-  def store_categories(self, categories: list[Category]) -> list[str]:
-    """Store the categories in 'streaming bulk' mode."""
+  def __bulk_write(self, actions, kind: str) -> list[str]:
+    with bulk_write_seconds.time(kind=kind):
+      try:
+        return self.__write_and_check(actions, kind)
+      except Exception:
+        bulk_write_failures_total.inc(kind=kind)
+        raise
 
+  def __write_and_check(self, actions, kind: str) -> list[str]:
     ids = []
-    self.log.info(f"attempting to insert {len(categories)} categories in {self.categories_index}")
-    for ok, action in helpers.streaming_bulk(self.es, self.__generate_category_actions(categories)):
+    errors = []
+    for ok, item in self.bulk_writer.write(actions):
+      if not ok and bulk_item_status(item) == 409:
+        # created with 'op_type=create' by someone else meanwhile
+        self.log.debug(f"{kind} already exists: {item}")
+        continue
+      if not ok and bulk_item_status(item) == 404:
+        # updated, but it isn't stored
+        self.log.warning(f"{kind} to update doesn't exist: {bulk_item_id(item)}")
+        continue
       if not ok:
-        self.log.error(f"failed to bulk store category: {action}")
+        self.log.error(f"failed to bulk store {kind}: {item}")
+        errors.append(item)
         continue
-      ids.append(action["index"]["_id"])
-      self.log.debug(f"successfully stored category: {action}")
+      ids.append(bulk_item_id(item))
+      self.log.debug(f"successfully stored {kind}: {item}")
+
+    if len(errors) > 0:
+      # after the retries, the batch fails and its messages are not ack-ed
+      raise helpers.BulkIndexError(f"{len(errors)} {kind} document(s) failed to index", errors)
     return ids
   
+
+  def store_categories(self, categories: list[Category]) -> list[str]:
+    """Create the categories which don't exist yet with the bulk writer, return the ids of the created ones."""
+
+    self.log.info(f"attempting to insert {len(categories)} categories in {self.categories_index}")
+    return self.__bulk_write(self.__generate_category_actions(categories), "category")
+
+  def get_category_ids(self, max_count: int) -> list[str]:
+    """Return the ids of the stored categories, at most 'max_count', and at most the index's 'max_result_window'."""
+
+    res = self.es.search(
+      index=self.categories_index, 
+      query={"match_all": {}}, 
+      size=min(max_count, 10000), 
+      source=False,
+    )
+    return [hit["_id"] for hit in res["hits"]["hits"]]
+  
   def __generate_category_actions(self, categories: list[Category]):
     for i in range(len(categories)):
       action = {
+        # only created if it doesn't exist, the ids are derived from the names, so concurrent analyzers agree
+        "_op_type": "create",
         "_id": categories[i].id,
         "_index": self.categories_index,
         "name": categories[i].name,
@@ -0,0 +1,58 @@
+import numpy as np
+
+# the scale of the 'byte' vectors, the normalized embeddings are in [-1, 1]
+BYTE_SCALE = 127
+
+
+class EmbeddingsStorage:
+  """
+  How the embeddings are mapped and serialized in the articles index.
+  'index_type' is the 'index_options' type of the 'dense_vector', 'int8_hnsw' keeps the kNN graph quantized
+  to a quarter of the memory. 'element_type' 'byte' stores the vectors themselves as bytes, scaled by 127,
+  the query vectors have to be scaled the same way. 'precision' rounds the floats of the bulk requests
+  to that many decimals, None keeps them as they are.
+  """
+
+  def __init__(
+    self,
+    dims: int = 384,
+    index_type: str | None = None,
+    element_type: str = "float",
+    precision: int | None = None,
+  ):
+    if element_type not in ("float", "byte"):
+      raise ValueError(f"unknown embeddings element type '{element_type}', use 'float' or 'byte'")
+    if element_type == "byte" and index_type == "int8_hnsw":
+      raise ValueError("'int8_hnsw' only quantizes float vectors, byte vectors are indexed with 'hnsw'")
+
+    self.dims = dims
+    self.index_type = index_type
+    self.element_type = element_type
+    self.precision = precision
+
+  def mapping(self) -> dict:
+    """The 'dense_vector' mapping of the embeddings."""
+    mapping = {
+      "type": "dense_vector",
+      "dims": self.dims, # depends on the embeddings model
+    }
+    if self.element_type != "float":
+      mapping["element_type"] = self.element_type
+    if self.index_type is not None:
+      mapping["index"] = True
+      mapping["index_options"] = {"type": self.index_type}
+    return mapping
+
+  def encode(self, embeddings: list[float]) -> list[float] | list[int]:
+    """The embeddings as they are sent to Elasticsearch."""
+    if self.element_type == "byte":
+      return quantize_to_bytes(embeddings).tolist()
+    if self.precision is not None:
+      # rounded as float64, so the shortest representation of the values is short too
+      return np.round(np.asarray(embeddings, dtype=np.float64), self.precision).tolist()
+    return embeddings
+
+
+def quantize_to_bytes(embeddings: list[float] | np.ndarray) -> np.ndarray:
+  """Scale normalized embeddings, or query vectors, to the integers of a 'byte' vector."""
+  return np.clip(np.rint(np.asarray(embeddings, dtype=np.float32) * BYTE_SCALE), -128, 127).astype(np.int8)
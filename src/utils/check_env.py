@@ -5,3 +5,9 @@ def check_env(name: str, default=None) -> str:
   if value is None:
     raise ValueError(f'{name} environment variable is not set')
   return value
+
+def check_env_bool(name: str, default: bool = False) -> bool:
+  value = os.environ.get(name)
+  if value is None:
+    return default
+  return value.strip().lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,15 @@
+from concurrent.futures import Future
+
+
+class Deferred:
+  """
+  Stands in for the result of a future, e.g. a model which is still loading.
+  Accessing an attribute blocks until the result is available, and raises the error of the future if it failed.
+  """
+
+  def __init__(self, future: Future):
+    self._future = future
+
+  def __getattr__(self, name: str):
+    # only called for the attributes not found on the Deferred itself
+    return getattr(self._future.result(), name)
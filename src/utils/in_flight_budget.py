@@ -0,0 +1,81 @@
+from threading import Condition
+from utils import metrics
+import time
+
+in_flight_messages = metrics.gauge(
+  "analyzer_in_flight_messages",
+  "messages read from the streams and not ack-ed or dropped yet",
+)
+in_flight_bytes = metrics.gauge(
+  "analyzer_in_flight_bytes",
+  "size of the messages read from the streams and not ack-ed or dropped yet",
+)
+reader_pauses_total = metrics.counter(
+  "analyzer_reader_pauses_total",
+  "times the reader waited for the in-flight messages to drain before reading",
+)
+reader_paused_seconds_total = metrics.counter(
+  "analyzer_reader_paused_seconds_total",
+  "time the reader spent waiting for the in-flight messages to drain",
+)
+
+
+class InFlightBudget:
+  """
+  Limits the messages held between reading and ack-ing them, by their count and by their size in bytes.
+  The reader waits for room before each read, the messages are given back when they are ack-ed,
+  or when their batch is dropped. The last messages of a read can go over 'max_bytes',
+  the next read waits until they are given back.
+  """
+
+  def __init__(self, max_messages: int, max_bytes: int):
+    self.max_messages = max(1, max_messages)
+    self.max_bytes = max(1, max_bytes)
+
+    self.__messages = 0
+    self.__bytes = 0
+    self.__changed = Condition()
+
+  def take(self, size: int) -> None:
+    """Count a message of 'size' bytes as in flight."""
+    with self.__changed:
+      self.__messages += 1
+      self.__bytes += size
+      self.__update_gauges()
+
+  def give_back(self, size: int) -> None:
+    """A message of 'size' bytes is not in flight anymore."""
+    with self.__changed:
+      self.__messages -= 1
+      self.__bytes -= size
+      self.__update_gauges()
+      self.__changed.notify_all()
+
+  def room(self) -> int:
+    """How many more messages can be read."""
+    with self.__changed:
+      if self.__bytes >= self.max_bytes:
+        return 0
+      return max(0, self.max_messages - self.__messages)
+
+  def saturated(self) -> bool:
+    return self.room() == 0
+
+  def wait_for_room(self, timeout: float | None = None) -> bool:
+    """Wait until messages can be read again, at most 'timeout' seconds. Returns False if it timed out."""
+    with self.__changed:
+      if not self.__saturated():
+        return True
+
+      reader_pauses_total.inc()
+      start = time.monotonic()
+      has_room = self.__changed.wait_for(lambda: not self.__saturated(), timeout=timeout)
+      reader_paused_seconds_total.inc(time.monotonic() - start)
+      return has_room
+
+  def __saturated(self) -> bool:
+    return self.__messages >= self.max_messages or self.__bytes >= self.max_bytes
+
+  def __update_gauges(self) -> None:
+    in_flight_messages.set(self.__messages)
+    in_flight_bytes.set(self.__bytes)
@@ -0,0 +1,241 @@
+from threading import Lock
+from bisect import bisect_left
+import math
+import time
+
+# Process-wide registry of metrics, the metrics are created once at import time by the modules using them.
+
+
+class Metric:
+
+  type = "untyped"
+
+  def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+    self.name = name
+    self.description = description
+    self.label_names = label_names
+    self._values: dict[tuple, float] = {}
+    self._lock = Lock()
+
+  def _key(self, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+  def value(self, **labels) -> float:
+    return self._values.get(self._key(labels), 0)
+
+  def samples(self) -> list[tuple[dict, float]]:
+    with self._lock:
+      items = list(self._values.items())
+    return [(dict(zip(self.label_names, key)), value) for key, value in items]
+
+  def series(self) -> list[tuple[str, dict, float]]:
+    """The samples as Prometheus series, (name, labels, value)."""
+    return [(self.name, labels, value) for labels, value in self.samples()]
+
+
+class Counter(Metric):
+
+  type = "counter"
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+  type = "gauge"
+
+  def set(self, value: float, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = value
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount: float = 1, **labels) -> None:
+    self.inc(-amount, **labels)
+
+
+# seconds, from a redis round trip to a slow inference batch
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram(Metric):
+  """
+  Counts of the observed values in cumulative buckets, with their sum and count.
+  An observation is a bisect and a few additions under the lock, cheap enough to leave on for every batch.
+  """
+
+  type = "histogram"
+
+  def __init__(
+    self,
+    name: str,
+    description: str,
+    label_names: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+  ):
+    super().__init__(name, description, label_names)
+    self.buckets = tuple(sorted(buckets))
+    # per labels: the count of each bucket, the last one is +Inf, then the sum
+    self._values: dict[tuple, list[float]] = {}
+
+  def observe(self, value: float, **labels) -> None:
+    key = self._key(labels)
+    # a value equal to the bound falls into the bucket, 'le'
+    index = bisect_left(self.buckets, value)
+    with self._lock:
+      counts = self._values.get(key)
+      if counts is None:
+        counts = [0] * (len(self.buckets) + 2)
+        self._values[key] = counts
+      counts[index] += 1
+      counts[-1] += value
+
+  def time(self, **labels) -> "HistogramTimer":
+    """Observe the seconds spent in a 'with' block."""
+    return HistogramTimer(self, labels)
+
+  def value(self, **labels) -> float:
+    """The number of observations."""
+    counts = self._values.get(self._key(labels))
+    return sum(counts[:-1]) if counts is not None else 0
+
+  def total(self, **labels) -> float:
+    """The sum of the observed values."""
+    counts = self._values.get(self._key(labels))
+    return counts[-1] if counts is not None else 0
+
+  def quantile(self, q: float, **labels) -> float | None:
+    """
+    Estimate the 'q' quantile from the buckets, interpolated linearly within the bucket, like 'histogram_quantile'.
+    Values above the largest bound are estimated as the largest bound, None if nothing was observed.
+    """
+    with self._lock:
+      counts = list(self._values.get(self._key(labels), ()))
+    count = sum(counts[:-1])
+    if count == 0:
+      return None
+
+    rank = q * count
+    cumulative = 0
+    for i, bound in enumerate(self.buckets):
+      if cumulative + counts[i] >= rank and counts[i] > 0:
+        lower = self.buckets[i - 1] if i > 0 else 0
+        return lower + (bound - lower) * (rank - cumulative) / counts[i]
+      cumulative += counts[i]
+    return self.buckets[-1]
+
+  def samples(self) -> list[tuple[dict, float]]:
+    with self._lock:
+      items = [(key, list(counts)) for key, counts in self._values.items()]
+    return [(dict(zip(self.label_names, key)), sum(counts[:-1])) for key, counts in items]
+
+  def series(self) -> list[tuple[str, dict, float]]:
+    with self._lock:
+      items = [(key, list(counts)) for key, counts in self._values.items()]
+
+    series = []
+    for key, counts in items:
+      labels = dict(zip(self.label_names, key))
+      cumulative = 0
+      for bound, count in zip((*self.buckets, math.inf), counts):
+        cumulative += count
+        series.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+      series.append((f"{self.name}_sum", labels, counts[-1]))
+      series.append((f"{self.name}_count", labels, cumulative))
+    return series
+
+
+class HistogramTimer:
+
+  def __init__(self, histogram: Histogram, labels: dict):
+    self.histogram = histogram
+    self.labels = labels
+
+  def __enter__(self) -> "HistogramTimer":
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+_registry: dict[str, Metric] = {}
+_registry_lock = Lock()
+
+
+def _get_or_create(cls: type, name: str, description: str, label_names: tuple[str, ...], **options) -> Metric:
+  with _registry_lock:
+    metric = _registry.get(name)
+    if metric is None:
+      metric = cls(name, description, label_names, **options)
+      _registry[name] = metric
+    elif not isinstance(metric, cls):
+      raise ValueError(f"metric {name} is already registered as a {metric.type}")
+    return metric
+
+
+def counter(name: str, description: str, label_names: tuple[str, ...] = ()) -> Counter:
+  return _get_or_create(Counter, name, description, label_names)
+
+
+def gauge(name: str, description: str, label_names: tuple[str, ...] = ()) -> Gauge:
+  return _get_or_create(Gauge, name, description, label_names)
+
+
+def histogram(
+  name: str,
+  description: str,
+  label_names: tuple[str, ...] = (),
+  buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+) -> Histogram:
+  return _get_or_create(Histogram, name, description, label_names, buckets=buckets)
+
+
+def metrics() -> list[Metric]:
+  with _registry_lock:
+    return list(_registry.values())
+
+
+def snapshot() -> dict[str, float]:
+  """Flat view of every metric, e.g. for logging, labels are appended to the name, histograms by their count."""
+  values = {}
+  for metric in metrics():
+    for labels, value in metric.samples():
+      suffix = ",".join(f"{k}={v}" for k, v in labels.items())
+      values[f"{metric.name}{{{suffix}}}" if suffix else metric.name] = value
+  return values
+
+
+def exposition() -> str:
+  """Every metric in the Prometheus text format."""
+  lines = []
+  for metric in metrics():
+    lines.append(f"# HELP {metric.name} {_escape(metric.description, quote=False)}")
+    lines.append(f"# TYPE {metric.name} {metric.type}")
+    for name, labels, value in metric.series():
+      if labels:
+        rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        lines.append(f"{name}{{{rendered}}} {_format_value(value)}")
+      else:
+        lines.append(f"{name} {_format_value(value)}")
+  return "\n".join(lines) + "\n"
+
+
+def _format_value(value: float) -> str:
+  if math.isinf(value):
+    return "+Inf" if value > 0 else "-Inf"
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+
+def _escape(value, quote: bool = True) -> str:
+  value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+  return value.replace('"', '\\"') if quote else value
@@ -0,0 +1,41 @@
+import numpy as np
+import struct
+import json
+
+# Memory-mapped views of arrays on disk. The pages are shared by every process mapping the same file,
+# and they are copy-on-write, so the arrays are writable without touching the file.
+
+SAFETENSORS_DTYPES = {
+  "F64": np.float64,
+  "F32": np.float32,
+  "F16": np.float16,
+  "I64": np.int64,
+  "I32": np.int32,
+  "I16": np.int16,
+  "I8": np.int8,
+  "U8": np.uint8,
+  "BOOL": np.bool_,
+}
+
+
+def mmap_safetensors(filename: str) -> dict[str, np.ndarray]:
+  """Map every tensor of a safetensors file into memory, without reading it."""
+
+  with open(filename, "rb") as f:
+    # 8 bytes little endian header size, the json header, then the tensor data
+    (header_size,) = struct.unpack("<Q", f.read(8))
+    header = json.loads(f.read(header_size))
+  header.pop("__metadata__", None)
+
+  data = np.memmap(filename, dtype=np.uint8, mode="c", offset=8 + header_size)
+  tensors = {}
+  for name, info in header.items():
+    if info["dtype"] not in SAFETENSORS_DTYPES:
+      raise ValueError(f"tensor {name} has unsupported dtype {info['dtype']}")
+    start, end = info["data_offsets"]
+    tensors[name] = data[start:end].view(SAFETENSORS_DTYPES[info["dtype"]]).reshape(info["shape"])
+  return tensors
+
+
+def mmap_npy(filename: str) -> np.ndarray:
+  return np.load(filename, mmap_mode="c")
@@ -0,0 +1,53 @@
+from threading import Lock
+from utils import log_utils, metrics
+import time
+
+startup_seconds = metrics.gauge(
+  "analyzer_startup_seconds", 
+  "seconds from the process start until a component was ready", 
+  ("component",),
+)
+
+
+class Readiness:
+  """Tracks the startup of the named components of the process, it is ready once all of them are."""
+
+  def __init__(self, components: list[str], start_time: float | None = None):
+    self.log = log_utils.create_console_logger(
+      self.__class__.__name__,
+    )
+    self.start_time = start_time if start_time is not None else time.monotonic()
+    self.__pending = set(components)
+    self.__first_batch_done = False
+    self.__lock = Lock()
+
+  def set_ready(self, component: str) -> None:
+    seconds = time.monotonic() - self.start_time
+    with self.__lock:
+      self.__pending.discard(component)
+      all_ready = len(self.__pending) == 0
+
+    startup_seconds.set(seconds, component=component)
+    self.log.info(f"{component} ready after {seconds:.2f} seconds")
+    if all_ready:
+      startup_seconds.set(seconds, component="all")
+      self.log.info(f"all components ready after {seconds:.2f} seconds")
+
+  def is_ready(self) -> bool:
+    with self.__lock:
+      return len(self.__pending) == 0
+
+  def pending(self) -> list[str]:
+    with self.__lock:
+      return sorted(self.__pending)
+
+  def first_batch_done(self) -> None:
+    """Record the time to the first processed batch, only the first call counts."""
+    with self.__lock:
+      if self.__first_batch_done:
+        return
+      self.__first_batch_done = True
+
+    seconds = time.monotonic() - self.start_time
+    startup_seconds.set(seconds, component="first_batch")
+    self.log.info(f"first batch processed after {seconds:.2f} seconds")